@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la capa "Grilla de análisis": una capa GeoJSON por celda (implementación
+anterior) frente a una sola FeatureCollection con estilo por propiedad (add_grid_layer).
+
+Mide tiempo de generación del HTML y tamaño resultante para 10, 100 y 1000 celdas.
+
+Uso:
+    python benchmarks/bench_grid_layer.py --cells 10 100 1000
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import folium
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import box
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.png_map import add_grid_layer  # noqa: E402
+
+
+def make_grid(n_cells):
+    side = int(np.ceil(np.sqrt(n_cells)))
+    cells = [box(-74.0 + 0.1 * (i % side), 4.5 + 0.1 * (i // side), -73.9 + 0.1 * (i % side), 4.6 + 0.1 * (i // side)) for i in range(n_cells)]
+    return gpd.GeoDataFrame({"grid_id": range(1, n_cells + 1)}, geometry=cells, crs="EPSG:4326")
+
+
+def legacy_grid_layer(fg, grid_gdf, alert_grid_ids):
+    """Implementación anterior: un folium.GeoJson por fila de la grilla."""
+    for idx, row in grid_gdf.iterrows():
+        grid_id = row.get("grid_id", idx)
+        is_alerted = grid_id in alert_grid_ids
+        color = "red" if is_alerted else "black"
+        weight = 2.5 if is_alerted else 1.5
+        folium.GeoJson(
+            gpd.GeoDataFrame([row], crs="EPSG:4326"),
+            style_function=lambda x, c=color, w=weight: {
+                "color": c,
+                "weight": w,
+                "fillOpacity": 0.01 if c == "red" else 0.02,
+                "fillColor": c if c == "red" else "black"
+            },
+            popup=f"Grid {grid_id}" + (" - ALERTA" if is_alerted else "")
+        ).add_to(fg)
+
+
+def run(builder, grid_gdf, alert_grid_ids):
+    start = time.perf_counter()
+    m = folium.Map(location=[4.6, -73.9], zoom_start=10, tiles="CartoDB positron")
+    fg = folium.FeatureGroup(name="Grilla de análisis", show=True)
+    builder(fg, grid_gdf, alert_grid_ids)
+    fg.add_to(m)
+    html = m.get_root().render()
+    return time.perf_counter() - start, len(html.encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la capa de grilla (por celda vs FeatureCollection)")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10, 100, 1000], help="Tamaños de grilla a medir")
+    args = parser.parse_args()
+
+    print(f"{'celdas':>7} | {'por celda (s)':>13} {'KiB':>9} | {'una capa (s)':>12} {'KiB':>9} | {'speedup':>7}")
+    print("-" * 72)
+    for n_cells in args.cells:
+        grid_gdf = make_grid(n_cells)
+        alert_grid_ids = grid_gdf["grid_id"].iloc[: max(1, n_cells // 20)].tolist()
+        t_old, size_old = run(legacy_grid_layer, grid_gdf, alert_grid_ids)
+        t_new, size_new = run(add_grid_layer, grid_gdf, alert_grid_ids)
+        print(f"{n_cells:>7} | {t_old:>13.3f} {size_old / 1024:>9.1f} | {t_new:>12.3f} {size_new / 1024:>9.1f} | {t_old / t_new:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark de tamaño de los HTML de mapas según el modo de referencia de overlays PNG.
+
+Genera una grilla sintética con PNGs aleatorios para ambos periodos y construye el mapa
+DW con asset_mode='inline' y asset_mode='relative'. Falla (exit 1) si el HTML en modo
+'relative' supera el presupuesto de bytes por grilla, para detectar regresiones que
+vuelvan a incrustar imágenes en el HTML.
+
+Uso:
+    python benchmarks/bench_map_html_size.py --grids 25 --png-size 512
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+from PIL import Image
+from shapely.geometry import box
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.png_map import generar_mapa_png  # noqa: E402
+
+PERIODO = "2025-07-01"
+PERIODO_ANTERIOR = "2024-07-01"
+PARAMO = "paramo_benchmark"
+
+
+def build_fixture(base_dir, n_grids, png_size):
+    """Crea grilla GeoJSON y PNGs DW aleatorios para n_grids celdas."""
+    grilla_dir = base_dir / "grilla"
+    dw_dir = base_dir / "mapas" / "imagenes" / "dw"
+    grilla_dir.mkdir(parents=True, exist_ok=True)
+    dw_dir.mkdir(parents=True, exist_ok=True)
+
+    side = int(np.ceil(np.sqrt(n_grids)))
+    cells = [box(-74.0 + 0.1 * (i % side), 4.5 + 0.1 * (i // side), -73.9 + 0.1 * (i % side), 4.6 + 0.1 * (i // side)) for i in range(n_grids)]
+    grid = gpd.GeoDataFrame({"grid_id": range(1, n_grids + 1)}, geometry=cells, crs="EPSG:4326")
+    grid_path = grilla_dir / f"grid_{PARAMO}_10000m.geojson"
+    grid.to_file(grid_path, driver="GeoJSON")
+
+    rng = np.random.default_rng(0)
+    for grid_id in grid["grid_id"]:
+        for periodo in (PERIODO_ANTERIOR, PERIODO):
+            data = rng.integers(0, 255, size=(png_size, png_size, 4), dtype=np.uint8)
+            Image.fromarray(data, "RGBA").save(dw_dir / f"dw_grid_{grid_id}_{periodo}.png")
+
+    return grid_path, grid["grid_id"].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de tamaño de HTML de mapas (inline vs relative)")
+    parser.add_argument("--grids", type=int, default=25, help="Número de grillas alertadas")
+    parser.add_argument("--png-size", type=int, default=256, help="Lado de cada PNG en píxeles")
+    parser.add_argument("--max-bytes-per-grid", type=int, default=8000, help="Presupuesto de bytes de HTML por grilla en modo 'relative'")
+    args = parser.parse_args()
+
+    # generar_mapa_png imprime rutas relativas a la raíz del repositorio
+    with tempfile.TemporaryDirectory(dir=ROOT) as tmp:
+        base_dir = Path(tmp) / PARAMO
+        grid_path, grid_ids = build_fixture(base_dir, args.grids, args.png_size)
+
+        sizes = {}
+        for mode in ("inline", "relative"):
+            output_html = base_dir / "mapas" / f"dw_mes_{mode}.html"
+            generar_mapa_png(
+                paramo=PARAMO,
+                periodo=PERIODO,
+                tipo="dw",
+                grilla_path=grid_path,
+                imagenes_dir=base_dir / "mapas" / "imagenes",
+                output_html=output_html,
+                alert_grid_ids=grid_ids,
+                asset_mode=mode,
+            )
+            sizes[mode] = output_html.stat().st_size
+
+    print("\n=== Tamaño de HTML de mapas ===")
+    for mode, size in sizes.items():
+        print(f"  {mode:<9} {size / 1024:>10.1f} KiB  ({size / args.grids:>10.0f} B/grilla)")
+    print(f"  Reducción: {sizes['inline'] / max(sizes['relative'], 1):.1f}x")
+
+    budget = args.max_bytes_per_grid * args.grids
+    if sizes["relative"] > budget:
+        print(f"[FAIL] HTML 'relative' ({sizes['relative']} B) supera el presupuesto de {budget} B")
+        sys.exit(1)
+    print("[OK] HTML 'relative' dentro del presupuesto")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark del render del reporte: implementación anterior (regex recursivas y un dict
+combinado por elemento) frente a la plantilla compilada y cacheada (render_template).
+
+Usa report_template.html con cientos de páramos y verifica que ambas salidas sean idénticas.
+
+Uso:
+    python benchmarks/bench_render_report.py --paramos 100 500 1000 --repeat 5
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from src.reports.render_report import SECTION_PAT, TOKEN_PAT, render_template  # noqa: E402
+
+TEMPLATE = ROOT / "src" / "reports" / "report_template.html"
+
+
+def legacy_render_template(tpl, root):
+    """Implementación anterior de render_template."""
+    def _render_block(block, ctx):
+        def _section(m):
+            key, inner = m.group(1), m.group(2)
+            arr = ctx.get(key, [])
+            if not isinstance(arr, list):
+                return ""
+            out = []
+            for item in arr:
+                local = {**ctx, **(item if isinstance(item, dict) else {".": item})}
+                out.append(_render_block(inner, local))
+            return "".join(out)
+
+        out = SECTION_PAT.sub(_section, block)
+
+        def _token(m):
+            k = m.group(1)
+            return str(ctx.get(k, root.get(k, "")))
+        return TOKEN_PAT.sub(_token, out)
+
+    return _render_block(tpl, root)
+
+
+def make_data(n_paramos):
+    return {
+        "TITLE": "Reporte de páramos",
+        "MES": "Enero",
+        "ANIO": 2025,
+        "HEADER_IMG1": "data:image/png;base64," + "A" * 20000,
+        "HEADER_IMG2": "data:image/png;base64," + "B" * 20000,
+        "FOOTER_IMG": "data:image/png;base64," + "C" * 20000,
+        "TABLA_COMPLETA": "https://example.org/tabla.csv",
+        "PARAMOS": [
+            {
+                "NOMBRE_PARAMO": f"Páramo {i}",
+                "PERDIDA_BOSQUE_PARAMOS": round(i * 0.37, 2),
+                "GRILLA_CON_MAS_PERDIDA": i % 17,
+                "PERDIDA_BOSQUE_GRILLA_1": round(i * 0.11, 2),
+                "PERDIDA_MATORRAL_PARAMOS": round(i * 0.21, 2),
+                "GRILLA_CON_MAS_CAMBIO_5": i % 13,
+                "PERDIDA_MATORRAL_GRILLA_1": round(i * 0.05, 2),
+                "MAPA_DW_INTERACTIVO": f"paramo_{i}/mapas/dw_mes.html",
+                "MAPA_SENTINEL_INTERACTIVO": f"paramo_{i}/mapas/sentinel_mes.html",
+            }
+            for i in range(n_paramos)
+        ],
+    }
+
+
+def timeit(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del render del reporte (regex vs plantilla compilada)")
+    parser.add_argument("--paramos", type=int, nargs="+", default=[100, 500, 1000], help="Número de páramos en el reporte")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones (se reporta el mejor tiempo)")
+    args = parser.parse_args()
+
+    tpl = TEMPLATE.read_text(encoding="utf-8")
+    print(f"{'páramos':>8} | {'anterior (ms)':>13} | {'compilada (ms)':>14} | {'speedup':>7} | {'KiB':>8}")
+    print("-" * 64)
+    for n_paramos in args.paramos:
+        data = make_data(n_paramos)
+        t_old, html_old = timeit(lambda: legacy_render_template(tpl, data), args.repeat)
+        t_new, html_new = timeit(lambda: render_template(tpl, data), args.repeat)
+        if html_old != html_new:
+            raise SystemExit(f"Salida distinta con {n_paramos} páramos")
+        print(f"{n_paramos:>8} | {t_old * 1000:>13.1f} | {t_new * 1000:>14.1f} | {t_old / t_new:>6.1f}x | {len(html_new.encode('utf-8')) / 1024:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,22 @@ import argparse
 import os
 import shutil
 from pathlib import Path
-from src.config import AOI_DIR, OUTPUTS_BASE, HEADER_IMG1_PATH, HEADER_IMG2_PATH, FOOTER_IMG_PATH, GRID_SIZE, LOOKBACK_DAYS, USE_GCS, GCS_BUCKET_NAME, GCS_OUTPUTS_BASE, GCS_PREFIX, get_paramo_geojson, download_altiplano_aoi_from_gcs
-from src.dw_utils import get_dynamic_world_image, compute_transitions, get_alert_grids, generate_coverage_csv
+from src.config import SCREENING_ENABLED, INCREMENTAL_RECOMPUTE, AOI_DIR, LOGOS_DIR, OUTPUTS_BASE, HEADER_IMG1_PATH, HEADER_IMG2_PATH, FOOTER_IMG_PATH, GRID_SIZE, BASELINE_MONTHS, GRID_ROLLUP_BASE_SIZE, GRID_ROLLUP_SIZES, HOTSPOT_REFINEMENT, BATCH_ALL_AOIS, LOOKBACK_DAYS, USE_GCS, REPORT_ASSET_MODE, MAP_ASSET_MODE, get_paramo_geojson, download_altiplano_aoi_from_gcs
+from src.dw_utils import get_dynamic_world_image, compute_transitions, get_alert_grids, generate_coverage_csv, write_coverage_csv, compute_batched_statistics, compute_cell_statistics, compute_baseline_statistics, incremental_enabled, aoi_transition_totals, compute_spectral_statistics
+from src.grid_hierarchy import compute_grid_levels, level_table
+from src.hotspots import refine_hotspots, hotspot_table
+from src.alert_utils import is_all_grids_aoi
 from src.maps_utils import generate_maps
 from src.png_map import get_display_grid_id
 from src.reports.render_report import render
-from src.aux_utils import log, save_json, create_grid
-from src.gcs_utils import upload_directory_to_gcs, upload_file_to_gcs, get_public_url, image_to_base64
+from src.aux_utils import log, save_json
+from src.aoi_registry import register_aoi, get_aoi, clear_registry
+from src.output_store import get_output_store
+from src.sharding import resolve_task, execution_id, assign_shards, write_partial, load_partials
+from src.ee_accounting import set_context as set_ee_context, budget_allows, export as export_ee_calls
+from src.cost_model import AOICost, CostModel, load_history, schedule, update_history, cost_report
+from src.input_cache import mirror_gcs_prefixes, resolve_input, list_mirrored
+from src.reports.report_assets import asset_ref
 from datetime import datetime
 import locale
 import gcsfs
@@ -20,66 +29,134 @@ try:
 except:
     locale.setlocale(locale.LC_TIME, "es_CO.UTF-8")
     
-def process_aoi(aoi_path, date_before, current_date, anio, mes, out_dir, period_name):
-    aoi_name = os.path.splitext(os.path.basename(aoi_path))[0]
-    log(f"Procesando AOI: {aoi_name}", "info")
-
-
-    # Crear estructura de carpetas para cada páramo
-    base_dir = os.path.join(out_dir, aoi_name)
-    mapas_dir = os.path.join(base_dir, "mapas")
-    imagenes_dir = os.path.join(mapas_dir, "imagenes")
-    dw_dir = os.path.join(imagenes_dir, "dw")
-    sentinel_dir = os.path.join(imagenes_dir, "sentinel")
-    for d in [base_dir, mapas_dir, imagenes_dir, dw_dir, sentinel_dir]:
-        os.makedirs(d, exist_ok=True)
-    paths = {
-        "grilla": os.path.join(base_dir, "grilla"),
-        "imagenes": imagenes_dir,
-        "comparacion": os.path.join(base_dir, "comparacion"),
-        "mapas": mapas_dir
+def aoi_keys(aoi_name):
+    """Claves de los artefactos del páramo dentro del store del periodo (local o GCS)."""
+    return {
+        "grilla": f"{aoi_name}/grilla",
+        "comparacion": f"{aoi_name}/comparacion",
+        "mapas": f"{aoi_name}/mapas"
     }
-    for p in paths.values():
-        os.makedirs(p, exist_ok=True)
 
-    # Copiar AOI base local a la carpeta del páramo si no existe (tanto en grilla como en la raíz del páramo)
+def register_paramo(aoi_path, out_dir, store):
+    """Registra el AOI y su grilla (una vez por ejecución) y copia el AOI base al store."""
+    aoi_name = os.path.splitext(os.path.basename(aoi_path))[0]
+    keys = aoi_keys(aoi_name)
+    grid_key = f"{keys['grilla']}/grid_{aoi_name}_{GRID_SIZE}m.geojson"
+    grid_path = os.path.join(out_dir, grid_key)
+    registered = get_aoi(aoi_name, grid_path)
+    if registered is not None:
+        return registered
+
+    # Copiar AOI base local a la carpeta del páramo (tanto en grilla como en la raíz del páramo)
     from src.config import LOCAL_AOI
     aoi_base_name = os.path.basename(aoi_path)
     aoi_local_path = os.path.join(LOCAL_AOI, aoi_base_name)
-    aoi_target_grilla = os.path.join(paths["grilla"], aoi_base_name)
-    aoi_target_root = os.path.join(out_dir, aoi_name, aoi_base_name)
-    import shutil
-    for target in [aoi_target_grilla, aoi_target_root]:
-        if not os.path.exists(target) and os.path.exists(aoi_local_path):
-            shutil.copy2(aoi_local_path, target)
-            log(f"AOI local copiado a: {target}", "info")
-
-    # Crear grilla de análisis si no existe
-    grid_path = os.path.join(paths["grilla"], f"grid_{aoi_name}_{GRID_SIZE}m.geojson")
-    if not os.path.exists(grid_path):
-        grid = create_grid(aoi_path, GRID_SIZE)
-        grid.to_file(grid_path, driver="GeoJSON")
+    if os.path.exists(aoi_local_path):
+        for key in [f"{keys['grilla']}/{aoi_base_name}", f"{aoi_name}/{aoi_base_name}"]:
+            store.put_file(aoi_local_path, key)
+            log(f"AOI local copiado a: {key}", "info")
+
+    # Cargar AOI y grilla una sola vez (se crea la grilla si no existe y se escribe en el store)
+    aoi = register_aoi(aoi_path, grid_path, name=aoi_name, grid_size=GRID_SIZE, store=store, grid_key=grid_key)
     # Si la grilla está vacía, asegúrate de que el AOI base esté en la carpeta raíz y en grilla
-    try:
-        import geopandas as gpd
-        gdf_grid = gpd.read_file(grid_path)
-        if gdf_grid.empty:
-            log(f"[WARN] Grilla vacía para {aoi_name}. Se usará el polígono del AOI para overlays.", "warning")
-    except Exception as e:
-        log(f"[ERROR] No se pudo leer la grilla para {aoi_name}: {e}", "error")
+    if aoi.grid.empty:
+        log(f"[WARN] Grilla vacía para {aoi_name}. Se usará el polígono del AOI para overlays.", "warning")
+    return aoi
+
+def process_aoi(aoi_path, date_before, current_date, anio, mes, out_dir, period_name, store, precomputed=None, cost=None):
+    """
+    date_before: fecha de la línea base o lista de fechas. La primera define el reporte, los mapas y
+                 las alertas; las demás escriben tablas adicionales (*_vs_<fecha>.csv)
+    precomputed: resultado de compute_batched_statistics para este AOI (mosaicos DW, transiciones y
+                 coberturas ya calculados en la reducción conjunta de todos los páramos)
+    cost: AOICost donde se registran los tiempos por etapa, celdas y alertas
+    """
+    baselines = list(dict.fromkeys([date_before] if isinstance(date_before, str) else date_before))
+    date_before = baselines[0]
+    aoi_name = os.path.splitext(os.path.basename(aoi_path))[0]
+    log(f"Procesando AOI: {aoi_name}", "info")
+    cost = cost or AOICost(aoi_name)
+    cost.start()
+    set_ee_context(aoi=aoi_name, stage="mosaicos")
+    keys = aoi_keys(aoi_name)
+    aoi = register_paramo(aoi_path, out_dir, store)
+    cost.cells = len(aoi.grid)
 
     # Crear capas de DW y calcular transiciones
-    dw_before = get_dynamic_world_image(aoi_path, date_before)
-    dw_current = get_dynamic_world_image(aoi_path, current_date)
-    df_trans = compute_transitions(dw_before, dw_current, grid_path)
+    if precomputed:
+        dw_before, dw_current = precomputed["dw_before"], precomputed["dw_current"]
+    else:
+        dw_before = get_dynamic_world_image(aoi, date_before)
+        dw_current = get_dynamic_world_image(aoi, current_date)
+    # Un mosaico por línea base distinta; el del periodo actual se comparte entre todos los pares
+    dw_baselines = {date_before: dw_before}
+    for baseline in baselines[1:]:
+        dw_baselines[baseline] = get_dynamic_world_image(aoi, baseline)
+    cost.lap("mosaicos")
+    set_ee_context(stage="estadisticas")
+
+    # Grillas anidadas (opcional): una sola reducción en la grilla base, sumada en cada nivel
+    levels = {}
+    if GRID_ROLLUP_SIZES and not is_all_grids_aoi(aoi_name) and not aoi.grid.empty:
+        levels = compute_grid_levels(
+            dw_before, dw_current, aoi, GRID_ROLLUP_BASE_SIZE, GRID_ROLLUP_SIZES,
+            reference_grids={GRID_SIZE: aoi.grid}
+        )
+        for size, level in levels.items():
+            store.write_text(f"{keys['grilla']}/grid_{aoi_name}_{size}m.geojson", level["grid"].to_json(drop_id=True))
+            with store.open(f"{keys['comparacion']}/{aoi_name}_niveles_{size}m.csv") as f:
+                level_table(level).to_csv(f, index=False)
+    # Si GRID_SIZE es uno de los niveles, sus tablas reemplazan las reducciones por celda. Si no se
+    # pudo mapear a la grilla del registro, compute_grid_levels lo omite y corre la reducción habitual
+    primary_level = levels.get(GRID_SIZE)
+    if levels and GRID_SIZE in GRID_ROLLUP_SIZES and primary_level is None:
+        log(f"⚠️ Nivel {GRID_SIZE} m sin grid_id de referencia: se usa la reducción por celda", "warning")
+
+    # Varias líneas base: todos los pares pendientes en una sola reducción por lotes
+    baseline_stats = {}
+    if len(dw_baselines) > 1 and not aoi.grid.empty:
+        pending = {d: img for d, img in dw_baselines.items() if d != date_before or not (primary_level or precomputed)}
+        try:
+            baseline_stats = compute_baseline_statistics(dw_current, pending, aoi, current_date=current_date)
+        except Exception as e:
+            log(f"⚠️ Error calculando las líneas base adicionales para {aoi_name}: {e}", "warning")
+        if date_before in baseline_stats:
+            precomputed = {"dw_before": dw_before, "dw_current": dw_current, **baseline_stats.pop(date_before)}
+
+    # Recálculo incremental: solo se reducen las celdas con escenas DW nuevas desde la ejecución anterior
+    if not primary_level and not precomputed and incremental_enabled() and not aoi.grid.empty:
+        try:
+            precomputed = compute_cell_statistics(dw_before, dw_current, aoi, date_before, current_date)
+        except Exception as e:
+            log(f"⚠️ Falló el recálculo incremental para {aoi_name}, se reduce cada celda: {e}", "warning")
+
+    if primary_level:
+        df_trans = primary_level["transitions"]
+    elif precomputed:
+        df_trans = precomputed["transitions"]
+    else:
+        df_trans = compute_transitions(dw_before, dw_current, aoi)
     
     # === Estadísticas agregadas ===
     total_perdida_bosque = df_trans["n_1_a_otro"].sum()
     total_perdida_matorral = df_trans["n_5_a_otro_no1"].sum()
+    # Con screening la tabla mezcla celdas a 10 m y estimaciones gruesas: los totales del páramo se
+    # recalculan a 10 m en una sola reducción y la grilla máxima se elige entre las celdas exactas
+    totales_estimados = False
+    df_max = df_trans
+    if "exacto" in df_trans and not df_trans["exacto"].all():
+        df_max = df_trans[df_trans["exacto"]]
+        try:
+            totals = aoi_transition_totals(dw_before, dw_current, aoi)
+            total_perdida_bosque = totals.get("change_1") or 0
+            total_perdida_matorral = totals.get("change_5") or 0
+        except Exception as e:
+            totales_estimados = True
+            log(f"⚠️ {aoi_name}: totales exactos no disponibles, se reportan estimaciones del screening: {e}", "warning")
 
         # Grilla con mayor pérdida de bosque
-    if total_perdida_bosque > 0:
-        fila_bosque_max = df_trans.loc[df_trans["n_1_a_otro"].idxmax()]
+    if total_perdida_bosque > 0 and not df_max.empty:
+        fila_bosque_max = df_max.loc[df_max["n_1_a_otro"].idxmax()]
         grid_id_bosque = int(fila_bosque_max["grid_id"])
         # Remapear grid_id si es Altiplano (0 → 1)
         grilla_max_bosque = get_display_grid_id(grid_id_bosque, aoi_name)
@@ -88,8 +165,8 @@ def process_aoi(aoi_path, date_before, current_date, anio, mes, out_dir, period_
         grilla_max_bosque, perdida_bosque_max = None, 0
 
         # Grilla con mayor cambio de matorral
-    if total_perdida_matorral > 0:
-        fila_mat_max = df_trans.loc[df_trans["n_5_a_otro_no1"].idxmax()]
+    if total_perdida_matorral > 0 and not df_max.empty:
+        fila_mat_max = df_max.loc[df_max["n_5_a_otro_no1"].idxmax()]
         grid_id_mat = int(fila_mat_max["grid_id"])
         # Remapear grid_id si es Altiplano (0 → 1)
         grilla_max_mat = get_display_grid_id(grid_id_mat, aoi_name)
@@ -98,63 +175,95 @@ def process_aoi(aoi_path, date_before, current_date, anio, mes, out_dir, period_
         grilla_max_mat, perdida_mat_max = None, 0
 
     # Guardar transiciones a CSV
-    csv_path = os.path.join(paths["comparacion"], f"{aoi_name}_transiciones.csv")
-    df_trans.to_csv(csv_path, index=False)
+    with store.open(f"{keys['comparacion']}/{aoi_name}_transiciones.csv") as f:
+        df_trans.to_csv(f, index=False)
     
     # Generar CSV de coberturas (clases DW en t1 y t2, índices de Sentinel)
-    csv_coverage_path = os.path.join(paths["comparacion"], f"{aoi_name}_coberturas.csv")
+    csv_coverage_key = f"{keys['comparacion']}/{aoi_name}_coberturas.csv"
     try:
-        generate_coverage_csv(dw_before, dw_current, grid_path, date_before, current_date, csv_coverage_path)
+        if primary_level or precomputed:
+            df_coverage = (primary_level or precomputed)["coverage"]
+            if primary_level:
+                # Los niveles no suman índices espectrales (no son aditivos): se reducen en la grilla del registro
+                try:
+                    df_spectral = compute_spectral_statistics(aoi, date_before, current_date)
+                    if df_spectral is not None:
+                        df_coverage = df_coverage.merge(df_spectral, on="grid_id", how="left")
+                except Exception as e:
+                    log(f"⚠️ Índices espectrales no disponibles para {aoi_name}: {e}", "warning")
+            write_coverage_csv(df_coverage, csv_coverage_key, store=store)
+        else:
+            df_coverage = generate_coverage_csv(dw_before, dw_current, aoi, date_before, current_date, csv_coverage_key, store=store)
     except Exception as e:
+        df_coverage = None
         log(f"⚠️ Error generando CSV de coberturas para {aoi_name}: {e}", "warning")
 
+    # Una tabla de transiciones y una de coberturas por cada línea base adicional
+    for baseline, stats in baseline_stats.items():
+        with store.open(f"{keys['comparacion']}/{aoi_name}_transiciones_vs_{baseline}.csv") as f:
+            stats["transitions"].to_csv(f, index=False)
+        write_coverage_csv(stats["coverage"], f"{keys['comparacion']}/{aoi_name}_coberturas_vs_{baseline}.csv", store=store)
+
+    cost.lap("estadisticas")
+    set_ee_context(stage="mapas")
+
     #sentinel_tif = os.path.join(paths["imagenes"], f"sentinel_rgb_{date_before}_a_{current_date}.tif")
     #if not os.path.exists(sentinel_tif):
         #download_sentinel_rgb_period(grid_path, date_before, current_date, sentinel_tif)
 
-    # Generar PNGs por grilla y mapas interactivos
-    maps_info = generate_maps(
-        aoi_path,
-        grid_path,
-        paths["mapas"],
-        date_before,
-        current_date,
-        anio,
-        month_str,      
-        LOOKBACK_DAYS,
-        dw_before=dw_before,
-        dw_current=dw_current,
-        df_transitions=df_trans,
-        aoi_name=aoi_name  # Pasar nombre del AOI para lógica de Altiplano
-    )
+    # URL pública de la carpeta de mapas (para los overlays en MAP_ASSET_MODE = "url")
+    map_asset_base_url = store.url(keys["mapas"]) if USE_GCS else None
+
+    # Generar PNGs por grilla y mapas interactivos. Los PNGs se post-procesan en disco, por lo que
+    # la carpeta de mapas se prepara en staging (con GCS: carpeta temporal que se sube al terminar).
+    # Fuera del modo inline los HTML solo referencian las copias de assets/: imagenes/ no se publica
+    map_exclude = ("imagenes",) if MAP_ASSET_MODE != "inline" else ()
+    with store.staging(keys["mapas"], exclude=map_exclude) as mapas_dir:
+        maps_info = generate_maps(
+            aoi_path,
+            aoi,
+            str(mapas_dir),
+            date_before,
+            current_date,
+            anio,
+            month_str,      
+            LOOKBACK_DAYS,
+            dw_before=dw_before,
+            dw_current=dw_current,
+            df_transitions=df_trans,
+            aoi_name=aoi_name,  # Pasar nombre del AOI para lógica de Altiplano
+            asset_base_url=map_asset_base_url,
+            df_coverage=df_coverage  # Coberturas en memoria para decidir qué grillas exportan PNGs
+        )
+        # Claves de los mapas dentro del store
+        maps_keys = {
+            k: f"{keys['mapas']}/{os.path.relpath(v, mapas_dir)}".replace("\\", "/")
+            for k, v in maps_info.items()
+        }
     
+    cost.lap("mapas")
+    set_ee_context(stage="focos")
+
     # === Seleccionar grillas para alertar (enfoque híbrido) ===
     alert_grids_df, alert_grid_ids = get_alert_grids(df_trans, aoi_name)
+    cost.alerts = len(alert_grid_ids)
+
+    # Focos de cambio dentro de las grillas alertadas (tabla + GeoJSON enlazados por grid_id)
+    if HOTSPOT_REFINEMENT and alert_grid_ids and budget_allows("focos"):
+        try:
+            hotspots = refine_hotspots(dw_before, dw_current, aoi, alert_grid_ids, df_trans)
+            store.write_text(f"{keys['grilla']}/{aoi_name}_focos.geojson", hotspots.to_json(drop_id=True))
+            with store.open(f"{keys['comparacion']}/{aoi_name}_focos.csv") as f:
+                hotspot_table(hotspots).to_csv(f, index=False)
+        except Exception as e:
+            log(f"⚠️ Error refinando focos de cambio para {aoi_name}: {e}", "warning")
     
+    cost.lap("focos")
+
     # Los mapas interactivos ya se generan dentro de generate_maps() con los overlays PNG
 
-    # Si está habilitado GCS, subir archivos
-    if USE_GCS:
-        log(f"📤 Subiendo {aoi_name} a GCS...", "info")
-        gcs_prefix = f"{GCS_PREFIX}/{period_name}/{aoi_name}"
-        local_aoi_dir = os.path.join(out_dir, aoi_name)
-        
-        # Subir todo el directorio del AOI
-        uploaded = upload_directory_to_gcs(local_aoi_dir, GCS_BUCKET_NAME, gcs_prefix)
-        
-        # Convertir rutas de mapas a URLs públicas
-        relative_maps = {}
-        for k, local_path in maps_info.items():
-            # Calcular blob_name basado en la estructura de archivos
-            rel_to_aoi = os.path.relpath(local_path, local_aoi_dir).replace("\\", "/")
-            blob_name = f"{gcs_prefix}/{rel_to_aoi}"
-            relative_maps[k] = get_public_url(GCS_BUCKET_NAME, blob_name)
-    else:
-        # Hacer rutas relativas al archivo HTML principal del periodo
-        relative_maps = {
-            k: os.path.relpath(v, start=out_dir)
-            for k, v in maps_info.items()
-        }
+    # URLs públicas (GCS) o rutas relativas al HTML principal del periodo (local)
+    relative_maps = {k: store.url(key) for k, key in maps_keys.items()}
 
     # Generar resultado final
     # Remover prefijo "paramo_" y formatear nombre
@@ -170,13 +279,82 @@ def process_aoi(aoi_path, date_before, current_date, anio, mes, out_dir, period_
         "MAPA_DW_INTERACTIVO": relative_maps.get("MAPA_DW_INTERACTIVO", ""),
         "MAPA_SENTINEL_INTERACTIVO": relative_maps.get("MAPA_SENTINEL_INTERACTIVO", "")
     }
+    # Celdas reducidas en esta ejecución frente a las reutilizadas (recálculo incremental)
+    if precomputed and "recomputed" in precomputed:
+        result["CELDAS_RECALCULADAS"] = precomputed["recomputed"]
+        result["CELDAS_TOTALES"] = precomputed["cells"]
+    if totales_estimados:
+        result["TOTALES_ESTIMADOS"] = True
+    # Celdas cuya reducción falló aun después de la cola de reintentos (quedan con NaN en los CSV)
+    if "fallida" in df_trans:
+        result["CELDAS_FALLIDAS"] = int(df_trans["fallida"].sum())
 
     return result
 
+def build_report(entries, anio, mes, month_str, store, history_store=None, history=None):
+    """
+    Arma reporte_paramos_{anio}_{mes}.json/html a partir de las entradas {"aoi", "result", "costo"}
+    de process_aoi (en orden de nombre de AOI), escribe costos_aoi.csv (predicho vs real) y
+    actualiza el historial de costos.
+    """
+    entries = sorted(entries, key=lambda e: e["aoi"])
+    results = [e["result"] for e in entries]
+    n_cells = sum(r.get("CELDAS_TOTALES", 0) for r in results)
+    screening_status = "screening activo" if SCREENING_ENABLED else "screening inactivo"
+    if n_cells:
+        n_recomputed = sum(r.get("CELDAS_RECALCULADAS", 0) for r in results)
+        log(f"♻️ Celdas recalculadas en la ejecución: {n_recomputed}/{n_cells} ({n_recomputed / n_cells:.0%}, {screening_status})", "success")
+    else:
+        log(f"♻️ Recálculo incremental {'sin registro disponible' if INCREMENTAL_RECOMPUTE else 'desactivado'} ({screening_status})", "info")
+    n_failed = sum(r.get("CELDAS_FALLIDAS", 0) for r in results)
+    if n_failed:
+        failed_aois = [r["NOMBRE_PARAMO"] for r in results if r.get("CELDAS_FALLIDAS")]
+        log(f"✗ {n_failed} celdas fallidas tras los reintentos en: {', '.join(failed_aois)}", "error")
+
+    # Los logos se guardan como referencias (asset://) y se resuelven al renderizar
+    json_final = {
+        "MES": month_str,
+        "ANIO": anio,
+        "HEADER_IMG1": asset_ref("header_img1"),
+        "HEADER_IMG2": asset_ref("header_img2"),
+        "FOOTER_IMG": asset_ref("footer_img"),
+        "ASSETS": {
+            "header_img1": HEADER_IMG1_PATH,
+            "header_img2": HEADER_IMG2_PATH,
+            "footer_img": FOOTER_IMG_PATH
+        },
+        "PARAMOS": results
+    }
+
+    json_key = f"reporte_paramos_{anio}_{mes}.json"
+    save_json(json_final, json_key, store=store)
+
+    BASE_DIR = Path(__file__).resolve().parent
+    tpl_path = BASE_DIR / "src" / "reports" / "report_template.html"
+    html_key = f"reporte_paramos_{anio}_{mes}.html"
+
+    render(Path(tpl_path), None, html_key, data=json_final, store=store, asset_mode=REPORT_ASSET_MODE)
+    log("Reporte HTML generado correctamente.", "success")
+
+    records = [e["costo"] for e in entries if e.get("costo")]
+    try:
+        with store.open("costos_aoi.csv") as f:
+            cost_report(records).to_csv(f, index=False)
+        if history_store is not None:
+            update_history(history_store, records, history=history)
+    except Exception as e:
+        log(f"⚠️ No se pudo guardar el reporte de costos: {e}", "warning")
+    return html_key
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pipeline de análisis Dynamic World interanual por mes")
     parser.add_argument("--anio", type=int, required=False, default=None, help="Año en formato YYYY (por ejemplo, 2025). Si no se especifica, usa el mes anterior al actual.")
     parser.add_argument("--mes", type=int, required=False, default=None, help="Mes en formato 1–12. Si no se especifica, usa el mes anterior al actual.")
+    parser.add_argument("--lineas_base", type=int, nargs="+", default=None, help="Meses hacia atrás de cada línea base (ej: 12 1 24). La primera define el reporte. Por defecto BASELINE_MONTHS.")
+    parser.add_argument("--tarea", type=int, default=None, help="Índice de la tarea en ejecución por fragmentos (por defecto CLOUD_RUN_TASK_INDEX o 0)")
+    parser.add_argument("--tareas", type=int, default=None, help="Número de tareas (por defecto CLOUD_RUN_TASK_COUNT o 1)")
+    parser.add_argument("--ejecucion", default=None, help="Identificador de la ejecución para los parciales (por defecto CLOUD_RUN_EXECUTION)")
+    parser.add_argument("--fusionar", action="store_true", help="Solo arma el reporte a partir de los parciales de las --tareas tareas")
     args = parser.parse_args()
     
     # Si no se especifican año y mes, calcular el mes anterior automáticamente
@@ -196,9 +374,21 @@ if __name__ == "__main__":
 
     #current_date, date_before = get_semester_dates(args.semestre, args.anio)
     current_date = datetime(anio, mes, 1).strftime("%Y-%m-%d")
-    date_before = datetime(anio - 1, mes, 1).strftime("%Y-%m-%d")
+    baseline_months = args.lineas_base or BASELINE_MONTHS
+    baseline_dates = []
+    for months_back in baseline_months:
+        y, m = divmod(anio * 12 + mes - 1 - months_back, 12)
+        baseline_dates.append(datetime(y, m + 1, 1))
+    date_before = baseline_dates[0].strftime("%Y-%m-%d")
     
-    log(f"📆 Comparando {month_str} {anio - 1} ↔ {month_str} {anio}", "info")
+    log(f"📆 Comparando {baseline_dates[0].strftime('%B').capitalize()} {baseline_dates[0].year} ↔ {month_str} {anio}", "info")
+    if len(baseline_dates) > 1:
+        log(f"📆 Líneas base adicionales: {', '.join(d.strftime('%Y-%m') for d in baseline_dates[1:])}", "info")
+
+    # Ejecución por fragmentos: cada tarea procesa un subconjunto de páramos y escribe parciales
+    task_index, task_count = resolve_task(args.tarea, args.tareas)
+    sharded = task_count > 1
+    run_id = execution_id(args.ejecucion, task_count)
 
     # Limpieza solo del periodo actual antes de procesar
     period_name = f"{anio}_{mes}"
@@ -212,23 +402,52 @@ if __name__ == "__main__":
             func(path)
         except Exception as e:
             print(f"[WARN] No se pudo borrar {path}: {e}")
-    if os.path.exists(period_dir):
+    # Con varias tareas no se limpia: otras tareas pueden estar escribiendo en la misma carpeta
+    if os.path.exists(period_dir) and not sharded and not args.fusionar:
         import shutil
         print(f"[INFO] Limpiando carpeta del periodo: {period_dir}")
         shutil.rmtree(period_dir, onerror=on_rm_error)
     os.makedirs(period_dir, exist_ok=True)
 
+    # Destino de los artefactos del periodo: directo a GCS (USE_GCS) o a period_dir
+    store = get_output_store(period_name, period_dir)
+    # Historial de costos por AOI, compartido entre periodos (se actualiza solo al armar el reporte)
+    history_store = get_output_store("historial", os.path.join(OUTPUTS_BASE, "historial"))
+    history = load_history(history_store)
+
+    if args.fusionar:
+        entries, missing = load_partials(store, task_count, execution=run_id)
+        if missing:
+            log(f"[ERROR] Faltan los parciales de las tareas {missing} de {task_count}", "error")
+            raise SystemExit(1)
+        html_key = build_report(entries, anio, mes, month_str, store, history_store, history)
+        log(f"✅ Reporte fusionado de {task_count} tareas: {store.url(html_key)}", "success")
+        raise SystemExit(0)
+
+    # Sincronizar insumos estáticos (AOIs, logos) a la caché local; las lecturas posteriores son locales
+    if AOI_DIR.startswith("gs://"):
+        try:
+            mirror_gcs_prefixes([AOI_DIR, LOGOS_DIR])
+        except Exception as e:
+            log(f"[WARN] No se pudo sincronizar la caché de insumos, se leerá desde GCS: {e}", "warning")
+
     # Descargar AOI de Altiplano desde GCS y guardarlo en la estructura local
     try:
         log("📥 Descargando AOI Altiplano desde GCS...", "info")
-        download_altiplano_aoi_from_gcs(OUTPUTS_BASE, anio, mes)
+        download_altiplano_aoi_from_gcs(OUTPUTS_BASE, anio, mes, source_path=resolve_input(f"{AOI_DIR}/paramo_altiplano.geojson"))
     except Exception as e:
         log(f"[WARN] No se pudo descargar AOI Altiplano: {e}", "warning")
         log("⏭️ Continuando sin Altiplano...", "warning")
 
     # Listar archivos GeoJSON desde GCS o local
     # Listar nombres base de páramos (sin extensión)
-    if AOI_DIR.startswith("gs://"):
+    mirrored_aois = list_mirrored(AOI_DIR)
+    if mirrored_aois:
+        geojson_files = sorted(
+            local for uri, local in mirrored_aois.items()
+            if uri.endswith(".geojson") and "paramo_" in os.path.basename(uri)
+        )
+    elif AOI_DIR.startswith("gs://"):
         fs = gcsfs.GCSFileSystem()
         aoi_dir_clean = AOI_DIR.replace("gs://", "")
         all_files = fs.ls(aoi_dir_clean)
@@ -238,57 +457,67 @@ if __name__ == "__main__":
         paramo_names = [os.path.splitext(f)[0] for f in os.listdir(AOI_DIR) if f.startswith("paramo_")]
         geojson_files = [get_paramo_geojson(name) for name in paramo_names]
     
-    results = []
+    # Más costosos primero; el mismo costo predicho balancea las tareas
+    geojson_files, aoi_costs = schedule(geojson_files, CostModel(history))
+    if sharded:
+        geojson_files = assign_shards(geojson_files, task_count, cost_fn=lambda p: aoi_costs[p].predicted)[task_index]
+        log(f"🧩 Tarea {task_index + 1}/{task_count}: {len(geojson_files)} páramos ({', '.join(os.path.basename(p) for p in geojson_files)})", "info")
+
+    # Modo conjunto: mosaicos sobre la unión de los páramos y una sola reducción por lotes para todas las celdas
+    precomputed = {}
+    if BATCH_ALL_AOIS and len(geojson_files) > 1:
+        batch_aois = []
+        for p in geojson_files:
+            try:
+                batch_aois.append(register_paramo(p, period_dir, store))
+            except Exception as e:
+                log(f"[WARN] No se pudo registrar {p} para el modo conjunto: {e}", "warning")
+        set_ee_context(aoi="(conjunto)", stage="estadisticas")
+        try:
+            precomputed = compute_batched_statistics([a for a in batch_aois if not a.grid.empty], date_before, current_date)
+        except Exception as e:
+            log(f"[WARN] Falló la reducción conjunta, se procesa cada páramo por separado: {e}", "warning")
+
+    entries = []
     for p in geojson_files:
         try:
-            results.append(process_aoi(p, date_before, current_date, anio, mes, period_dir, period_name))
+            aoi_name = os.path.splitext(os.path.basename(p))[0]
+            cost = aoi_costs[p]
+            result = process_aoi(p, [d.strftime("%Y-%m-%d") for d in baseline_dates], current_date, anio, mes, period_dir, period_name, store, precomputed=precomputed.get(aoi_name), cost=cost)
+            entries.append({"aoi": aoi_name, "result": result, "costo": cost.to_record()})
         except Exception as e:
             log(f"[ERROR] Falló el procesamiento de {p}: {e}", "error")
+    # Las grillas y geometrías EE de los páramos ya no se usan (el reporte solo lee entries)
+    clear_registry()
 
-    # Convertir logos a base64 (funciona tanto para GCS como local)
-    log("🖼 Convirtiendo logos a base64...", "info")
-    header_img1_b64 = image_to_base64(HEADER_IMG1_PATH)
-    header_img2_b64 = image_to_base64(HEADER_IMG2_PATH)
-    footer_img_b64 = image_to_base64(FOOTER_IMG_PATH)
-    
-    # Generar JSON y HTML localmente con logos en base64
-    json_final = {
-        "MES": month_str,
-        "ANIO": anio,
-        "HEADER_IMG1": header_img1_b64,
-        "HEADER_IMG2": header_img2_b64,
-        "FOOTER_IMG": footer_img_b64,
-        "PARAMOS": results
-    }
+    # Llamadas a Earth Engine de este proceso (una tabla por tarea en ejecución por fragmentos)
+    try:
+        export_ee_calls(store, f"ee_llamadas_tarea_{task_index:03d}" if sharded else "ee_llamadas")
+    except Exception as e:
+        log(f"⚠️ No se pudo exportar la contabilidad de Earth Engine: {e}", "warning")
 
-    json_path = os.path.join(period_dir, f"reporte_paramos_{anio}_{mes}.json")
-    save_json(json_final, json_path)
+    html_key = None
+    if sharded:
+        # La última tarea en terminar (la que ve todos los parciales) arma el reporte
+        write_partial(store, task_index, task_count, entries, execution=run_id)
+        all_entries, missing = load_partials(store, task_count, execution=run_id)
+        if missing:
+            log(f"🧩 Parcial de la tarea {task_index} guardado; faltan {len(missing)} tareas (o ejecutar con --fusionar)", "info")
+        else:
+            html_key = build_report(all_entries, anio, mes, month_str, store, history_store, history)
+    else:
+        html_key = build_report(entries, anio, mes, month_str, store, history_store, history)
 
-    BASE_DIR = Path(__file__).resolve().parent
-    tpl_path = BASE_DIR / "src" / "reports" / "report_template.html"
-    html_path = os.path.join(period_dir, f"reporte_paramos_{anio}_{mes}.html")
+    if html_key and USE_GCS:
+        log(f"✅ Reporte disponible en: {store.url(html_key)}", "success")
+    elif html_key:
+        log(f"✅ Reporte guardado en: {os.path.join(period_dir, html_key)}", "success")
 
-    render(Path(tpl_path), Path(json_path), Path(html_path))
-    log("Reporte HTML generado correctamente.", "success")
-    
-    # Subir reporte final a GCS
-    if USE_GCS:
-        log("📤 Subiendo reporte final a GCS...", "info")
-        json_blob = f"{GCS_PREFIX}/{period_name}/reporte_paramos_{anio}_{mes}.json"
-        html_blob = f"{GCS_PREFIX}/{period_name}/reporte_paramos_{anio}_{mes}.html"
-        
-        upload_file_to_gcs(json_path, GCS_BUCKET_NAME, json_blob)
-        upload_file_to_gcs(html_path, GCS_BUCKET_NAME, html_blob)
-        
-        final_url = get_public_url(GCS_BUCKET_NAME, html_blob)
-        log(f"✅ Reporte disponible en: {final_url}", "success")
-        
-        # Limpiar archivos temporales
+    if USE_GCS and not sharded:
+        # Limpiar archivos temporales (solo quedan insumos locales, ej: grilla de Altiplano)
         log("🧹 Limpiando archivos temporales...", "info")
         try:
             shutil.rmtree(period_dir)
         except PermissionError:
             # En Windows, algunos archivos pueden quedar bloqueados
             log("⚠️ No se pudieron eliminar algunos archivos temporales (archivos en uso)", "warning")
-    else:
-        log(f"✅ Reporte guardado en: {html_path}", "success")
@@ -0,0 +1,143 @@
+"""
+Motor de alertas por grilla.
+
+Une en una sola evaluación vectorizada los dos criterios del pipeline:
+  - Transiciones (reporte): top N grillas cuyo alert_score supera el umbral
+  - Coberturas (PNGs de mapas): disminución de clase 1 o pérdida neta de clase 5 mayor al umbral
+"""
+
+import pandas as pd
+from src.aux_utils import log
+from src.config import ALERT_THRESHOLD_PP, ALERT_TOP_N_GRIDS, ALERT_COMBINE_METRICS, SCREENING_TOP_SLACK
+
+
+def is_all_grids_aoi(aoi_name):
+    """Caso especial: Altiplano siempre alerta (y genera mapas para) todas sus grillas."""
+    return bool(aoi_name) and "altiplano" in aoi_name.lower()
+
+
+def transition_score(df_transitions, combine_metrics):
+    """alert_score por fila: máximo de ambas métricas de transición o solo la de bosques."""
+    if combine_metrics:
+        # Usar el máximo de ambas métricas como indicador de severidad
+        return df_transitions[["pct_1_a_otro_clase1", "pct_5_a_otro_no1_clase5"]].max(axis=1)
+    # Usar solo cambio de bosques
+    return df_transitions["pct_1_a_otro_clase1"]
+
+
+def _transition_alerts(df_transitions, min_threshold, top_n, combine_metrics):
+    """alert_score y alerta_transiciones (top N sobre el umbral) por grid_id."""
+    score = transition_score(df_transitions, combine_metrics)
+
+    df = pd.DataFrame({"grid_id": df_transitions["grid_id"].values, "alert_score": score.values})
+    above = df[df["alert_score"] >= min_threshold]
+    top_idx = above.nlargest(top_n, "alert_score").index
+    df["alerta_transiciones"] = df.index.isin(top_idx)
+    # Orden de severidad (1 = más severa) entre las grillas alertadas
+    df["rank_alerta"] = df["alert_score"].where(df["alerta_transiciones"]).rank(ascending=False, method="first")
+    return df
+
+
+def _coverage_alerts(df_coverage, threshold_pp):
+    """
+    Criterios de alerta por coberturas:
+    1. Clase 1 (árboles) disminuye más del umbral
+    2. Clase 5 (arbustos/matorrales) disminuye más del umbral Y el aumento de clase 1 no compensa esa pérdida
+       Esto evita alertar por transiciones naturales 5→1 (arbustos→árboles)
+    """
+    alerta_clase_1 = df_coverage["pp_class_1"] < -threshold_pp
+    alerta_clase_5 = (df_coverage["pp_class_5"] < -threshold_pp) & (df_coverage["pp_class_1"] < -df_coverage["pp_class_5"])
+    return pd.DataFrame({
+        "grid_id": df_coverage["grid_id"].values,
+        "alerta_clase_1": alerta_clase_1.values,
+        "alerta_clase_5": alerta_clase_5.values,
+        "alerta_coberturas": (alerta_clase_1 | alerta_clase_5).values,
+    })
+
+
+def evaluate_alerts(aoi_name, df_transitions=None, df_coverage=None, min_threshold=None, top_n=None, combine_metrics=None):
+    """
+    Evalúa todos los criterios de alerta para cada grilla.
+
+    Args:
+        aoi_name: nombre del AOI (ej: 'paramo_chingaza')
+        df_transitions: DataFrame de compute_transitions (opcional)
+        df_coverage: DataFrame de generate_coverage_csv (opcional)
+        min_threshold: umbral en % / puntos porcentuales. Si None, usa config
+        top_n: máximo de grillas alertadas por transiciones. Si None, usa config
+        combine_metrics: si True, combina ambas métricas de transición. Si None, usa config
+
+    Returns:
+        pd.DataFrame: una fila por grid_id con columnas
+            alert_score, alerta_transiciones, rank_alerta (si hay transiciones)
+            alerta_clase_1, alerta_clase_5, alerta_coberturas (si hay coberturas)
+    """
+    min_threshold = min_threshold or ALERT_THRESHOLD_PP
+    top_n = top_n or ALERT_TOP_N_GRIDS
+    combine_metrics = combine_metrics if combine_metrics is not None else ALERT_COMBINE_METRICS
+
+    parts = []
+    if df_transitions is not None and not df_transitions.empty:
+        parts.append(_transition_alerts(df_transitions, min_threshold, top_n, combine_metrics))
+    if df_coverage is not None and not df_coverage.empty:
+        parts.append(_coverage_alerts(df_coverage, min_threshold))
+    if not parts:
+        return pd.DataFrame(columns=["grid_id"])
+
+    df = parts[0]
+    for part in parts[1:]:
+        df = df.merge(part, on="grid_id", how="outer")
+
+    flag_cols = [c for c in ["alerta_transiciones", "alerta_clase_1", "alerta_clase_5", "alerta_coberturas"] if c in df.columns]
+    df[flag_cols] = df[flag_cols].fillna(False).astype(bool)
+
+    # Caso especial: Altiplano siempre alertar todas las grillas
+    if is_all_grids_aoi(aoi_name):
+        df[flag_cols] = True
+
+    return df
+
+
+def coverage_alert_grid_ids(df_coverage, aoi_name, threshold_pp=None):
+    """
+    grid_ids que requieren PNGs según el criterio de coberturas.
+    Sin coberturas no se alerta ninguna grilla (salvo Altiplano, que usa la grilla completa).
+    """
+    threshold_pp = threshold_pp or ALERT_THRESHOLD_PP
+    if df_coverage is None or df_coverage.empty:
+        return []
+    df = evaluate_alerts(aoi_name, df_coverage=df_coverage, min_threshold=threshold_pp)
+    log(f"Filtro coberturas (disminución >{threshold_pp}pp): {int(df['alerta_coberturas'].sum())}/{len(df)} grillas", "info")
+    log(f"  - Alertas árboles (clase 1): {int(df['alerta_clase_1'].sum())}", "info")
+    log(f"  - Alertas arbustos/matorrales (clase 5, pérdida neta): {int(df['alerta_clase_5'].sum())}", "info")
+    return df.loc[df["alerta_coberturas"], "grid_id"].tolist()
+
+
+def transition_screening_ids(df_transitions, margin_pp, min_threshold=None, top_n=None, combine_metrics=None):
+    """
+    grid_ids a recalcular a 10 m tras el screening de transiciones (estimaciones a escala gruesa):
+      - alert_score a menos de margin_pp del umbral (o por encima)
+      - las SCREENING_TOP_SLACK * top_n de mayor alert_score (candidatas al top N)
+      - las top_n de mayor pérdida absoluta de clase 1 y de clase 5 (grillas reportadas en el resumen)
+    """
+    min_threshold = min_threshold or ALERT_THRESHOLD_PP
+    top_n = top_n or ALERT_TOP_N_GRIDS
+    combine_metrics = combine_metrics if combine_metrics is not None else ALERT_COMBINE_METRICS
+    if df_transitions.empty:
+        return []
+
+    score = transition_score(df_transitions, combine_metrics)
+    selected = score >= min_threshold - margin_pp
+    selected |= df_transitions.index.isin(score.nlargest(SCREENING_TOP_SLACK * top_n).index)
+    for col in ("n_1_a_otro", "n_5_a_otro_no1"):
+        selected |= df_transitions.index.isin(df_transitions[col].nlargest(top_n).index)
+    return df_transitions.loc[selected, "grid_id"].tolist()
+
+
+def coverage_screening_ids(df_coverage, margin_pp, threshold_pp=None):
+    """grid_ids a recalcular a 10 m tras el screening de coberturas: disminución de clase 1 o 5 cercana al umbral."""
+    threshold_pp = threshold_pp or ALERT_THRESHOLD_PP
+    if df_coverage.empty:
+        return []
+    near = (df_coverage["pp_class_1"] < -(threshold_pp - margin_pp)) | (df_coverage["pp_class_5"] < -(threshold_pp - margin_pp))
+    return df_coverage.loc[near, "grid_id"].tolist()
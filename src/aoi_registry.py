@@ -0,0 +1,134 @@
+"""
+Registro en memoria de AOIs y grillas para una ejecución.
+
+Cada AOI y su grilla se leen del disco (o de GCS) una sola vez, se reproyectan a EPSG:4326
+y se guardan junto con sus bounds, centroides y geometrías de Earth Engine. Las etapas del
+pipeline (transiciones, coberturas, mapas) reciben el AOIData por referencia en lugar de
+volver a leer y reproyectar los GeoJSON.
+"""
+
+import os
+from dataclasses import dataclass, field
+from typing import Optional
+
+import ee
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from src.aux_utils import log, create_grid
+from src.geom_utils import prepare_ee_geometries
+from src.config import EE_GEOM_TOLERANCE, EE_GEOM_PRECISION
+
+
+@dataclass
+class AOIData:
+    """AOI y grilla de análisis de un páramo, en EPSG:4326."""
+    name: str
+    aoi_path: str
+    grid_path: str
+    aoi: gpd.GeoDataFrame
+    grid: gpd.GeoDataFrame
+    _ee_shapes: Optional[dict] = field(default=None, repr=False)
+    _ee_geometries: Optional[dict] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        source = self.grid if not self.grid.empty else self.aoi
+        # Bounds (minx, miny, maxx, maxy) del AOI, usados para filtrar y recortar mosaicos DW
+        self.bounds = tuple(self.aoi.total_bounds)
+        # Centro del mapa (lat, lon)
+        center = source.union_all().centroid
+        self.center = (center.y, center.x)
+        # Centroides por celda, vectorizados
+        self.cell_centroids = shapely.centroid(np.asarray(self.grid.geometry.values))
+
+    @property
+    def grid_ids(self):
+        return self.grid["grid_id"].tolist()
+
+    @property
+    def ee_bbox(self):
+        """ee.Geometry.BBox de los bounds del AOI."""
+        return ee.Geometry.BBox(*self.bounds)
+
+    @property
+    def ee_shapes(self):
+        """{grid_id: geometría shapely preparada para Earth Engine} (sin celdas vacías)."""
+        if self._ee_shapes is None:
+            geoms = prepare_ee_geometries(self.grid, EE_GEOM_TOLERANCE, EE_GEOM_PRECISION, label=f"Earth Engine {self.name}")
+            self._ee_shapes = {gid: g for gid, g in zip(self.grid["grid_id"], geoms) if g is not None}
+        return self._ee_shapes
+
+    @property
+    def ee_geometries(self):
+        """{grid_id: ee.Geometry}. Se construyen una vez y se reutilizan en todas las etapas."""
+        if self._ee_geometries is None:
+            self._ee_geometries = {gid: ee.Geometry(g.__geo_interface__) for gid, g in self.ee_shapes.items()}
+        return self._ee_geometries
+
+
+# Registro de la ejecución actual: (nombre del AOI, ruta de la grilla) -> AOIData
+_REGISTRY = {}
+
+
+def register_aoi(aoi_path, grid_path, name=None, grid_size=None, store=None, grid_key=None):
+    """
+    Carga (una sola vez por ejecución) el AOI y su grilla. El registro se indexa por nombre y
+    grid_path: la misma AOI con otra grilla se carga aparte.
+    Si la grilla no existe en grid_path y se da grid_size, se crea a partir del AOI ya cargado
+    y se guarda en grid_path (o en grid_key del OutputStore, si se da store).
+
+    Returns:
+        AOIData
+    """
+    name = name or os.path.splitext(os.path.basename(str(aoi_path)))[0]
+    key = (name, str(grid_path))
+    if key in _REGISTRY:
+        return _REGISTRY[key]
+
+    aoi_gdf = gpd.read_file(aoi_path).to_crs(epsg=4326)
+
+    if not os.path.exists(grid_path) and grid_size:
+        grid_gdf = create_grid(aoi_gdf, grid_size)
+        if store is not None:
+            store.write_text(grid_key, grid_gdf.to_json(drop_id=True))
+        else:
+            grid_gdf.to_file(grid_path, driver="GeoJSON")
+    else:
+        grid_gdf = gpd.read_file(grid_path).to_crs(epsg=4326)
+
+    data = AOIData(name=name, aoi_path=str(aoi_path), grid_path=str(grid_path), aoi=aoi_gdf, grid=grid_gdf)
+    _REGISTRY[key] = data
+    log(f"AOI registrado: {name} ({len(grid_gdf)} grillas)", "info")
+    return data
+
+
+def get_aoi(name, grid_path):
+    """Devuelve el AOIData registrado para name con la grilla grid_path (o None)."""
+    return _REGISTRY.get((name, str(grid_path)))
+
+
+def clear_registry():
+    """Vacía el registro (ej: al terminar una ejecución)."""
+    _REGISTRY.clear()
+
+
+def load_grid(grid):
+    """
+    Devuelve la grilla en EPSG:4326 a partir de un AOIData, un GeoDataFrame o una ruta.
+    Permite que las etapas sigan aceptando rutas cuando se usan por separado.
+    """
+    if isinstance(grid, AOIData):
+        return grid.grid
+    if isinstance(grid, gpd.GeoDataFrame):
+        return grid.to_crs(epsg=4326)
+    return gpd.read_file(grid).to_crs(epsg=4326)
+
+
+def load_ee_geometries(grid):
+    """{grid_id: ee.Geometry} a partir de un AOIData (cacheado), GeoDataFrame o ruta."""
+    if isinstance(grid, AOIData):
+        return grid.ee_geometries
+    grid_gdf = load_grid(grid)
+    geoms = prepare_ee_geometries(grid_gdf, EE_GEOM_TOLERANCE, EE_GEOM_PRECISION)
+    return {gid: ee.Geometry(g.__geo_interface__) for gid, g in zip(grid_gdf["grid_id"], geoms) if g is not None}
@@ -17,16 +17,21 @@ def log(msg, level="info"):
     prefix = f"[{datetime.now().strftime('%H:%M:%S')}]"
     print(f"{colors.get(level, '')}{prefix} {msg}{reset}")
 
-def save_json(data, path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+def save_json(data, path, store=None):
+    # Con store (ver src/output_store.py), path es la clave del artefacto dentro del store
+    if store is not None:
+        store.write_text(path, json.dumps(data, indent=2, ensure_ascii=False))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
     log(f"JSON guardado en {path}", "success")
 
 def load_json(path):
     return json.loads(Path(path).read_text(encoding="utf-8"))
 
-def create_grid(aoi_path: str, grid_size: int) -> gpd.GeoDataFrame:
-    aoi = gpd.read_file(aoi_path)
+def create_grid(aoi_path, grid_size: int) -> gpd.GeoDataFrame:
+    # Acepta una ruta o un GeoDataFrame ya cargado (ej: desde el registro de AOIs)
+    aoi = aoi_path if isinstance(aoi_path, gpd.GeoDataFrame) else gpd.read_file(aoi_path)
     aoi = aoi.to_crs(epsg=3857)
     
     aoi_union = aoi.union_all()
@@ -38,7 +43,16 @@ def create_grid(aoi_path: str, grid_size: int) -> gpd.GeoDataFrame:
 
     # Crear las celdas de la grilla
     grid_cells = [box(x, y, x + grid_size, y + grid_size) for x in cols for y in rows]
-    grid = gpd.GeoDataFrame(geometry=grid_cells, crs="EPSG:3857")
+    # Índices de columna/fila desde el origen (floor de los bounds): grillas del mismo AOI con tamaños
+    # múltiplos entre sí quedan anidadas (celda padre = ix // k, iy // k)
+    grid = gpd.GeoDataFrame(
+        {
+            "ix": [i for i in range(len(cols)) for _ in rows],
+            "iy": [j for _ in cols for j in range(len(rows))],
+        },
+        geometry=grid_cells,
+        crs="EPSG:3857"
+    )
 
     # Filtrar solo las celdas que se intersectan con el AOI
     grid = gpd.sjoin(grid, gpd.GeoDataFrame(geometry=[aoi_union], crs="EPSG:3857"),how="inner", predicate="intersects").drop(columns="index_right")
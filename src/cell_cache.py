@@ -0,0 +1,149 @@
+"""
+Recálculo incremental por celda guiado por las escenas que alimentan cada celda.
+
+El valor de un píxel del mosaico DW solo depende de las escenas cuya huella lo cubre, así que los
+conteos de una celda (transiciones y clases en t1/t2) quedan determinados por su geometría y por las
+escenas DW de cada ventana que la intersectan (y, con los índices espectrales, las escenas S2 de sus
+compuestos). Esa combinación se resume en una firma por celda
+(con el índice local de escenas) y se guarda junto a los conteos de la última ejecución en
+CELL_CACHE_DIR: en la siguiente ejecución solo se reducen en Earth Engine las celdas cuya firma cambió.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import shapely
+
+from src.aux_utils import log
+from src.aoi_registry import load_grid
+from src.scene_index import DW_COLLECTION, S2_COLLECTION, get_scene_index, window_ms
+from src.config import CELL_CACHE_DIR, LOOKBACK_DAYS, SPECTRAL_INDICES_ENABLED, SPECTRAL_MAX_CLOUD
+
+# Cambiar si cambian las bandas de la pila (transition_image + coverage_image + índices): invalida los registros
+CELL_CACHE_VERSION = "2"
+
+
+def cell_signatures(aoi_data, date_before, current_date, lookback_days=LOOKBACK_DAYS):
+    """
+    Firma por celda: geometría + escenas DW de cada ventana cuya huella intersecta la celda
+    (más las escenas S2 de los compuestos si SPECTRAL_INDICES_ENABLED).
+
+    Returns:
+        dict grid_id -> firma (hex)
+    """
+    windows = [(DW_COLLECTION, None, date_before), (DW_COLLECTION, None, current_date)]
+    if SPECTRAL_INDICES_ENABLED:
+        windows += [(S2_COLLECTION, SPECTRAL_MAX_CLOUD, date_before), (S2_COLLECTION, SPECTRAL_MAX_CLOUD, current_date)]
+    grid = load_grid(aoi_data)
+    geoms = grid.geometry.values
+    tree = shapely.STRtree(geoms)
+
+    scene_ids_by_cell = [[[] for _ in windows] for _ in range(len(grid))]
+    for slot, (collection, max_cloud, date) in enumerate(windows):
+        index = get_scene_index(collection, aoi_data)
+        scenes = index.scenes(*window_ms(date, lookback_days), max_cloud=max_cloud)
+        if not scenes:
+            continue
+        footprints = [index.footprint(s) for s in scenes]
+        # Pares (escena, celda) que se intersectan
+        scene_idx, cell_idx = tree.query(footprints, predicate="intersects")
+        for s, c in zip(scene_idx, cell_idx):
+            scene_ids_by_cell[c][slot].append(scenes[s]["id"])
+
+    signatures = {}
+    for gid, geom, window_ids in zip(grid["grid_id"], geoms, scene_ids_by_cell):
+        h = hashlib.sha1(CELL_CACHE_VERSION.encode())
+        h.update(shapely.to_wkb(shapely.set_precision(geom, 1e-7)))
+        h.update("#".join("|".join(sorted(ids)) for ids in window_ids).encode())
+        signatures[gid] = h.hexdigest()
+    return signatures
+
+
+def _cache_path(aoi_name):
+    return Path(CELL_CACHE_DIR) / f"{aoi_name}.json"
+
+
+def load_cell_cache(aoi_name):
+    """{str(grid_id): {"sig", "counts"}} de la última ejecución ({} si no existe o es ilegible)."""
+    path = _cache_path(aoi_name)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        log(f"⚠️ Registro de celdas ilegible ({path}), se recalcula todo: {e}", "warning")
+        return {}
+
+
+def split_cached(aoi_name, grid_ids, signatures):
+    """
+    Separa las celdas con conteos reutilizables (misma firma que en la ejecución anterior).
+
+    Returns:
+        (dict grid_id -> conteos reutilizados, lista de grid_ids a recalcular)
+    """
+    cache = load_cell_cache(aoi_name)
+    cached, changed = {}, []
+    for gid in grid_ids:
+        entry = cache.get(str(gid))
+        if entry and entry["sig"] == signatures.get(gid):
+            cached[gid] = entry["counts"]
+        else:
+            changed.append(gid)
+    return cached, changed
+
+
+def store_counts(aoi_name, counts, signatures):
+    """
+    Guarda la firma y los conteos de cada celda (las celdas sin datos no se guardan). Solo deben
+    pasarse conteos exactos a 10 m (no estimaciones del screening).
+    """
+    cache = load_cell_cache(aoi_name)
+    for gid, stats in counts.items():
+        if stats and gid in signatures:
+            cache[str(gid)] = {"sig": signatures[gid], "counts": stats}
+    path = _cache_path(aoi_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(cache), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def reduce_changed_cells(reduce_fn, aoi_data, grid_ids, date_before, current_date):
+    """
+    Conteos por celda reutilizando los de la ejecución anterior para las celdas sin escenas nuevas.
+
+    Args:
+        reduce_fn: función grid_ids -> ({grid_id: conteos}, set de grid_ids exactos a 10 m)
+        aoi_data: AOIData del registro
+        grid_ids: celdas a devolver
+        date_before, current_date: fechas 'YYYY-MM-DD' de las ventanas
+
+    Returns:
+        (dict grid_id -> conteos, número de celdas recalculadas, set de grid_ids exactos)
+    """
+    try:
+        signatures = cell_signatures(aoi_data, date_before, current_date)
+    except Exception as e:
+        log(f"⚠️ Sin firmas de celdas para {aoi_data.name} (se recalcula todo): {e}", "warning")
+        counts, exact = reduce_fn(grid_ids)
+        return counts, len(grid_ids), exact
+
+    counts, changed = split_cached(aoi_data.name, grid_ids, signatures)
+    # Los conteos reutilizados son exactos: solo se guardan los calculados a 10 m
+    exact = set(counts)
+    if changed:
+        fresh, fresh_exact = reduce_fn(changed)
+        store_counts(aoi_data.name, {gid: c for gid, c in fresh.items() if gid in fresh_exact}, signatures)
+        counts.update(fresh)
+        exact |= fresh_exact
+    log_recomputed(aoi_data.name, len(changed), len(grid_ids))
+    return counts, len(changed), exact
+
+
+def log_recomputed(aoi_name, n_changed, n_total):
+    fraction = n_changed / n_total if n_total else 0.0
+    log(f"♻️ {aoi_name}: {n_changed}/{n_total} celdas recalculadas ({fraction:.0%}), el resto reutilizadas", "info")
+    return fraction
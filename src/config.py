@@ -9,14 +9,61 @@ GCS_OUTPUTS_BASE = "gs://reportes-simbyp"
 # === Derived paths ===
 AOI_DIR = f"{INPUTS_PATH}/area_estudio/dynamic_world"
 LOCAL_AOI = os.path.join(os.getcwd(), "AOIs")
-HEADER_IMG1_PATH = f"{INPUTS_PATH}/SDP Logos/asi_4.png"
-HEADER_IMG2_PATH = f"{INPUTS_PATH}/SDP Logos/bogota_4.png"
-FOOTER_IMG_PATH = f"{INPUTS_PATH}/SDP Logos/secre_5.png"
+LOGOS_DIR = f"{INPUTS_PATH}/SDP Logos"
+HEADER_IMG1_PATH = f"{LOGOS_DIR}/asi_4.png"
+HEADER_IMG2_PATH = f"{LOGOS_DIR}/bogota_4.png"
+FOOTER_IMG_PATH = f"{LOGOS_DIR}/secre_5.png"
+
+# === Caché local de insumos estáticos (AOIs, logos) ===
+# Se revalida al inicio de cada ejecución (generation/ETag) y solo se descargan objetos modificados
+INPUT_CACHE_DIR = os.path.join(os.getcwd(), ".cache", "inputs")
+INPUT_CACHE_WORKERS = 8  # Descargas concurrentes
+
+# === Índice local de escenas (Dynamic World y Sentinel-2) por AOI ===
+# IDs, fechas, huellas y % de nubes; se actualiza incrementalmente y permite responder disponibilidad
+# sin consultar Earth Engine y construir los mosaicos con listas explícitas de escenas
+SCENE_INDEX_ENABLED = True
+SCENE_INDEX_DIR = os.path.join(os.getcwd(), ".cache", "scenes")
+SCENE_INDEX_OVERLAP_DAYS = 7   # Re-consultar los últimos días indexados (escenas ingeridas con retraso)
+SCENE_INDEX_CHUNK_DAYS = 90    # Días por consulta al poblar el índice (límite de elementos de getInfo)
+# Recálculo incremental: solo se reducen las celdas cuyas escenas DW cambiaron desde la ejecución
+# anterior; el resto reutiliza los conteos guardados en CELL_CACHE_DIR (requiere SCENE_INDEX_ENABLED).
+# Desactivado por defecto: las ventanas (LOOKBACK_DAYS) avanzan un mes en cada ejecución mensual y casi
+# todas las firmas cambian, así que solo ahorra trabajo al re-ejecutar el mismo periodo
+INCREMENTAL_RECOMPUTE = False
+CELL_CACHE_DIR = os.path.join(os.getcwd(), ".cache", "cells")
 
 # === Cloud Storage ===
 GCS_BUCKET_NAME = GCS_OUTPUTS_BASE.replace("gs://", "")
 GCS_PREFIX = "dynamic_world"  # Carpeta dentro del bucket
 USE_GCS = True  # Cambiar a False para guardar localmente
+GCS_UPLOAD_WORKERS = 8  # Uploads concurrentes al subir directorios
+GCS_UPLOAD_RETRIES = 3  # Reintentos por archivo ante errores
+GCS_SYNC = True  # Solo subir archivos nuevos o modificados (compara checksums con los objetos existentes)
+GCS_SYNC_DELETE_STALE = False  # Con GCS_SYNC, eliminar objetos del prefijo que ya no existen localmente
+GCS_GZIP_TEXT = True  # Subir HTML/JSON/CSV/GeoJSON comprimidos (Content-Encoding: gzip)
+
+# === Mapas interactivos ===
+# Cómo referenciar los overlays PNG desde los HTML de mapas:
+#   "inline"   -> base64 dentro del HTML (archivos muy pesados)
+#   "relative" -> copias con hash de contenido en mapas/assets/, referenciadas por ruta relativa
+#   "url"      -> igual que "relative" pero con la URL pública de GCS (requiere USE_GCS)
+MAP_ASSET_MODE = "relative"
+
+# === Reporte ===
+# Cómo se incluyen los logos en el HTML del reporte (el JSON solo guarda referencias asset://):
+#   "inline"   -> base64 dentro del HTML (un solo archivo autocontenido)
+#   "relative" -> copias con hash de contenido en assets/ junto al reporte
+#   "url"      -> URL pública del logo en el bucket de insumos (requiere que sea público)
+REPORT_ASSET_MODE = "inline"
+
+# === Preparación de geometrías (grados, EPSG:4326) ===
+# Versión para mapas HTML: simplificada y con pocos decimales
+DISPLAY_GEOM_TOLERANCE = 0.0001  # ~11 m
+DISPLAY_GEOM_PRECISION = 5       # decimales (~1 m)
+# Versión enviada a Earth Engine: sin simplificar para no alterar las estadísticas
+EE_GEOM_TOLERANCE = 0.0
+EE_GEOM_PRECISION = 7            # decimales (~1 cm)
 
 # === Outputs locales (temporal) ===
 OUTPUTS_BASE = os.path.join(os.getcwd(), "temp_data")
@@ -34,7 +81,15 @@ print(f"✓ Configuración cargada - Proyecto: {PROJECT_ID}")
 
 # === Parámetros globales ===
 GRID_SIZE = 10000  # metros
+# Grillas anidadas: conteos calculados una vez en la grilla base y sumados en cada nivel (sin trabajo
+# adicional en Earth Engine). Los niveles deben ser múltiplos de la base; [] desactiva el roll-up.
+# Si GRID_SIZE está entre los niveles, sus tablas reemplazan las reducciones de la grilla principal
+GRID_ROLLUP_BASE_SIZE = 5000  # metros
+GRID_ROLLUP_SIZES = []        # ej: [5000, 10000, 20000]
 LOOKBACK_DAYS = 365
+# Líneas base a comparar con el mes analizado (meses hacia atrás). La primera define el reporte, los
+# mapas y las alertas; el resto escribe tablas adicionales (ej: [12, 1, 24] para t-12, t-1 y t-24)
+BASELINE_MONTHS = [12]
 
 # === Configuración de alertas por cambios de cobertura ===
 # Enfoque híbrido: seleccionar los TOP N grillas que superen el umbral mínimo
@@ -43,6 +98,48 @@ ALERT_TOP_N_GRIDS = 5  # Cuántas grillas alertar como máximo (ej: top 5)
 ALERT_COMBINE_METRICS = True  # Si es True, combina pct_1_a_otro_clase1 y pct_5_a_otro_no1_clase5
 # Special case: Altiplano siempre genera mapas (solo tiene 1 grilla)
 
+# === Reducciones en Earth Engine ===
+CELL_BATCH_SIZE = 200  # Celdas por solicitud reduceRegions
+BATCH_ALL_AOIS = False  # Mosaicos sobre la unión de todos los páramos y una sola reducción conjunta de sus celdas
+# Screening grueso-a-fino: reducir todas las celdas a SCREENING_SCALE y recalcular a 10 m solo las
+# cercanas al umbral de alerta o candidatas al top N. Las grillas reportadas siempre son exactas;
+# los totales por páramo incluyen estimaciones para las celdas descartadas (columna "exacto")
+SCREENING_ENABLED = False
+SCREENING_SCALE = 100       # metros
+SCREENING_MARGIN_PP = 3.0   # margen (pp) bajo ALERT_THRESHOLD_PP para recalcular una celda
+SCREENING_TOP_SLACK = 2     # recalcular las SCREENING_TOP_SLACK * ALERT_TOP_N_GRIDS de mayor score
+# Índices espectrales de Sentinel-2 por celda (NDVI, NBR, NDMI: media, mediana, p10, p90 y delta)
+# en la tabla de coberturas, reducidos en la misma solicitud que los conteos DW de cada lote
+SPECTRAL_INDICES_ENABLED = True
+SPECTRAL_INDEX_SCALE = 20          # metros (resolución nativa de B11/B12)
+SPECTRAL_MAX_CLOUD = 30            # % máximo de nubes por escena del compuesto
+SPECTRAL_MASK_SCL = [3, 8, 9, 10]  # clases SCL enmascaradas: sombra de nube, nube media/alta, cirros
+
+# === Reintentos y circuit breakers (Earth Engine y Cloud Storage) ===
+RETRY_ATTEMPTS = 4              # Reintentos de errores transitorios por llamada a Earth Engine
+RETRY_BASE_DELAY_S = 2.0        # Backoff exponencial con jitter: hasta base * 2^intento segundos
+RETRY_MAX_DELAY_S = 60.0
+BREAKER_FAILURE_THRESHOLD = 5   # Fallos transitorios seguidos que abren el circuito del backend
+BREAKER_COOLDOWN_S = 60.0       # Pausa de la etapa con el circuito abierto
+RETRY_QUEUE_ROUNDS = 2          # Rondas de la cola de celdas fallidas (lotes 4 veces más pequeños en cada una)
+
+# === Contabilidad de llamadas a Earth Engine ===
+EE_CALL_BUDGET = None  # Máximo de llamadas por ejecución (None = sin presupuesto)
+# Fracción del presupuesto a partir de la cual se omite cada producto (las estadísticas nunca se omiten)
+EE_BUDGET_DEGRADE = {"sentinel_png": 0.8, "dw_png": 0.9, "focos": 0.95}
+EE_LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60)  # Límites (s) del histograma de latencia
+
+# === Modelo de costo por AOI (orden de procesamiento y reparto entre tareas) ===
+COST_HISTORY_KEY = "costos_aoi.json"  # Historial de tiempos por etapa, en el store "historial" (fuera del periodo)
+COST_HISTORY_ALPHA = 0.5              # Peso de la última ejecución en el promedio exponencial por AOI
+# Segundos por celda (mosaicos, estadisticas) o por alerta (mapas, focos) mientras no hay historial
+COST_DEFAULTS = {"base": 20.0, "mosaicos": 0.2, "estadisticas": 1.0, "mapas": 30.0, "focos": 15.0}
+
+# === Focos de cambio (quadtree sobre las grillas alertadas) ===
+HOTSPOT_REFINEMENT = True  # Subdividir las grillas alertadas (10 km → 5 → 2.5 → 1.25 km)
+HOTSPOT_MIN_SIZE = 1250    # Tamaño mínimo de cuadrante (m)
+HOTSPOT_MIN_PIXELS = 100   # Píxeles válidos mínimos (1 ha) para que un cuadrante cuente como foco
+
 # AOI_DIR ya está bien definido como carpeta
 # Para obtener el path de cada geojson de páramo:
 def get_paramo_geojson(paramo_name):
@@ -50,7 +147,7 @@ def get_paramo_geojson(paramo_name):
     return os.path.join(AOI_DIR, f"{paramo_name}.geojson")
 
 
-def download_altiplano_aoi_from_gcs(output_dir: str, year: int, month: int) -> str:
+def download_altiplano_aoi_from_gcs(output_dir: str, year: int, month: int, source_path: str = None) -> str:
     """
     Descarga el AOI de Altiplano desde GCS y lo guarda como grid virtual.
     
@@ -61,6 +158,7 @@ def download_altiplano_aoi_from_gcs(output_dir: str, year: int, month: int) -> s
         output_dir: Directorio base de outputs (ej: '/path/to/temp_data')
         year: Año (ej: 2025)
         month: Mes (ej: 12)
+        source_path: copia local del AOI (caché de insumos). Si existe, no se descarga de GCS
     
     Returns:
         str: Ruta al archivo guardado
@@ -75,16 +173,21 @@ def download_altiplano_aoi_from_gcs(output_dir: str, year: int, month: int) -> s
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
     try:
-        # Parsear ruta GCS (gs://bucket/path)
-        gcs_parts = gcs_aoi_path.replace("gs://", "").split("/", 1)
-        bucket_name = gcs_parts[0]
-        blob_path = gcs_parts[1] if len(gcs_parts) > 1 else ""
-        
-        # Descargar desde GCS
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_path)
-        aoi_data = json.loads(blob.download_as_string())
+        if source_path and os.path.exists(source_path):
+            # Leer desde la caché local de insumos
+            with open(source_path, encoding="utf-8") as f:
+                aoi_data = json.load(f)
+        else:
+            # Parsear ruta GCS (gs://bucket/path)
+            gcs_parts = gcs_aoi_path.replace("gs://", "").split("/", 1)
+            bucket_name = gcs_parts[0]
+            blob_path = gcs_parts[1] if len(gcs_parts) > 1 else ""
+
+            # Descargar desde GCS
+            client = storage.Client()
+            bucket = client.bucket(bucket_name)
+            blob = bucket.blob(blob_path)
+            aoi_data = json.loads(blob.download_as_string())
         
         # Convertir a GeoDataFrame con ID de grid
         gdf = gpd.GeoDataFrame.from_features(aoi_data['features'])
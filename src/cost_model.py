@@ -0,0 +1,169 @@
+"""
+Modelo de costo por AOI y programación del más costoso primero.
+
+El costo (segundos) de un páramo se predice con:
+  - el historial del propio AOI (promedio exponencial de sus tiempos reales), si existe
+  - si no, tasas por etapa ajustadas con el historial de todos los AOIs: mosaicos y estadísticas
+    proporcionales al número de celdas (estimado del área), mapas y focos al número de alertas
+
+El historial (tiempos por etapa, celdas, área y alertas de cada AOI) se guarda fuera del periodo
+(COST_HISTORY_KEY en el store "historial") y solo se actualiza al armar el reporte, así todas las
+tareas de una ejecución por fragmentos leen el mismo historial y reparten los AOIs igual.
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+
+import geopandas as gpd
+import pandas as pd
+
+from src.aux_utils import log
+from src.config import GRID_SIZE, ALERT_TOP_N_GRIDS, COST_HISTORY_KEY, COST_DEFAULTS, COST_HISTORY_ALPHA
+
+STAGES = ("mosaicos", "estadisticas", "mapas", "focos")
+# Variable que explica el tiempo de cada etapa
+STAGE_DRIVERS = {"mosaicos": "celdas", "estadisticas": "celdas", "mapas": "alertas", "focos": "alertas"}
+
+COST_COLUMNS = ["aoi", "celdas", "area_km2", "alertas", "predicho_s", "real_s"] + [f"{s}_s" for s in STAGES]
+
+
+def aoi_area_km2(aoi_path):
+    gdf = gpd.read_file(aoi_path).to_crs(epsg=3857)
+    return float(gdf.geometry.area.sum()) / 1e6
+
+
+def estimated_cells(area_km2):
+    return max(1, round(area_km2 * 1e6 / GRID_SIZE ** 2))
+
+
+class AOICost:
+    """Tiempos por etapa de un AOI en la ejecución actual (lap() cierra la etapa en curso)."""
+
+    def __init__(self, aoi_name, predicted=None, area_km2=None):
+        self.aoi = aoi_name
+        self.predicted = predicted
+        self.area_km2 = area_km2
+        self.cells = None
+        self.alerts = None
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def start(self):
+        """Reinicia el reloj al comenzar el procesamiento del AOI (schedule() lo crea antes)."""
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def to_record(self):
+        return {
+            "aoi": self.aoi,
+            "celdas": self.cells,
+            "area_km2": round(self.area_km2, 2) if self.area_km2 is not None else None,
+            "alertas": self.alerts,
+            "predicho_s": round(self.predicted, 1) if self.predicted is not None else None,
+            "real_s": round(self.total(), 1),
+            **{f"{s}_s": round(self.stages.get(s, 0.0), 1) for s in STAGES},
+        }
+
+
+def load_history(store):
+    """{aoi: registro} del historial (vacío si no existe o es ilegible)."""
+    try:
+        text = store.read_text(COST_HISTORY_KEY)
+        return json.loads(text) if text else {}
+    except Exception as e:
+        log(f"⚠️ Historial de costos no disponible: {e}", "warning")
+        return {}
+
+
+class CostModel:
+    def __init__(self, history):
+        self.history = history
+        self.rates = self._fit_rates(history)
+
+    @staticmethod
+    def _fit_rates(history):
+        """Segundos por unidad de la variable de cada etapa (celdas o alertas), sobre todo el historial."""
+        rates = {}
+        for stage in STAGES:
+            driver = STAGE_DRIVERS[stage]
+            seconds = sum(h["tiempos"].get(stage, 0.0) for h in history.values() if h.get(driver))
+            units = sum(h[driver] for h in history.values() if h.get(driver))
+            rates[stage] = seconds / units if units else COST_DEFAULTS[stage]
+        return rates
+
+    def predict(self, aoi_name, area_km2):
+        """Segundos estimados para procesar el AOI."""
+        past = self.history.get(aoi_name)
+        if past and past.get("total_ema"):
+            return past["total_ema"]
+        drivers = {
+            "celdas": estimated_cells(area_km2),
+            "alertas": (past or {}).get("alertas", ALERT_TOP_N_GRIDS),
+        }
+        return COST_DEFAULTS["base"] + sum(self.rates[s] * drivers[STAGE_DRIVERS[s]] for s in STAGES)
+
+
+def _aoi_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def schedule(aoi_paths, model):
+    """
+    Costo predicho por AOI y orden de procesamiento (más costoso primero).
+
+    Returns:
+        (lista de rutas ordenada, {ruta: AOICost con la predicción})
+    """
+    costs = {}
+    for path in aoi_paths:
+        try:
+            area = aoi_area_km2(path)
+        except Exception as e:
+            log(f"⚠️ No se pudo leer el área de {path}: {e}", "warning")
+            area = 0.0
+        costs[path] = AOICost(_aoi_name(path), predicted=model.predict(_aoi_name(path), area), area_km2=area)
+    ordered = sorted(aoi_paths, key=lambda p: (-costs[p].predicted, _aoi_name(p)))
+    return ordered, costs
+
+
+def update_history(store, records, history=None):
+    """Agrega los tiempos reales de la ejecución al historial (promedio exponencial del total)."""
+    history = dict(history if history is not None else load_history(store))
+    for rec in records:
+        if not rec.get("real_s"):
+            continue
+        prev = history.get(rec["aoi"], {})
+        ema = prev.get("total_ema")
+        history[rec["aoi"]] = {
+            "celdas": rec["celdas"],
+            "area_km2": rec["area_km2"],
+            "alertas": rec["alertas"],
+            "tiempos": {s: rec[f"{s}_s"] for s in STAGES},
+            "total": rec["real_s"],
+            "total_ema": rec["real_s"] if ema is None else round(COST_HISTORY_ALPHA * rec["real_s"] + (1 - COST_HISTORY_ALPHA) * ema, 1),
+            "actualizado": datetime.now().isoformat(timespec="seconds"),
+        }
+    store.write_text(COST_HISTORY_KEY, json.dumps(history, indent=2, ensure_ascii=False))
+    return history
+
+
+def cost_report(records):
+    """DataFrame predicho vs real por AOI (ordenado por costo real) y log del resumen."""
+    df = pd.DataFrame(records, columns=COST_COLUMNS).sort_values("real_s", ascending=False)
+    if df.empty:
+        return df
+    with_pred = df.dropna(subset=["predicho_s"])
+    mape = (abs(with_pred["predicho_s"] - with_pred["real_s"]) / with_pred["real_s"].clip(lower=1)).mean() * 100
+    log(f"⏱️ Costo por AOI: predicho {with_pred['predicho_s'].sum():.0f} s, real {df['real_s'].sum():.0f} s (error medio {mape:.0f}%)", "info")
+    for _, row in df.head(5).iterrows():
+        log(f"   {row['aoi']}: predicho {row['predicho_s']} s, real {row['real_s']} s", "info")
+    return df
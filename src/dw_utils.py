@@ -2,9 +2,15 @@ import geopandas as gpd
 import pandas as pd
 import ee
 import geemap
-from shapely.ops import unary_union
 from src.aux_utils import log
-from src.config import LOOKBACK_DAYS, PROJECT_ID, ALERT_THRESHOLD_PP, ALERT_TOP_N_GRIDS, ALERT_COMBINE_METRICS
+from src.aoi_registry import AOIData, load_grid, load_ee_geometries
+from src.alert_utils import evaluate_alerts, is_all_grids_aoi, transition_screening_ids, coverage_screening_ids
+from src.scene_index import DW_COLLECTION, scene_collection, window_scene_ids
+from src.ee_accounting import get_info
+from src.resilience import call_with_retry
+from src.spectral_indices import spectral_image, s2_composite, index_image, s2_scene_ids, index_reducer, is_spectral, spectral_from_counts
+from src.cell_cache import cell_signatures, split_cached, store_counts, reduce_changed_cells, log_recomputed
+from src.config import LOOKBACK_DAYS, PROJECT_ID, ALERT_THRESHOLD_PP, ALERT_TOP_N_GRIDS, CELL_BATCH_SIZE, SCREENING_ENABLED, SCREENING_SCALE, SCREENING_MARGIN_PP, SCENE_INDEX_ENABLED, INCREMENTAL_RECOMPUTE, RETRY_QUEUE_ROUNDS, SPECTRAL_INDEX_SCALE, SPECTRAL_INDICES_ENABLED
 
 def authenticate_gee():
     try:
@@ -16,50 +22,216 @@ def authenticate_gee():
         ee.Initialize(project=PROJECT_ID)
         log("Autenticación completada.", "success")
 
-def get_dynamic_world_image(aoi_path, end_date, lookback_days=LOOKBACK_DAYS):
+def dw_scene_ids(aois, end_date, lookback_days=LOOKBACK_DAYS):
+    """
+    IDs de las escenas DW de la ventana [end_date - lookback_days, end_date) según el índice local
+    (unión sobre los AOIs). None si el índice está desactivado o no se pudo actualizar.
+    """
+    if not SCENE_INDEX_ENABLED:
+        return None
+    try:
+        return window_scene_ids(DW_COLLECTION, aois, end_date, lookback_days)
+    except Exception as e:
+        log(f"⚠️ Índice de escenas DW no disponible, se filtra la colección en Earth Engine: {e}", "warning")
+        return None
+
+
+def get_dynamic_world_image(aoi_path, end_date, lookback_days=LOOKBACK_DAYS, scene_ids=None):
+    """
+    aoi_path: ruta al GeoJSON del AOI, AOIData del registro (evita releer el archivo)
+              o bounds (minx, miny, maxx, maxy), ej: la unión de varios AOIs
+    scene_ids: escenas DW explícitas del mosaico (ver dw_scene_ids). Si es None y aoi_path es
+               AOIData, se toman del índice local de escenas
+    """
     authenticate_gee()
-    gdf = gpd.read_file(aoi_path)
-    minx, miny, maxx, maxy = gdf.total_bounds
+    if isinstance(aoi_path, tuple):
+        minx, miny, maxx, maxy = aoi_path
+    elif isinstance(aoi_path, AOIData):
+        minx, miny, maxx, maxy = aoi_path.bounds
+        if scene_ids is None:
+            scene_ids = dw_scene_ids([aoi_path], end_date, lookback_days)
+    else:
+        gdf = gpd.read_file(aoi_path)
+        minx, miny, maxx, maxy = gdf.total_bounds
     bbox = ee.Geometry.BBox(minx, miny, maxx, maxy)
 
+    start, end = ee.Date(end_date).advance(-lookback_days, "day"), ee.Date(end_date)
+    if scene_ids is not None:
+        # Las escenas del índice local dentro de la misma ventana y bbox
+        collection = scene_collection(DW_COLLECTION, scene_ids, start, end, bbox)
+    else:
+        collection = ee.ImageCollection(DW_COLLECTION).filterDate(start, end).filterBounds(bbox)
     collection = (
-        ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1")
-        .filterDate(ee.Date(end_date).advance(-lookback_days, "day"), ee.Date(end_date))
-        .filterBounds(bbox)
+        collection
         .select("label")
         .sort("system:time_start", False)
         .sort("system:index")
     )
 
     image = collection.mosaic().clip(bbox)
-    log(f"Imagen DW cargada para {end_date}", "success")
+    log(f"Imagen DW cargada para {end_date}" + (f" ({len(scene_ids)} escenas)" if scene_ids is not None else ""), "success")
     return image
 
-def compute_transitions(dw_before, dw_current, grid_path):
+# Escala nativa de Dynamic World (m)
+DW_SCALE = 10
+
+def _reduce_batch(img, ee_geoms, batch, scale, index_img=None, reducer=None):
+    """Un lote de reduceRegions (con reintentos de errores transitorios). Devuelve grid_id -> {banda: valor}."""
+    fc = ee.FeatureCollection([ee.Feature(ee_geoms[gid], {"grid_id": gid}) for gid in batch])
+    reduced = img.reduceRegions(collection=fc, reducer=reducer or ee.Reducer.sum(), scale=scale)
+    if index_img is not None:
+        # Encadenado sobre las mismas features: las estadísticas espectrales llegan en la misma solicitud
+        reduced = index_img.reduceRegions(collection=reduced, reducer=index_reducer(), scale=max(scale, SPECTRAL_INDEX_SCALE))
+    reduced = call_with_retry(
+        get_info, reduced, "reduceRegions", backend="ee", label=f"reduceRegions {batch[0]}..{batch[-1]}"
+    )
+    results = {}
+    for feature in reduced.get("features", []):
+        props = feature.get("properties", {})
+        results[props.pop("grid_id")] = props
+    return results
+
+
+def reduce_cells(img, ee_geoms, scale=DW_SCALE, grid_ids=None, batch_size=None, index_img=None, reducer=None):
     """
-    Calcula, por celda de grilla, los cambios:
-      - 1 -> cualquier clase distinta de 1
-      - 5 -> cualquier clase distinta de 1 y 5
+    Suma las bandas de img en cada celda con reduceRegions, en lotes de batch_size celdas
+    (una sola solicitud a Earth Engine por lote en lugar de una por celda).
 
-    Devuelve un DataFrame con:
-      grid_id, n_validos,
-      n_1_a_otro, n_5_a_otro_no1,
-      pct_1_a_otro_clase1, pct_5_a_otro_no1_clase5
+    Las celdas de los lotes que fallan pasan a una cola de reintentos que, al final de la pasada,
+    reprocesa solo esas celdas en lotes más pequeños (RETRY_QUEUE_ROUNDS rondas).
+
+    Args:
+        img: ee.Image con las bandas a sumar
+        ee_geoms: {grid_id: ee.Geometry}
+        scale: escala de la reducción (m)
+        grid_ids: subconjunto (y orden) de celdas a reducir. Si None, todas
+        batch_size: celdas por solicitud. Si None, usa CELL_BATCH_SIZE
+        index_img: imagen de índices espectrales (ver spectral_indices.spectral_image). Sus estadísticas
+                   (media, mediana, p10, p90) se agregan a cada celda en la misma solicitud del lote
+        reducer: reductor de img. Si None, ee.Reducer.sum()
+
+    Returns:
+        dict: grid_id -> {banda: suma, <índice>_<periodo>_<estadística>: valor}. Las celdas que siguen fallando quedan en None (fallidas,
+        nunca como ceros)
     """
+    grid_ids = list(ee_geoms) if grid_ids is None else [gid for gid in grid_ids if gid in ee_geoms]
+    batch_size = batch_size or CELL_BATCH_SIZE
+    results = {}
+    queue = grid_ids
+    for round_ in range(RETRY_QUEUE_ROUNDS + 1):
+        failed = []
+        for start in range(0, len(queue), batch_size):
+            batch = queue[start:start + batch_size]
+            try:
+                results.update(_reduce_batch(img, ee_geoms, batch, scale, index_img, reducer))
+                failed += [gid for gid in batch if gid not in results]
+            except Exception as e:
+                log(f"⚠️ Error reduciendo grillas {batch[0]}..{batch[-1]} ({len(batch)} celdas): {e}", "warning")
+                failed += batch
+        if not failed or round_ == RETRY_QUEUE_ROUNDS:
+            break
+        # Lotes más pequeños: algunos errores (memoria, timeouts) dependen del tamaño del lote
+        queue, batch_size = failed, max(1, batch_size // 4)
+        log(f"↻ Cola de reintentos: {len(queue)} celdas fallidas en lotes de {batch_size}", "warning")
+
+    for gid in failed:
+        results[gid] = None
+    if failed:
+        log(f"✗ {len(failed)} celdas sin datos tras los reintentos (marcadas como fallidas)", "error")
+    return results
+
+
+def mark_failed(df, counts):
+    """Agrega la columna fallida (True si la reducción de la celda falló) si alguna celda falló."""
+    failed = {gid for gid, stats in counts.items() if stats is None}
+    if failed:
+        df["fallida"] = df["grid_id"].isin(failed)
+    return df
 
-    # === Cargar grilla y asegurar CRS ===
-    grid_gdf = gpd.read_file(grid_path)
-    grid_gdf = grid_gdf.to_crs(epsg=4326)
-    results = []
 
-    # === Preparar imágenes de cambio ===
+def _screened_counts(img, ee_geoms, grid_ids, to_frame, select_refine, label, index_img=None):
+    """
+    Modo screening: reduce todas las celdas a SCREENING_SCALE (conteos escalados a píxeles de 10 m)
+    y recalcula a 10 m solo las celdas que select_refine(df_grueso) devuelve. Las estadísticas
+    espectrales (index_img) no se escalan: en las celdas no recalculadas quedan a la escala gruesa.
+
+    Returns:
+        (dict grid_id -> conteos, set de grid_ids exactos)
+    """
+    coarse = _coarse_counts(img, ee_geoms, grid_ids, index_img)
+    refine_ids = _refine_ids(coarse, grid_ids, to_frame, select_refine)
+    exact = reduce_cells(img, ee_geoms, scale=DW_SCALE, grid_ids=refine_ids, index_img=index_img)
+    log(f"🔎 Screening {label}: {len(exact)}/{len(grid_ids)} celdas recalculadas a {DW_SCALE} m (resto a {SCREENING_SCALE} m)", "info")
+    return {**coarse, **exact}, set(exact)
+
+
+def _coarse_counts(img, ee_geoms, grid_ids, index_img=None):
+    """Pasada gruesa del screening: conteos a SCREENING_SCALE escalados a píxeles de 10 m."""
+    factor = (SCREENING_SCALE / DW_SCALE) ** 2
+    coarse = reduce_cells(img, ee_geoms, scale=SCREENING_SCALE, grid_ids=grid_ids, index_img=index_img)
+    return {
+        gid: None if stats is None else {band: value if is_spectral(band) else value * factor for band, value in stats.items()}
+        for gid, stats in coarse.items()
+    }
+
+
+def _refine_ids(coarse, grid_ids, to_frame, select_refine):
+    """Celdas a recalcular a 10 m: las que select_refine elige y las que fallaron en la pasada gruesa."""
+    selected = set(select_refine(to_frame(coarse, grid_ids))) | {gid for gid, stats in coarse.items() if stats is None}
+    return [gid for gid in grid_ids if gid in selected]
+
+
+def _with_pp(df):
+    for class_num in (1, 5):
+        df[f"pp_class_{class_num}"] = df[f"class_{class_num}_t2_pct"] - df[f"class_{class_num}_t1_pct"]
+    return df
+
+
+def _stack_frames(counts, grid_ids):
+    """Tablas (transiciones, coberturas) de la pila combinada, para el screening."""
+    return transitions_from_counts(counts, grid_ids), _with_pp(coverage_from_counts(counts, grid_ids))
+
+
+def _stack_screening_ids(frames):
+    """Celdas cercanas al umbral en transiciones o en coberturas (pila combinada)."""
+    df_trans, df_cov = frames
+    return set(transition_screening_ids(df_trans, SCREENING_MARGIN_PP)) | set(coverage_screening_ids(df_cov, SCREENING_MARGIN_PP))
+
+
+def _reduce_stack(img_all, ee_geoms, grid_ids, index_img=None, screening=False):
+    """
+    Conteos de la pila transiciones + coberturas (+ índices) para grid_ids, con screening opcional.
+
+    Returns:
+        (dict grid_id -> conteos, set de grid_ids exactos a 10 m)
+    """
+    if screening and grid_ids:
+        return _screened_counts(img_all, ee_geoms, grid_ids, _stack_frames, _stack_screening_ids, "celdas", index_img=index_img)
+    counts = reduce_cells(img_all, ee_geoms, grid_ids=grid_ids, index_img=index_img)
+    return counts, set(counts)
+
+
+def _mark_exact(df, exact_ids):
+    df["exacto"] = df["grid_id"].isin(exact_ids)
+    return df
+
+
+def _use_screening(screening, grid_path):
+    screening = SCREENING_ENABLED if screening is None else screening
+    # Altiplano alerta todas sus grillas: no hay nada que descartar
+    if screening and isinstance(grid_path, AOIData) and is_all_grids_aoi(grid_path.name):
+        return False
+    return screening
+
+
+def transition_image(dw_before, dw_current):
+    """Bandas binarias cuya suma por celda da los conteos de transiciones."""
     change_1 = dw_before.eq(1).And(dw_current.neq(1)).rename("change_1")
     change_5 = dw_before.eq(5).And(dw_current.neq(1)).And(dw_current.neq(5)).rename("change_5")
     class1_mask = dw_before.eq(1).rename("class1")
     class5_mask = dw_before.eq(5).rename("class5")
     valid_mask = dw_before.gte(0).And(dw_current.gte(0)).rename("valid")
-
-    img_all = (
+    return (
         change_1
         .addBands(change_5)
         .addBands(class1_mask)
@@ -67,66 +239,285 @@ def compute_transitions(dw_before, dw_current, grid_path):
         .addBands(valid_mask)
     )
 
-    # === Iterar sobre cada celda de la grilla ===
-    for _, row in grid_gdf.iterrows():
-        geom = row.geometry
-        if geom.is_empty:
-            continue
-        if geom.geom_type == "MultiPolygon":
-            geom = unary_union([p for p in geom.geoms if not p.is_empty])
-
-        ee_geom = ee.Geometry(geom.__geo_interface__)
-
-        try:
-            # Validar si hay píxeles dentro de la celda
-            count_valid = dw_before.reduceRegion(
-                reducer=ee.Reducer.count(),
-                geometry=ee_geom,
-                scale=10,
-                maxPixels=1e13
-            ).getInfo()
-
-            if not count_valid:
-                log(f"⚠️ Grid {row.get('grid_id', '?')} sin píxeles válidos (fuera del área DW).", "warning")
-                continue
 
-            # Reducir regiones (sumar píxeles)
-            stats = img_all.reduceRegion(
-                reducer=ee.Reducer.sum(),
-                geometry=ee_geom,
-                scale=10,
-                maxPixels=1e13
-            ).getInfo() or {}
-
-            # Extraer valores por nombre de banda
-            n_1_a_otro = stats.get("change_1", 0)
-            n_5_a_otro_no1 = stats.get("change_5", 0)
-            n_class1_before = stats.get("class1", 0)
-            n_class5_before = stats.get("class5", 0)
-            n_valid = stats.get("valid", 0)
-
-            # Porcentajes relativos solo a las clases de origen
-            pct_1_to_any_of_class1 = 100 * n_1_a_otro / n_class1_before if n_class1_before else 0
-            pct_5_to_not1_of_class5 = 100 * n_5_a_otro_no1 / n_class5_before if n_class5_before else 0
-
-        except Exception as e:
-            log(f"⚠️ Error en grid {row.get('grid_id', '?')}: {e}", "warning")
-            n_valid = n_1_a_otro = n_5_a_otro_no1 = 0
-            pct_1_to_any_of_class1 = pct_5_to_not1_of_class5 = 0
+TRANSITION_COLUMNS = ["grid_id", "n_validos", "n_1_a_otro", "pct_1_a_otro_clase1", "n_5_a_otro_no1", "pct_5_a_otro_no1_clase5"]
 
+
+def transitions_from_counts(counts, grid_ids):
+    """
+    DataFrame de transiciones a partir de los conteos por celda (grid_id -> {banda: suma}).
+    Las celdas fallidas (conteos None) quedan con NaN y la columna fallida.
+    """
+    results = []
+    for grid_id in grid_ids:
+        stats = counts.get(grid_id, {})
+        if stats is None:
+            results.append({"grid_id": grid_id})
+            continue
+        n_1_a_otro = stats.get("change_1", 0)
+        n_5_a_otro_no1 = stats.get("change_5", 0)
+        n_class1_before = stats.get("class1", 0)
+        n_class5_before = stats.get("class5", 0)
+
+        # Porcentajes relativos solo a las clases de origen
         results.append({
-            "grid_id": row.get("grid_id", _),
-            "n_validos": n_valid,
+            "grid_id": grid_id,
+            "n_validos": stats.get("valid", 0),
             "n_1_a_otro": n_1_a_otro,
-            "pct_1_a_otro_clase1": pct_1_to_any_of_class1,
+            "pct_1_a_otro_clase1": 100 * n_1_a_otro / n_class1_before if n_class1_before else 0,
             "n_5_a_otro_no1": n_5_a_otro_no1,
-            "pct_5_a_otro_no1_clase5": pct_5_to_not1_of_class5
+            "pct_5_a_otro_no1_clase5": 100 * n_5_a_otro_no1 / n_class5_before if n_class5_before else 0
         })
+    return mark_failed(pd.DataFrame(results, columns=TRANSITION_COLUMNS), counts)
+
+
+def compute_transitions(dw_before, dw_current, grid_path, screening=None):
+    """
+    Calcula, por celda de grilla, los cambios:
+      - 1 -> cualquier clase distinta de 1
+      - 5 -> cualquier clase distinta de 1 y 5
+
+    Devuelve un DataFrame con:
+      grid_id, n_validos,
+      n_1_a_otro, n_5_a_otro_no1,
+      pct_1_a_otro_clase1, pct_5_a_otro_no1_clase5
+    (y la columna exacto en modo screening)
+
+    grid_path: ruta al GeoJSON de grilla o AOIData del registro (evita releer y reproyectar)
+    screening: si True, primero reduce todas las celdas a SCREENING_SCALE y recalcula a 10 m solo las
+               cercanas al umbral de alerta o entre las de mayor cambio (las reportadas). Si None, usa config
+    """
+
+    # === Cargar grilla (AOIData del registro o ruta) ===
+    grid_gdf = load_grid(grid_path)
+    ee_geoms = load_ee_geometries(grid_path)
+    grid_ids = [gid for gid in grid_gdf["grid_id"] if gid in ee_geoms]
+
+    # === Preparar imágenes de cambio ===
+    img_all = transition_image(dw_before, dw_current)
+
+    # === Reducir todas las celdas en lotes ===
+    if _use_screening(screening, grid_path):
+        counts, exact_ids = _screened_counts(
+            img_all, ee_geoms, grid_ids, transitions_from_counts,
+            lambda df: transition_screening_ids(df, SCREENING_MARGIN_PP), "transiciones"
+        )
+        df = transitions_from_counts(counts, grid_ids)
+        df["exacto"] = df["grid_id"].isin(exact_ids)
+    else:
+        df = transitions_from_counts(reduce_cells(img_all, ee_geoms, grid_ids=grid_ids), grid_ids)
 
-    df = pd.DataFrame(results)
     log(f"✅ Transiciones calculadas: {len(df)} celdas procesadas.", "success")
     return df
 
+def aoi_transition_totals(dw_before, dw_current, grid_path):
+    """
+    Pérdidas totales (pixeles 1 -> otro y 5 -> otro no 1) del AOI a 10 m con un solo reduceRegion
+    sobre la unión de sus celdas: exactas aunque la tabla por celda venga del screening.
+
+    Returns:
+        dict {"change_1": suma, "change_5": suma}
+    """
+    region = ee.FeatureCollection([ee.Feature(g) for g in load_ee_geometries(grid_path).values()]).geometry()
+    totals = transition_image(dw_before, dw_current).select(["change_1", "change_5"]).reduceRegion(
+        reducer=ee.Reducer.sum(), geometry=region, scale=DW_SCALE, maxPixels=1e13
+    )
+    return call_with_retry(get_info, totals, "reduceRegion", backend="ee", label="totales del AOI")
+
+
+def compute_baseline_statistics(dw_current, dw_baselines, aoi_data, current_date=None):
+    """
+    Transiciones y coberturas de varias líneas base contra el mismo periodo actual en una sola
+    reducción por lotes: una pila de bandas por par (prefijo b<i>_) concatenadas en una imagen.
+
+    Args:
+        dw_current: imagen DW del periodo actual
+        dw_baselines: {date_before: imagen DW de esa línea base}
+        aoi_data: AOIData del registro
+        current_date: fecha 'YYYY-MM-DD' del periodo actual. Si se da, las coberturas incluyen los
+                      índices espectrales de cada par (un compuesto S2 por fecha)
+
+    Returns:
+        dict: date_before -> {"transitions", "coverage"}
+    """
+    prefixes = {date_before: f"b{i}_" for i, date_before in enumerate(dw_baselines)}
+    img_all = ee.Image.cat([
+        transition_image(dw_before, dw_current)
+        .addBands(coverage_image(dw_before, dw_current))
+        .regexpRename("^(.*)$", f"{prefixes[date_before]}$1")
+        for date_before, dw_before in dw_baselines.items()
+    ])
+    index_img = None
+    if current_date is not None and SPECTRAL_INDICES_ENABLED:
+        # El compuesto S2 del periodo actual se comparte entre todos los pares, como el mosaico DW
+        s2_current = s2_composite(aoi_data, current_date)
+        index_img = ee.Image.cat([
+            index_image(s2_composite(aoi_data, date_before), s2_current)
+            .regexpRename("^(.*)$", f"{prefixes[date_before]}$1")
+            for date_before in dw_baselines
+        ])
+    ee_geoms = load_ee_geometries(aoi_data)
+    grid_ids = [gid for gid in aoi_data.grid["grid_id"] if gid in ee_geoms]
+    counts = reduce_cells(img_all, ee_geoms, grid_ids=grid_ids, index_img=index_img)
+    log(f"🧮 {len(dw_baselines)} líneas base en una sola reducción de {len(grid_ids)} celdas", "info")
+
+    out = {}
+    for date_before, prefix in prefixes.items():
+        pair_counts = {
+            gid: None if stats is None else {band[len(prefix):]: value for band, value in stats.items() if band.startswith(prefix)}
+            for gid, stats in counts.items()
+        }
+        out[date_before] = {
+            "transitions": transitions_from_counts(pair_counts, grid_ids),
+            "coverage": add_coverage_deltas(coverage_from_counts(pair_counts, grid_ids)),
+        }
+    return out
+
+
+def incremental_enabled():
+    """El recálculo incremental necesita el índice de escenas para las firmas por celda."""
+    return INCREMENTAL_RECOMPUTE and SCENE_INDEX_ENABLED
+
+
+def compute_cell_statistics(dw_before, dw_current, aoi_data, date_before, current_date):
+    """
+    Transiciones, coberturas e índices espectrales de un AOI en una sola pasada (bandas apiladas), reduciendo solo las
+    celdas cuyas escenas DW cambiaron desde la ejecución anterior (ver src/cell_cache.py). Con
+    SCREENING_ENABLED las celdas a reducir pasan por el screening grueso-a-fino (columna exacto) y
+    solo se guardan en el registro las exactas.
+
+    Returns:
+        dict con el mismo formato que compute_batched_statistics para un AOI, más
+        "recomputed" y "cells" (celdas recalculadas y totales)
+    """
+    img_all = transition_image(dw_before, dw_current).addBands(coverage_image(dw_before, dw_current))
+    index_img = spectral_image(aoi_data, date_before, current_date)
+    ee_geoms = load_ee_geometries(aoi_data)
+    grid_ids = [gid for gid in aoi_data.grid["grid_id"] if gid in ee_geoms]
+    screening = _use_screening(None, aoi_data)
+    counts, n_recomputed, exact_ids = reduce_changed_cells(
+        lambda ids: _reduce_stack(img_all, ee_geoms, ids, index_img=index_img, screening=screening),
+        aoi_data, grid_ids, date_before, current_date
+    )
+    df_trans = transitions_from_counts(counts, grid_ids)
+    df_cov = add_coverage_deltas(coverage_from_counts(counts, grid_ids))
+    if screening:
+        df_trans, df_cov = _mark_exact(df_trans, exact_ids), _mark_exact(df_cov, exact_ids)
+    return {
+        "dw_before": dw_before,
+        "dw_current": dw_current,
+        "transitions": df_trans,
+        "coverage": df_cov,
+        "recomputed": n_recomputed,
+        "cells": len(grid_ids),
+    }
+
+
+def compute_batched_statistics(aois, date_before, current_date):
+    """
+    Modo conjunto para varios AOIs: ambos mosaicos DW se construyen una vez sobre la unión de sus
+    bounds y todas las celdas (etiquetadas con aoi_name/grid_id) se reducen juntas en lotes de
+    CELL_BATCH_SIZE, con las bandas de transiciones y de clases (y los índices espectrales de un
+    compuesto S2 por periodo sobre la misma unión) en la misma pasada. Con SCREENING_ENABLED la
+    pasada gruesa es conjunta y las celdas a recalcular a 10 m se eligen por AOI.
+    Los resultados por celda son los mismos que por AOI: cada píxel del mosaico solo depende de las
+    escenas que lo cubren.
+
+    Args:
+        aois: lista de AOIData
+        date_before, current_date: fechas 'YYYY-MM-DD'
+
+    Returns:
+        dict: aoi_name -> {"dw_before", "dw_current", "transitions", "coverage", "recomputed", "cells"}
+    """
+    if not aois:
+        return {}
+    authenticate_gee()
+    bounds = (
+        min(a.bounds[0] for a in aois), min(a.bounds[1] for a in aois),
+        max(a.bounds[2] for a in aois), max(a.bounds[3] for a in aois)
+    )
+    dw_before = get_dynamic_world_image(bounds, date_before, scene_ids=dw_scene_ids(aois, date_before))
+    dw_current = get_dynamic_world_image(bounds, current_date, scene_ids=dw_scene_ids(aois, current_date))
+    img_all = transition_image(dw_before, dw_current).addBands(coverage_image(dw_before, dw_current))
+    index_img = spectral_image(
+        bounds, date_before, current_date,
+        scene_ids=(s2_scene_ids(aois, date_before), s2_scene_ids(aois, current_date))
+    )
+
+    # Clave única por celda: "aoi_name::grid_id" (reduceRegions devuelve la propiedad como texto).
+    # Con recálculo incremental solo entran las celdas cuyas escenas cambiaron
+    incremental = incremental_enabled()
+    ee_geoms, cell_of, grid_ids, signatures = {}, {}, {}, {}
+    per_aoi, recomputed = {}, {}
+    for aoi in aois:
+        grid_ids[aoi.name] = [gid for gid in aoi.grid["grid_id"] if gid in aoi.ee_geometries]
+        changed = grid_ids[aoi.name]
+        per_aoi[aoi.name] = {}
+        if incremental:
+            try:
+                signatures[aoi.name] = cell_signatures(aoi, date_before, current_date)
+                per_aoi[aoi.name], changed = split_cached(aoi.name, changed, signatures[aoi.name])
+            except Exception as e:
+                log(f"⚠️ Sin firmas de celdas para {aoi.name} (se recalcula todo): {e}", "warning")
+        recomputed[aoi.name] = len(changed)
+        for gid in changed:
+            key = f"{aoi.name}::{gid}"
+            ee_geoms[key] = aoi.ee_geometries[gid]
+            cell_of[key] = (aoi.name, gid)
+
+    screening = {aoi.name: _use_screening(None, aoi) for aoi in aois}
+    keys = list(ee_geoms)
+    if any(screening.values()) and keys:
+        # Pasada gruesa conjunta; la selección de celdas a recalcular (umbral, top N) se hace por AOI
+        coarse = _coarse_counts(img_all, ee_geoms, keys, index_img)
+        refine = []
+        for aoi in aois:
+            aoi_keys = [k for k in keys if cell_of[k][0] == aoi.name]
+            if not screening[aoi.name]:
+                refine += aoi_keys
+                continue
+            gid_of = {cell_of[k][1]: k for k in aoi_keys}
+            aoi_coarse = {gid: coarse[k] for gid, k in gid_of.items()}
+            refine += [gid_of[gid] for gid in _refine_ids(aoi_coarse, list(gid_of), _stack_frames, _stack_screening_ids)]
+        exact = reduce_cells(img_all, ee_geoms, grid_ids=refine, index_img=index_img)
+        counts, exact_keys = {**coarse, **exact}, set(exact)
+        log(f"🔎 Screening conjunto: {len(exact)}/{len(keys)} celdas recalculadas a {DW_SCALE} m (resto a {SCREENING_SCALE} m)", "info")
+    else:
+        counts = reduce_cells(img_all, ee_geoms, index_img=index_img) if keys else {}
+        exact_keys = set(counts)
+    log(f"🧮 Reducción conjunta: {len(ee_geoms)} celdas de {len(aois)} AOIs en {-(-len(ee_geoms) // CELL_BATCH_SIZE)} solicitudes", "success")
+
+    fresh = {aoi.name: {} for aoi in aois}
+    # Las celdas reutilizadas del registro son exactas (solo se guardan conteos a 10 m)
+    exact_ids = {name: set(cached) for name, cached in per_aoi.items()}
+    for key, stats in counts.items():
+        name, gid = cell_of[key]
+        fresh[name][gid] = stats
+        if key in exact_keys:
+            exact_ids[name].add(gid)
+    for name, aoi_counts in fresh.items():
+        per_aoi[name].update(aoi_counts)
+        if name in signatures:
+            store_counts(name, {gid: c for gid, c in aoi_counts.items() if gid in exact_ids[name]}, signatures[name])
+            log_recomputed(name, recomputed[name], len(grid_ids[name]))
+
+    out = {}
+    for name, aoi_counts in per_aoi.items():
+        df_trans = transitions_from_counts(aoi_counts, grid_ids[name])
+        df_cov = add_coverage_deltas(coverage_from_counts(aoi_counts, grid_ids[name]))
+        if screening[name]:
+            df_trans, df_cov = _mark_exact(df_trans, exact_ids[name]), _mark_exact(df_cov, exact_ids[name])
+        out[name] = {
+            "dw_before": dw_before,
+            "dw_current": dw_current,
+            "transitions": df_trans,
+            "coverage": df_cov,
+            "recomputed": recomputed[name],
+            "cells": len(grid_ids[name]),
+        }
+    return out
+
 def get_alert_grids(df_transitions, aoi_name, min_threshold=None, top_n=None, combine_metrics=None):
     """
     Filtra grillas para alertar basado en enfoque híbrido:
@@ -146,10 +537,9 @@ def get_alert_grids(df_transitions, aoi_name, min_threshold=None, top_n=None, co
     """
     min_threshold = min_threshold or ALERT_THRESHOLD_PP
     top_n = top_n or ALERT_TOP_N_GRIDS
-    combine_metrics = combine_metrics if combine_metrics is not None else ALERT_COMBINE_METRICS
     
     # Caso especial: Altiplano siempre alertar todas las grillas
-    if "altiplano" in aoi_name.lower():
+    if is_all_grids_aoi(aoi_name):
         log(f"📍 {aoi_name}: Generando mapas para TODAS las grillas (caso especial Altiplano)", "info")
         return df_transitions, df_transitions["grid_id"].tolist()
     
@@ -158,24 +548,16 @@ def get_alert_grids(df_transitions, aoi_name, min_threshold=None, top_n=None, co
         log(f"⚠️ {aoi_name}: Sin datos de transiciones", "warning")
         return pd.DataFrame(), []
     
-    # Combinar métricas en un score único
-    if combine_metrics:
-        # Usar el máximo de ambas métricas como indicador de severidad
-        df_transitions["alert_score"] = df_transitions[["pct_1_a_otro_clase1", "pct_5_a_otro_no1_clase5"]].max(axis=1)
-    else:
-        # Usar solo cambio de bosques
-        df_transitions["alert_score"] = df_transitions["pct_1_a_otro_clase1"]
-    
-    # Filtrar por umbral mínimo
-    df_above_threshold = df_transitions[df_transitions["alert_score"] >= min_threshold].copy()
+    # Evaluación vectorizada (alert_score + top N sobre el umbral) en el motor de alertas
+    alerts = evaluate_alerts(aoi_name, df_transitions=df_transitions, min_threshold=min_threshold, top_n=top_n, combine_metrics=combine_metrics)
+    selected = alerts[alerts["alerta_transiciones"]].sort_values("rank_alerta")
     
-    if df_above_threshold.empty:
+    if selected.empty:
         log(f"⚠️ {aoi_name}: No hay grillas por encima del umbral {min_threshold}%", "warning")
         # Si no hay grillas sobre el umbral, retornar vacío (no alertar)
         return pd.DataFrame(), []
     
-    # Seleccionar top N sobre el umbral
-    alert_grids = df_above_threshold.nlargest(top_n, "alert_score")
+    alert_grids = selected[["grid_id", "alert_score"]].merge(df_transitions, on="grid_id", how="left")
     alert_grid_ids = alert_grids["grid_id"].tolist()
     
     log(
@@ -187,7 +569,42 @@ def get_alert_grids(df_transitions, aoi_name, min_threshold=None, top_n=None, co
     return alert_grids, alert_grid_ids
 
 
-def compute_coverage_distribution(dw_before, dw_current, grid_path):
+def coverage_image(dw_before, dw_current):
+    """Una banda binaria por clase (0-8) y periodo; su suma por celda da los conteos por clase."""
+    bands = []
+    for class_num in range(9):
+        bands.append(dw_before.eq(class_num).rename(f"class_{class_num}_t1"))
+        bands.append(dw_current.eq(class_num).rename(f"class_{class_num}_t2"))
+    return ee.Image.cat(bands)
+
+
+def coverage_from_counts(counts, grid_ids):
+    """
+    DataFrame de porcentajes por clase a partir de los conteos por celda (grid_id -> {banda: suma}).
+    Si los conteos traen estadísticas espectrales (reduce_cells con index_img), se agregan sus columnas.
+    """
+    results = []
+    for grid_id in grid_ids:
+        stats = counts.get(grid_id, {})
+        result_row = {"grid_id": grid_id}
+        if stats is None:
+            results.append(result_row)
+            continue
+        for period in ("t1", "t2"):
+            n_total = sum(stats.get(f"class_{i}_{period}", 0) for i in range(9))
+            for class_num in range(9):
+                n_class = stats.get(f"class_{class_num}_{period}", 0)
+                pct = 100 * n_class / n_total if n_total > 0 else 0
+                result_row[f"class_{class_num}_{period}_pct"] = round(pct, 2)
+        results.append(result_row)
+    columns = ["grid_id"] + [f"class_{c}_{p}_pct" for p in ("t1", "t2") for c in range(9)]
+    df = pd.DataFrame(results, columns=columns)
+    if any(stats and any(is_spectral(band) for band in stats) for stats in counts.values()):
+        df = df.merge(spectral_from_counts(counts, grid_ids), on="grid_id", how="left")
+    return mark_failed(df, counts)
+
+
+def compute_coverage_distribution(dw_before, dw_current, grid_path, screening=None, index_img=None):
     """
     Calcula la distribución de clases (0-8) de Dynamic World para cada grilla en t1 y t2.
     
@@ -197,108 +614,76 @@ def compute_coverage_distribution(dw_before, dw_current, grid_path):
     Devuelve un DataFrame con porcentaje de cada clase por grilla:
       grid_id, class_0_t1, class_1_t1, ..., class_8_t1,
                class_0_t2, class_1_t2, ..., class_8_t2
-    """
-    grid_gdf = gpd.read_file(grid_path).to_crs(epsg=4326)
-    results = []
     
-    # Crear bandas para cada clase en t1 y t2
-    dw_images = {}
-    for class_num in range(9):
-        dw_images[f"class_{class_num}_t1"] = dw_before.eq(class_num).rename(f"class_{class_num}_t1")
-        dw_images[f"class_{class_num}_t2"] = dw_current.eq(class_num).rename(f"class_{class_num}_t2")
+    screening: si True, solo se recalculan a 10 m las celdas cuya disminución de clase 1 o 5
+               (estimada a SCREENING_SCALE) está cerca del umbral de alerta. Si None, usa config
+    index_img: imagen de índices espectrales (ver spectral_indices.spectral_image); sus estadísticas
+               se agregan como columnas en la misma reducción
+    """
+    grid_gdf = load_grid(grid_path)
+    ee_geoms = load_ee_geometries(grid_path)
+    grid_ids = [gid for gid in grid_gdf["grid_id"] if gid in ee_geoms]
     
-    # Combinar todas las bandas
-    img_all = None
-    for band_name, band in dw_images.items():
-        if img_all is None:
-            img_all = band
-        else:
-            img_all = img_all.addBands(band)
+    # Una banda por clase en t1 y t2
+    img_all = coverage_image(dw_before, dw_current)
     
-    # Iterar sobre cada celda de la grilla
-    for _, row in grid_gdf.iterrows():
-        geom = row.geometry
-        if geom.is_empty:
-            continue
-        if geom.geom_type == "MultiPolygon":
-            geom = unary_union([p for p in geom.geoms if not p.is_empty])
-        
-        ee_geom = ee.Geometry(geom.__geo_interface__)
-        grid_id = row.get("grid_id", _)
-        
-        try:
-            # Contar píxeles válidos
-            count_valid = dw_before.reduceRegion(
-                reducer=ee.Reducer.count(),
-                geometry=ee_geom,
-                scale=10,
-                maxPixels=1e13
-            ).getInfo()
-            
-            if not count_valid:
-                log(f"⚠️ Grid {grid_id} sin píxeles válidos (fue omitida).", "warning")
-                continue
-            
-            # Reducir regiones (sumar píxeles por clase)
-            stats = img_all.reduceRegion(
-                reducer=ee.Reducer.sum(),
-                geometry=ee_geom,
-                scale=10,
-                maxPixels=1e13
-            ).getInfo() or {}
-            
-            # Extraer porcentajes
-            result_row = {"grid_id": grid_id}
-            n_total_t1 = sum(stats.get(f"class_{i}_t1", 0) for i in range(9))
-            n_total_t2 = sum(stats.get(f"class_{i}_t2", 0) for i in range(9))
-            
-            # Porcentajes por clase en t1
-            for class_num in range(9):
-                n_class_t1 = stats.get(f"class_{class_num}_t1", 0)
-                pct_t1 = 100 * n_class_t1 / n_total_t1 if n_total_t1 > 0 else 0
-                result_row[f"class_{class_num}_t1_pct"] = round(pct_t1, 2)
-            
-            # Porcentajes por clase en t2
-            for class_num in range(9):
-                n_class_t2 = stats.get(f"class_{class_num}_t2", 0)
-                pct_t2 = 100 * n_class_t2 / n_total_t2 if n_total_t2 > 0 else 0
-                result_row[f"class_{class_num}_t2_pct"] = round(pct_t2, 2)
-            
-        except Exception as e:
-            log(f"⚠️ Error en grid {grid_id}: {e}", "warning")
-            result_row = {"grid_id": grid_id}
-            for class_num in range(9):
-                result_row[f"class_{class_num}_t1_pct"] = 0
-                result_row[f"class_{class_num}_t2_pct"] = 0
-        
-        results.append(result_row)
+    if _use_screening(screening, grid_path):
+        counts, exact_ids = _screened_counts(
+            img_all, ee_geoms, grid_ids, lambda c, ids: _with_pp(coverage_from_counts(c, ids)),
+            lambda df: coverage_screening_ids(df, SCREENING_MARGIN_PP), "coberturas", index_img=index_img
+        )
+        df = coverage_from_counts(counts, grid_ids)
+        df["exacto"] = df["grid_id"].isin(exact_ids)
+    else:
+        df = coverage_from_counts(reduce_cells(img_all, ee_geoms, grid_ids=grid_ids, index_img=index_img), grid_ids)
     
-    df = pd.DataFrame(results)
     log(f"✅ Cobertura calculada: {len(df)} celdas procesadas.", "success")
     return df
 
-
-
-
-def generate_coverage_csv(dw_before, dw_current, grid_path, date_before, current_date, output_path):
+def generate_coverage_csv(dw_before, dw_current, grid_path, date_before, current_date, output_path, store=None):
     """
-    Genera CSV con distribución de clases (0-8) de Dynamic World por grilla en t1 y t2.
+    Genera CSV con distribución de clases (0-8) de Dynamic World e índices de Sentinel-2 por grilla en t1 y t2.
 
     Columnas:
       - grid_id
       - Porcentaje de cada clase (0-8) en t1 y t2
+      - NDVI, NBR y NDMI (media, mediana, p10, p90) en t1 y t2, y delta de media y mediana
+        (si SPECTRAL_INDICES_ENABLED)
       - Suma de todas las categorías en t1 y t2
       - Diferencia entre coberturas en t1 y t2 para cada clase
 
     Args:
         dw_before, dw_current: Imágenes de Dynamic World (EE Image)
-        grid_path: Ruta al GeoJSON de grilla
-        date_before, current_date: Fechas en formato 'YYYY-MM-DD' (no se usan)
-        output_path: Ruta donde guardar el CSV
+        grid_path: Ruta al GeoJSON de grilla o AOIData del registro
+        date_before, current_date: Fechas en formato 'YYYY-MM-DD' (ventanas de los compuestos S2)
+        output_path: Ruta donde guardar el CSV (clave del artefacto si se da store)
+        store: OutputStore de destino (ver src/output_store.py). Si None, se escribe en disco
     """
     # Calcular distribuciones de clase
-    df_coverage = compute_coverage_distribution(dw_before, dw_current, grid_path)
+    index_img = spectral_image(grid_path, date_before, current_date)
+    df_coverage = add_coverage_deltas(compute_coverage_distribution(dw_before, dw_current, grid_path, index_img=index_img))
+    write_coverage_csv(df_coverage, output_path, store=store)
+    return df_coverage
+
+
+def compute_spectral_statistics(grid_path, date_before, current_date):
+    """
+    Solo los índices espectrales por celda (sin conteos DW), para las tablas de coberturas que no
+    salen de reduce_cells con index_img (ej: GRID_SIZE calculado como nivel de grillas anidadas).
 
+    Devuelve el DataFrame de spectral_from_counts, o None si SPECTRAL_INDICES_ENABLED es False.
+    """
+    index_img = spectral_image(grid_path, date_before, current_date)
+    if index_img is None:
+        return None
+    ee_geoms = load_ee_geometries(grid_path)
+    grid_ids = [gid for gid in load_grid(grid_path)["grid_id"] if gid in ee_geoms]
+    counts = reduce_cells(index_img, ee_geoms, scale=SPECTRAL_INDEX_SCALE, grid_ids=grid_ids, reducer=index_reducer())
+    return spectral_from_counts(counts, grid_ids)
+
+
+def add_coverage_deltas(df_coverage):
+    """Agrega sum_t1/sum_t2 y las diferencias pp_class_N (t2 - t1) a una tabla de coberturas."""
     # Calcular suma de todas las categorías en t1 y t2
     df_coverage["sum_t1"] = df_coverage[[f"class_{i}_t1_pct" for i in range(9)]].sum(axis=1)
     df_coverage["sum_t2"] = df_coverage[[f"class_{i}_t2_pct" for i in range(9)]].sum(axis=1)
@@ -307,11 +692,19 @@ def generate_coverage_csv(dw_before, dw_current, grid_path, date_before, current
     for class_num in range(9):
         class_name = f"class_{class_num}"
         df_coverage[f"pp_{class_name}"] = df_coverage[f"{class_name}_t2_pct"] - df_coverage[f"{class_name}_t1_pct"]
+    return df_coverage
 
-    # Guardar
-    import os
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df_coverage.to_csv(output_path, index=False)
 
-    log(f"✅ CSV de coberturas guardado: {output_path}", "success")
-    return df_coverage
+def write_coverage_csv(df_coverage, output_path, store=None):
+    """Guarda la tabla de coberturas (salida secundaria: un error al escribir no impide usarla en memoria)."""
+    import os
+    try:
+        if store is not None:
+            with store.open(output_path) as f:
+                df_coverage.to_csv(f, index=False)
+        else:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            df_coverage.to_csv(output_path, index=False)
+        log(f"✅ CSV de coberturas guardado: {output_path}", "success")
+    except Exception as e:
+        log(f"⚠️ No se pudo guardar el CSV de coberturas {output_path}: {e}", "warning")
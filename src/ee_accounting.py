@@ -0,0 +1,140 @@
+"""
+Contabilidad de llamadas a Earth Engine por AOI y etapa, con un presupuesto opcional por ejecución.
+
+Cada llamada que ejecuta cómputo en Earth Engine (getInfo, las reducciones que materializa y
+download_ee_image) pasa por tracked(): se registran conteo, histograma de latencia, tamaño de la
+respuesta y tipos de error bajo el contexto actual (set_context(aoi=..., stage=...)).
+
+Con EE_CALL_BUDGET, al acercarse al presupuesto se degradan primero los productos prescindibles según
+EE_BUDGET_DEGRADE (PNGs de Sentinel, luego PNGs de DW, luego focos); las estadísticas nunca se omiten.
+"""
+
+import csv
+import json
+import os
+import time
+
+from src.aux_utils import log
+from src.config import EE_CALL_BUDGET, EE_BUDGET_DEGRADE, EE_LATENCY_BUCKETS
+
+_context = {"aoi": None, "stage": None}
+# (aoi, etapa, tipo) -> estadísticas
+_stats = {}
+# categoría -> productos omitidos por presupuesto
+_skipped = {}
+
+_KEEP = object()
+
+
+def set_context(aoi=_KEEP, stage=_KEEP):
+    """AOI y etapa a los que se atribuyen las llamadas siguientes (los argumentos omitidos no cambian)."""
+    if aoi is not _KEEP:
+        _context["aoi"] = aoi
+    if stage is not _KEEP:
+        _context["stage"] = stage
+
+
+def _entry(kind):
+    key = (_context["aoi"], _context["stage"], kind)
+    if key not in _stats:
+        _stats[key] = {
+            "llamadas": 0, "errores": {}, "segundos": 0.0, "bytes": 0,
+            "latencia": [0] * (len(EE_LATENCY_BUCKETS) + 1),
+        }
+    return _stats[key]
+
+
+def _json_size(result):
+    try:
+        return len(json.dumps(result))
+    except (TypeError, ValueError):
+        return 0
+
+
+def tracked(kind, fn, *args, size_fn=None, **kwargs):
+    """Ejecuta fn(*args, **kwargs) registrando la llamada bajo el tipo kind."""
+    entry = _entry(kind)
+    entry["llamadas"] += 1
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        name = type(e).__name__
+        entry["errores"][name] = entry["errores"].get(name, 0) + 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        entry["segundos"] += elapsed
+        entry["latencia"][sum(elapsed > b for b in EE_LATENCY_BUCKETS)] += 1
+    if size_fn is not None:
+        entry["bytes"] += size_fn(result)
+    return result
+
+
+def get_info(obj, kind="getInfo"):
+    """obj.getInfo() contabilizado (kind identifica la consulta, ej: "reduceRegions")."""
+    return tracked(kind, obj.getInfo, size_fn=_json_size)
+
+
+def download_ee_image(download_fn, **kwargs):
+    """download_fn(**kwargs) (ej: geemap.download_ee_image) contabilizado con el tamaño del archivo."""
+    filename = kwargs.get("filename")
+    return tracked(
+        "download_ee_image", download_fn,
+        size_fn=lambda _: os.path.getsize(filename) if filename and os.path.exists(filename) else 0,
+        **kwargs,
+    )
+
+
+def total_calls():
+    return sum(s["llamadas"] for s in _stats.values())
+
+
+def budget_allows(category):
+    """
+    False si la categoría (ej: "sentinel_png") debe omitirse porque las llamadas de la ejecución
+    alcanzaron su fracción de EE_CALL_BUDGET. Sin presupuesto o sin umbral para la categoría: True.
+    """
+    threshold = EE_BUDGET_DEGRADE.get(category)
+    if not EE_CALL_BUDGET or threshold is None or total_calls() < threshold * EE_CALL_BUDGET:
+        return True
+    if category not in _skipped:
+        log(f"⚠️ Presupuesto de Earth Engine: {total_calls()}/{EE_CALL_BUDGET} llamadas, se omiten {category}", "warning")
+    _skipped[category] = _skipped.get(category, 0) + 1
+    return False
+
+
+def records():
+    """Filas (una por AOI, etapa y tipo de llamada) para exportar."""
+    labels = [f"lat_le_{b}s" for b in EE_LATENCY_BUCKETS] + [f"lat_gt_{EE_LATENCY_BUCKETS[-1]}s"]
+    rows = []
+    for (aoi, stage, kind), s in sorted(_stats.items(), key=lambda item: tuple(str(k) for k in item[0])):
+        rows.append({
+            "aoi": aoi, "etapa": stage, "tipo": kind,
+            "llamadas": s["llamadas"],
+            "errores": sum(s["errores"].values()),
+            "tipos_error": json.dumps(s["errores"]) if s["errores"] else "",
+            "segundos": round(s["segundos"], 2),
+            "bytes": s["bytes"],
+            **dict(zip(labels, s["latencia"])),
+        })
+    return rows
+
+
+def export(store, key_prefix):
+    """Escribe <key_prefix>.json (totales, omitidos y detalle) y <key_prefix>.csv (detalle) en el store."""
+    rows = records()
+    summary = {
+        "llamadas": total_calls(),
+        "presupuesto": EE_CALL_BUDGET,
+        "omitidos": dict(_skipped),
+        "detalle": rows,
+    }
+    store.write_text(f"{key_prefix}.json", json.dumps(summary, indent=2, ensure_ascii=False))
+    if rows:
+        with store.open(f"{key_prefix}.csv") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    log(f"📊 Earth Engine: {summary['llamadas']} llamadas, {sum(r['errores'] for r in rows)} con error → {key_prefix}.json", "info")
+    return summary
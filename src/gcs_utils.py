@@ -2,51 +2,269 @@
 """Utilidades para manejo de Google Cloud Storage"""
 import os
 import base64
+import gzip
+import hashlib
+import mimetypes
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from google.cloud import storage
 from src.aux_utils import log
+from src.config import GCS_UPLOAD_WORKERS, GCS_UPLOAD_RETRIES, GCS_GZIP_TEXT
+from src.resilience import call_with_retry
+
+# Cliente compartido por todo el proceso (storage.Client es thread-safe para uploads)
+_storage_client = None
+_storage_client_lock = threading.Lock()
 
 def get_storage_client():
-    """Inicializa y retorna cliente de GCS"""
-    return storage.Client()
+    """
+    Retorna el cliente de GCS compartido (se inicializa una sola vez por proceso).
+    Respeta STORAGE_EMULATOR_HOST para apuntar a un emulador local.
+    """
+    global _storage_client
+    with _storage_client_lock:
+        if _storage_client is None:
+            _storage_client = storage.Client()
+    return _storage_client
+
+def set_storage_client(client):
+    """Reemplaza el cliente compartido (ej: cliente falso sobre un directorio local en pruebas)"""
+    global _storage_client
+    with _storage_client_lock:
+        _storage_client = client
+
+# Metadata con el MD5 del archivo local original (se conserva aunque el objeto se guarde transformado)
+SOURCE_MD5_KEY = "source-md5"
+
+def file_md5_b64(path, chunk_size=1 << 20):
+    """MD5 de un archivo local en base64 (mismo formato que blob.md5_hash)"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode("utf-8")
 
-def upload_file_to_gcs(local_path, bucket_name, blob_name):
+def file_crc32c_b64(path, chunk_size=1 << 20):
+    """CRC32C de un archivo local en base64 (mismo formato que blob.crc32c)"""
+    import google_crc32c
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode("utf-8")
+
+# === Políticas de publicación por tipo de artefacto ===
+# Artefactos de texto que se suben comprimidos con Content-Encoding: gzip
+GZIP_EXTENSIONS = {".html", ".json", ".geojson", ".csv", ".js", ".css", ".svg", ".txt"}
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+    ".geojson": "application/geo+json; charset=utf-8",
+    ".csv": "text/csv; charset=utf-8",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".svg": "image/svg+xml",
+}
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"  # PNGs con hash de contenido (mapas/assets/)
+CACHE_REPORT = "public, max-age=300"                     # Reporte del periodo y mapas HTML
+CACHE_DEFAULT = "public, max-age=3600"                   # CSV, GeoJSON, PNGs sin hash
+
+def artifact_policy(blob_name):
     """
-    Sube un archivo local a GCS
+    Content-Type, Cache-Control y compresión según la clase de artefacto
+    
+    Returns:
+        dict: {"content_type", "cache_control", "gzip"}
+    """
+    ext = Path(blob_name).suffix.lower()
+    parts = blob_name.split("/")
+    if "assets" in parts[:-1]:
+        cache_control = CACHE_IMMUTABLE
+    elif ext == ".html" or parts[-1].startswith("reporte_paramos_"):
+        cache_control = CACHE_REPORT
+    else:
+        cache_control = CACHE_DEFAULT
+    return {
+        "content_type": CONTENT_TYPES.get(ext) or mimetypes.guess_type(blob_name)[0] or "application/octet-stream",
+        "cache_control": cache_control,
+        "gzip": GCS_GZIP_TEXT and ext in GZIP_EXTENSIONS,
+    }
+
+def _upload_blob(blob, blob_name, local_path=None, data=None):
+    """
+    Sube un archivo (local_path) o bytes (data) aplicando la política del artefacto.
+    Los artefactos de texto se comprimen con gzip (mtime=0, salida determinista) si reduce el tamaño.
+    
+    Returns:
+        int: bytes transferidos
+    """
+    policy = artifact_policy(blob_name)
+    blob.cache_control = policy["cache_control"]
+    if policy["gzip"]:
+        if data is None:
+            data = Path(local_path).read_bytes()
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            blob.content_encoding = "gzip"
+            blob.upload_from_string(compressed, content_type=policy["content_type"])
+            return len(compressed)
+    if data is not None:
+        blob.upload_from_string(data, content_type=policy["content_type"])
+        return len(data)
+    blob.upload_from_filename(local_path, content_type=policy["content_type"])
+    return os.path.getsize(local_path)
+
+def upload_file_to_gcs(local_path, bucket_name, blob_name, client=None, source_md5=None, retries=None, return_bytes=False):
+    """
+    Sube un archivo local a GCS, reintentando los errores transitorios (ver src/resilience.py)
     
     Args:
         local_path: Ruta del archivo local
         bucket_name: Nombre del bucket (sin gs://)
         blob_name: Ruta dentro del bucket (ej: "2025_1/paramo_sumapaz/mapas/mapa.html")
+        client: cliente de GCS (por defecto el compartido)
+        source_md5: MD5 (base64) del archivo si ya se calculó
+        retries: reintentos ante errores transitorios (default: GCS_UPLOAD_RETRIES)
+        return_bytes: si True, devuelve también los bytes transferidos (comprimidos con gzip para texto)
     
     Returns:
-        str: URL pública del archivo o ruta gs://
+        str: URL pública del archivo o ruta gs:// (tupla (ruta, bytes) con return_bytes)
     """
     try:
-        client = get_storage_client()
+        client = client or get_storage_client()
         bucket = client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
+        # Guardar el checksum del archivo local para sincronizaciones posteriores
+        blob.metadata = {SOURCE_MD5_KEY: source_md5 or file_md5_b64(local_path)}
         
-        blob.upload_from_filename(local_path)
+        sent = call_with_retry(
+            _upload_blob, blob, blob_name, local_path=local_path, backend="gcs",
+            retries=GCS_UPLOAD_RETRIES if retries is None else retries, label=f"Subida de {os.path.basename(local_path)}"
+        )
         
         gcs_path = f"gs://{bucket_name}/{blob_name}"
         log(f"✓ Subido: {os.path.basename(local_path)} → {gcs_path}", "success")
-        return gcs_path
+        return (gcs_path, sent) if return_bytes else gcs_path
     except Exception as e:
         log(f"✗ Error al subir {local_path}: {str(e)}", "error")
         raise
 
-def upload_directory_to_gcs(local_dir, bucket_name, gcs_prefix):
+def upload_files_to_gcs(files, bucket_name, max_workers=None, retries=None, client=None, checksums=None):
+    """
+    Sube en paralelo una lista de archivos a GCS con un cliente compartido
+    
+    Args:
+        files: lista de tuplas (ruta_local, blob_name)
+        bucket_name: Nombre del bucket
+        max_workers: número de uploads concurrentes (default: GCS_UPLOAD_WORKERS)
+        retries: reintentos por archivo (default: GCS_UPLOAD_RETRIES)
+        client: cliente de GCS (default: el compartido). Cualquier objeto con
+                client.bucket(name).blob(name) que implemente upload_from_filename y
+                upload_from_string sirve como fake
+        checksums: dict opcional ruta_local -> MD5 base64 ya calculado
+    
+    Returns:
+        tuple: (dict ruta_local -> ruta gs://, dict resumen con files, bytes, seconds, mb_per_s, failed)
+    """
+    max_workers = max_workers or GCS_UPLOAD_WORKERS
+    retries = GCS_UPLOAD_RETRIES if retries is None else retries
+    client = client or get_storage_client()
+    checksums = checksums or {}
+    
+    uploaded, failed = {}, {}
+    total_bytes = 0
+    start = time.perf_counter()
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(upload_file_to_gcs, str(local), bucket_name, blob_name, client, checksums.get(str(local)), retries, True): (str(local), blob_name)
+            for local, blob_name in files
+        }
+        for future in as_completed(futures):
+            local, blob_name = futures[future]
+            try:
+                uploaded[local], sent = future.result()
+                # Bytes transferidos (tamaño gzip para HTML/JSON/CSV/GeoJSON), no el tamaño en disco
+                total_bytes += sent
+            except Exception as e:
+                failed[local] = str(e)
+    
+    elapsed = time.perf_counter() - start
+    summary = {
+        "files": len(uploaded),
+        "bytes": total_bytes,
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(total_bytes / 1e6 / elapsed, 2) if elapsed > 0 else 0,
+        "failed": failed,
+    }
+    log(
+        f"📦 Lote GCS: {summary['files']} archivos, {total_bytes / 1e6:.1f} MB en {elapsed:.1f}s "
+        f"({summary['mb_per_s']} MB/s, {max_workers} en paralelo, {len(failed)} fallidos)",
+        "success" if not failed else "warning"
+    )
+    return uploaded, summary
+
+def list_remote_checksums(bucket_name, prefix, client=None):
     """
-    Sube un directorio completo a GCS manteniendo la estructura
+    Lista (en una sola consulta paginada) los objetos bajo un prefijo con sus checksums
+    
+    Returns:
+        dict: blob_name -> {"source_md5", "md5", "crc32c"}
+    """
+    client = client or get_storage_client()
+    remote = {}
+    for blob in client.list_blobs(bucket_name, prefix=f"{prefix.rstrip('/')}/"):
+        remote[blob.name] = {
+            "source_md5": (blob.metadata or {}).get(SOURCE_MD5_KEY),
+            "md5": blob.md5_hash,
+            "crc32c": blob.crc32c,
+        }
+    return remote
+
+def _is_unchanged(local_md5, local_path, remote):
+    """Compara el archivo local con los checksums del objeto remoto"""
+    if remote.get("source_md5"):
+        return remote["source_md5"] == local_md5
+    if remote.get("md5"):
+        return remote["md5"] == local_md5
+    if remote.get("crc32c"):
+        # Objetos compuestos no tienen MD5
+        return remote["crc32c"] == file_crc32c_b64(local_path)
+    return False
+
+def delete_gcs_blobs(bucket_name, blob_names, client=None):
+    """Elimina una lista de blobs en un solo lote"""
+    if not blob_names:
+        return 0
+    client = client or get_storage_client()
+    bucket = client.bucket(bucket_name)
+    bucket.delete_blobs([bucket.blob(name) for name in blob_names], on_error=lambda blob: log(f"✗ No se pudo eliminar {blob.name}", "warning"))
+    log(f"🗑 Eliminados {len(blob_names)} objetos obsoletos en gs://{bucket_name}", "info")
+    return len(blob_names)
+
+def upload_directory_to_gcs(local_dir, bucket_name, gcs_prefix, max_workers=None, retries=None, client=None, sync=False, delete_stale=False, exclude=()):
+    """
+    Sube un directorio completo a GCS manteniendo la estructura (uploads en paralelo)
     
     Args:
         local_dir: Directorio local a subir
         bucket_name: Nombre del bucket
         gcs_prefix: Prefijo en GCS (ej: "2025_1/paramo_sumapaz")
+        max_workers, retries, client: ver upload_files_to_gcs
+        sync: si True, solo sube archivos nuevos o modificados comparando el MD5 local con los
+              checksums de los objetos existentes (un solo listado por prefijo)
+        delete_stale: con sync=True, elimina objetos bajo el prefijo que ya no existen localmente
+        exclude: subcarpetas de local_dir (rutas relativas) que no se suben
     
     Returns:
         dict: Mapeo de archivos locales a rutas GCS
+    
+    Raises:
+        RuntimeError: si algún archivo no se pudo subir tras los reintentos
+                      (después de intentar subir todos los demás)
     """
     uploaded_files = {}
     local_path = Path(local_dir)
@@ -55,14 +273,39 @@ def upload_directory_to_gcs(local_dir, bucket_name, gcs_prefix):
         log(f"⚠ Directorio no existe: {local_dir}", "warning")
         return uploaded_files
     
+    excluded = [Path(p) for p in exclude]
+    files = []
     for file_path in local_path.rglob("*"):
         if file_path.is_file():
             # Calcular ruta relativa
             rel_path = file_path.relative_to(local_path)
+            if any(p == rel_path or p in rel_path.parents for p in excluded):
+                continue
             blob_name = f"{gcs_prefix}/{rel_path}".replace("\\", "/")
-            
-            gcs_path = upload_file_to_gcs(str(file_path), bucket_name, blob_name)
-            uploaded_files[str(file_path)] = gcs_path
+            files.append((str(file_path), blob_name))
+    
+    checksums = {}
+    skipped = {}
+    if sync:
+        remote = list_remote_checksums(bucket_name, gcs_prefix, client=client)
+        pending = []
+        for local, blob_name in files:
+            checksums[local] = file_md5_b64(local)
+            if blob_name in remote and _is_unchanged(checksums[local], local, remote[blob_name]):
+                skipped[local] = f"gs://{bucket_name}/{blob_name}"
+            else:
+                pending.append((local, blob_name))
+        log(f"🔁 Sync gs://{bucket_name}/{gcs_prefix}: {len(pending)} nuevos/modificados, {len(skipped)} sin cambios", "info")
+        
+        if delete_stale:
+            local_blobs = {blob_name for _, blob_name in files}
+            delete_gcs_blobs(bucket_name, [name for name in remote if name not in local_blobs], client=client)
+        files = pending
+    
+    uploaded_files, summary = upload_files_to_gcs(files, bucket_name, max_workers=max_workers, retries=retries, client=client, checksums=checksums)
+    uploaded_files.update(skipped)
+    if summary["failed"]:
+        raise RuntimeError(f"{len(summary['failed'])} archivos no se pudieron subir a gs://{bucket_name}/{gcs_prefix}: {list(summary['failed'])}")
     
     return uploaded_files
 
@@ -0,0 +1,100 @@
+"""
+Preparación de geometrías de grilla y AOI según su destino:
+  - Visualización (HTML de mapas): simplificadas y con pocos decimales
+  - Earth Engine (reducciones por celda): sin simplificar por defecto, con precisión suficiente
+    para no alterar las estadísticas a escala de 10 m
+
+Cada celda se simplifica por separado (preserve_topology evita geometrías inválidas, no mantiene
+bordes compartidos): los bordes rectos interiores no cambian, pero los tramos recortados contra el AOI
+pueden divergir entre celdas vecinas y dejar huecos o solapes de hasta la tolerancia. Por eso las
+geometrías para Earth Engine no se simplifican por defecto.
+"""
+
+import json
+import numpy as np
+import shapely
+import geopandas as gpd
+from shapely.geometry import mapping
+from shapely.ops import unary_union
+from src.aux_utils import log
+
+# Valores por defecto (en grados, EPSG:4326), definidos en config.py
+from src.config import (
+    DISPLAY_GEOM_TOLERANCE as DISPLAY_TOLERANCE,
+    DISPLAY_GEOM_PRECISION as DISPLAY_PRECISION,
+    EE_GEOM_TOLERANCE as EE_TOLERANCE,
+    EE_GEOM_PRECISION as EE_PRECISION,
+)
+
+
+def geojson_size(geoms):
+    """Tamaño en bytes de la serialización GeoJSON de una secuencia de geometrías."""
+    return sum(len(json.dumps(mapping(g))) for g in geoms if g is not None and not g.is_empty)
+
+
+def simplify_and_quantize(geoms, tolerance=0.0, precision=None):
+    """
+    Simplifica (Douglas-Peucker preservando topología) y redondea coordenadas.
+
+    Args:
+        geoms: array/secuencia de geometrías shapely
+        tolerance: tolerancia de simplificación en unidades del CRS (0 = sin simplificar)
+        precision: número de decimales a conservar (None = sin redondear)
+
+    Returns:
+        np.ndarray de geometrías
+    """
+    geoms = np.asarray(geoms)
+    if tolerance and tolerance > 0:
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+    if precision is not None:
+        geoms = shapely.transform(geoms, lambda coords: np.round(coords, precision))
+    return geoms
+
+
+def _report_payload(label, before, after):
+    pct = 100 * (1 - after / before) if before else 0
+    log(f"Geometrías {label}: {before / 1024:.1f} KiB → {after / 1024:.1f} KiB (-{pct:.0f}%)", "info")
+
+
+def prepare_display_gdf(gdf, tolerance=DISPLAY_TOLERANCE, precision=DISPLAY_PRECISION, label="mapa"):
+    """
+    Devuelve una copia de gdf (EPSG:4326) con geometrías a resolución de visualización.
+    Los atributos se conservan; solo cambia la geometría. Reporta el tamaño antes/después.
+    """
+    if gdf.empty:
+        return gdf
+    original = np.asarray(gdf.geometry.values)
+    prepared = simplify_and_quantize(original, tolerance, precision)
+    _report_payload(label, geojson_size(original), geojson_size(prepared))
+    out = gdf.copy()
+    out["geometry"] = gpd.GeoSeries(prepared, index=gdf.index, crs=gdf.crs)
+    return out
+
+
+def prepare_ee_geometries(gdf, tolerance=EE_TOLERANCE, precision=EE_PRECISION, label="Earth Engine"):
+    """
+    Prepara las geometrías de la grilla para enviarlas a Earth Engine.
+    Las celdas vacías quedan como None y los MultiPolygon se unen igual que antes
+    de enviarse (unary_union de sus partes no vacías).
+
+    Returns:
+        list: geometrías shapely (o None) alineadas con las filas de gdf
+    """
+    geoms = []
+    for geom in gdf.geometry:
+        if geom is None or geom.is_empty:
+            geoms.append(None)
+            continue
+        if geom.geom_type == "MultiPolygon":
+            geom = unary_union([p for p in geom.geoms if not p.is_empty])
+        geoms.append(geom)
+
+    valid_idx = [i for i, g in enumerate(geoms) if g is not None]
+    if valid_idx:
+        original = [geoms[i] for i in valid_idx]
+        prepared = simplify_and_quantize(original, tolerance, precision)
+        _report_payload(label, geojson_size(original), geojson_size(prepared))
+        for i, g in zip(valid_idx, prepared):
+            geoms[i] = g
+    return geoms
@@ -0,0 +1,130 @@
+"""
+Grillas anidadas multi-resolución a partir de una sola pasada en Earth Engine.
+
+Los conteos de píxeles (transiciones y clases DW) se calculan una vez sobre una grilla base fina
+(GRID_ROLLUP_BASE_SIZE) y se suman en grillas más gruesas (GRID_ROLLUP_SIZES) con un índice
+padre-hijo: como los conteos son aditivos y todas las grillas del AOI comparten el origen de
+create_grid, los resultados de cada nivel son exactos sin trabajo adicional en Earth Engine.
+"""
+
+from src.aux_utils import log, create_grid
+from src.aoi_registry import load_ee_geometries
+from src.alert_utils import evaluate_alerts
+from src.spectral_indices import is_spectral
+from src.dw_utils import (
+    reduce_cells, transition_image, coverage_image, transitions_from_counts,
+    coverage_from_counts, add_coverage_deltas,
+)
+
+
+def build_level(base_grid, base_size, level_size, reference_grid=None):
+    """
+    Grilla de nivel level_size a partir de la grilla base (con columnas ix, iy de create_grid).
+
+    Args:
+        base_grid: grilla base (EPSG:4326) con grid_id, ix, iy
+        base_size, level_size: tamaños en metros (level_size múltiplo de base_size)
+        reference_grid: grilla existente de ese tamaño (ej: la del registro). Se reutilizan sus
+                        grid_id para que el nivel coincida con los mapas; si no tiene ix/iy o no
+                        todas las celdas del nivel están en ella, se lanza ValueError (nunca se
+                        devuelven ids posicionales para una grilla de referencia)
+
+    Returns:
+        (GeoDataFrame del nivel con grid_id, ix, iy; dict grid_id base -> grid_id del nivel)
+    """
+    if level_size % base_size:
+        raise ValueError(f"El tamaño {level_size} m no es múltiplo de la grilla base ({base_size} m)")
+    k = level_size // base_size
+
+    base = base_grid[["grid_id", "ix", "iy", "geometry"]].copy()
+    base["ix"] = base["ix"] // k
+    base["iy"] = base["iy"] // k
+
+    # La celda padre recortada al AOI es la unión de sus hijas recortadas
+    level = base.dissolve(by=["ix", "iy"], as_index=False)[["ix", "iy", "geometry"]]
+    # Mismo orden que create_grid (columna, luego fila) -> mismos grid_id que una grilla creada a ese tamaño
+    level = level.sort_values(["ix", "iy"]).reset_index(drop=True)
+    level["grid_id"] = range(1, len(level) + 1)
+
+    if reference_grid is not None:
+        if not {"ix", "iy"} <= set(reference_grid.columns):
+            raise ValueError(f"La grilla de {level_size} m no tiene columnas ix/iy: no se pueden conservar sus grid_id")
+        ref_ids = reference_grid.set_index(["ix", "iy"])["grid_id"]
+        mapped = level.set_index(["ix", "iy"]).index.map(ref_ids.to_dict())
+        if mapped.isna().any():
+            raise ValueError(f"{int(mapped.isna().sum())}/{len(level)} celdas del nivel {level_size} m no están en la grilla de referencia")
+        level["grid_id"] = list(mapped)
+
+    parent_ids = base.merge(level[["ix", "iy", "grid_id"]], on=["ix", "iy"], suffixes=("", "_nivel"))
+    parent_of = dict(zip(parent_ids["grid_id"], parent_ids["grid_id_nivel"]))
+    return level, parent_of
+
+
+def rollup_counts(counts, parent_of):
+    """
+    Suma los conteos por celda base (grid_id -> {banda: suma}) en sus celdas padre.
+    Una celda padre con alguna hija fallida (None) queda fallida. Las estadísticas espectrales
+    (medias, medianas, percentiles) no son aditivas y no se propagan a los niveles.
+    """
+    rolled, failed = {}, set()
+    for gid, stats in counts.items():
+        if stats is None:
+            failed.add(parent_of[gid])
+            continue
+        parent = rolled.setdefault(parent_of[gid], {})
+        for band, value in stats.items():
+            if not is_spectral(band):
+                parent[band] = parent.get(band, 0) + value
+    for parent_id in failed:
+        rolled[parent_id] = None
+    return rolled
+
+
+def compute_grid_levels(dw_before, dw_current, aoi_data, base_size, level_sizes, reference_grids=None):
+    """
+    Calcula transiciones, coberturas y alertas para cada nivel con una sola reducción sobre la grilla base.
+
+    Args:
+        dw_before, dw_current: imágenes DW (ee.Image)
+        aoi_data: AOIData del registro
+        base_size: tamaño de la grilla base (m)
+        level_sizes: tamaños de los niveles (m), múltiplos de base_size
+        reference_grids: {tamaño: grilla existente} cuyos grid_id se conservan (ver build_level). Un
+                         nivel cuya grilla de referencia no se puede mapear se omite
+
+    Returns:
+        dict: tamaño -> {"grid", "transitions", "coverage", "alerts"}
+    """
+    base_grid = create_grid(aoi_data.aoi, base_size)
+    ee_geoms = load_ee_geometries(base_grid)
+    base_ids = [gid for gid in base_grid["grid_id"] if gid in ee_geoms]
+
+    # Una sola pasada: bandas de transición y de clases apiladas
+    img_all = transition_image(dw_before, dw_current).addBands(coverage_image(dw_before, dw_current))
+    counts = reduce_cells(img_all, ee_geoms, grid_ids=base_ids)
+    log(f"🧮 Grilla base {base_size} m: {len(base_ids)} celdas reducidas para {len(level_sizes)} niveles", "info")
+
+    levels = {}
+    for size in sorted(set(level_sizes)):
+        try:
+            level_grid, parent_of = build_level(base_grid, base_size, size, reference_grid=(reference_grids or {}).get(size))
+        except ValueError as e:
+            # Sin los grid_id de la grilla de referencia el nivel apuntaría a otras celdas (alertas,
+            # mapas): se omite y esas estadísticas salen de la reducción por celda habitual
+            log(f"⚠️ Nivel {size} m omitido: {e}", "warning")
+            continue
+        level_counts = rollup_counts({gid: counts.get(gid, {}) for gid in base_ids}, parent_of)
+        level_ids = [gid for gid in level_grid["grid_id"] if gid in level_counts]
+
+        df_trans = transitions_from_counts(level_counts, level_ids)
+        df_cov = add_coverage_deltas(coverage_from_counts(level_counts, level_ids))
+        alerts = evaluate_alerts(aoi_data.name, df_transitions=df_trans, df_coverage=df_cov)
+        levels[size] = {"grid": level_grid, "transitions": df_trans, "coverage": df_cov, "alerts": alerts}
+        log(f"   Nivel {size} m: {len(level_ids)} celdas", "info")
+    return levels
+
+
+def level_table(level):
+    """Tabla por celda de un nivel: transiciones + coberturas + banderas de alerta."""
+    df = level["transitions"].merge(level["coverage"], on="grid_id", how="outer")
+    return df.merge(level["alerts"], on="grid_id", how="left") if not level["alerts"].empty else df
@@ -0,0 +1,129 @@
+"""
+Refinamiento adaptativo (quadtree) de las grillas alertadas para localizar focos de cambio.
+
+Cada grilla alertada se divide en 4 cuadrantes (10 km → 5 → 2.5 → 1.25 km) y solo se vuelven a dividir
+los cuadrantes cuyo alert_score supera el umbral, por lo que el costo en Earth Engine sigue al tamaño
+del cambio y no al área del AOI. Cada nivel se reduce en una sola pasada por lotes.
+
+Un foco (hotspot) es la celda más fina que supera el umbral: una celda sobre el umbral sin ningún
+cuadrante sobre el umbral (cambio disperso) o un cuadrante del tamaño mínimo.
+"""
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+from shapely.geometry import box
+
+from src.aux_utils import log
+from src.aoi_registry import load_ee_geometries
+from src.alert_utils import transition_score
+from src.dw_utils import reduce_cells, transition_image, transitions_from_counts
+from src.config import GRID_SIZE, ALERT_THRESHOLD_PP, ALERT_COMBINE_METRICS, HOTSPOT_MIN_SIZE, HOTSPOT_MIN_PIXELS
+
+HOTSPOT_COLUMNS = [
+    "hotspot_id", "grid_id", "nivel", "tamano_m", "n_validos",
+    "n_1_a_otro", "ha_1_a_otro", "pct_1_a_otro_clase1",
+    "n_5_a_otro_no1", "ha_5_a_otro_no1", "pct_5_a_otro_no1_clase5",
+    "alert_score", "lat", "lon",
+]
+
+
+def _quadrants(geom):
+    """Cuadrantes (EPSG:3857) de una celda recortada al AOI, sin las partes vacías."""
+    minx, miny, maxx, maxy = geom.bounds
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    quads = [box(minx, miny, midx, midy), box(midx, miny, maxx, midy), box(minx, midy, midx, maxy), box(midx, midy, maxx, maxy)]
+    return [(q, part) for q, part in enumerate(geom.intersection(quad) for quad in quads) if not part.is_empty]
+
+
+def _record(node, row, score):
+    return {
+        "hotspot_id": node["key"],
+        "grid_id": node["grid_id"],
+        "nivel": node["level"],
+        "tamano_m": node["size"],
+        "n_validos": row["n_validos"],
+        "n_1_a_otro": row["n_1_a_otro"],
+        "ha_1_a_otro": round(row["n_1_a_otro"] * 0.01, 2),
+        "pct_1_a_otro_clase1": row["pct_1_a_otro_clase1"],
+        "n_5_a_otro_no1": row["n_5_a_otro_no1"],
+        "ha_5_a_otro_no1": round(row["n_5_a_otro_no1"] * 0.01, 2),
+        "pct_5_a_otro_no1_clase5": row["pct_5_a_otro_no1_clase5"],
+        "alert_score": score,
+        "geometry": node["geometry"],
+    }
+
+
+def refine_hotspots(dw_before, dw_current, aoi_data, alert_grid_ids, df_transitions, cell_size=GRID_SIZE,
+                    min_size=None, threshold=None, min_pixels=None, combine_metrics=None):
+    """
+    Subdivide recursivamente las grillas alertadas y devuelve los focos de cambio.
+
+    Args:
+        dw_before, dw_current: imágenes DW (ee.Image)
+        aoi_data: AOIData del registro (grilla en EPSG:4326)
+        alert_grid_ids: grid_ids alertados (ej: de get_alert_grids)
+        df_transitions: transiciones de la grilla principal (métricas del nivel 0)
+        cell_size: tamaño de la grilla principal (m)
+        min_size: tamaño mínimo de cuadrante (m). Si None, usa HOTSPOT_MIN_SIZE
+        threshold: umbral de alert_score. Si None, usa ALERT_THRESHOLD_PP
+        min_pixels: píxeles válidos mínimos para que un cuadrante cuente como foco
+        combine_metrics: ver evaluate_alerts. Si None, usa config
+
+    Returns:
+        gpd.GeoDataFrame (EPSG:4326) con HOTSPOT_COLUMNS, ordenado por alert_score
+    """
+    min_size = min_size or HOTSPOT_MIN_SIZE
+    threshold = threshold or ALERT_THRESHOLD_PP
+    min_pixels = HOTSPOT_MIN_PIXELS if min_pixels is None else min_pixels
+    combine_metrics = combine_metrics if combine_metrics is not None else ALERT_COMBINE_METRICS
+
+    grid = aoi_data.grid.to_crs(epsg=3857).set_index("grid_id")
+    metrics = df_transitions.set_index("grid_id")
+    level0 = df_transitions[df_transitions["grid_id"].isin(alert_grid_ids)]
+    scores0 = transition_score(level0, combine_metrics).set_axis(level0["grid_id"])
+
+    frontier = [
+        {"key": str(gid), "grid_id": gid, "level": 0, "size": cell_size, "geometry": grid.geometry[gid],
+         "row": metrics.loc[gid], "score": scores0[gid]}
+        for gid in alert_grid_ids if gid in grid.index and gid in metrics.index
+    ]
+    img = transition_image(dw_before, dw_current)
+    hotspots = []
+    size, level = cell_size, 0
+    while frontier and size / 2 >= min_size:
+        size, level = size / 2, level + 1
+        children = [
+            {"key": f"{node['key']}.{q}", "grid_id": node["grid_id"], "level": level, "size": size, "geometry": part, "parent": node["key"]}
+            for node in frontier for q, part in _quadrants(node["geometry"])
+        ]
+        keys = [child["key"] for child in children]
+        gdf = gpd.GeoDataFrame({"grid_id": keys}, geometry=[child["geometry"] for child in children], crs="EPSG:3857").to_crs(epsg=4326)
+        df = transitions_from_counts(reduce_cells(img, load_ee_geometries(gdf), grid_ids=keys), keys)
+        scores = transition_score(df, combine_metrics)
+        hot = (scores >= threshold) & (df["n_validos"] >= min_pixels)
+
+        hot_children = []
+        for child, (_, row), score, is_hot in zip(children, df.iterrows(), scores, hot):
+            if is_hot:
+                hot_children.append({**child, "row": row, "score": score})
+        parents_with_hot = {child["parent"] for child in hot_children}
+        # Celdas sobre el umbral sin cuadrantes sobre el umbral: el cambio está disperso en toda la celda
+        hotspots += [_record(node, node["row"], node["score"]) for node in frontier if node["key"] not in parents_with_hot]
+        log(f"   Quadtree nivel {level} ({size:.0f} m): {len(children)} cuadrantes, {len(hot_children)} sobre el umbral", "info")
+        frontier = hot_children
+    hotspots += [_record(node, node["row"], node["score"]) for node in frontier]
+
+    if not hotspots:
+        return gpd.GeoDataFrame(columns=HOTSPOT_COLUMNS + ["geometry"], geometry="geometry", crs="EPSG:4326")
+    out = gpd.GeoDataFrame(hotspots, geometry="geometry", crs="EPSG:3857").to_crs(epsg=4326)
+    centroids = shapely.centroid(out.geometry.values)
+    out["lat"], out["lon"] = shapely.get_y(centroids), shapely.get_x(centroids)
+    out = out.sort_values("alert_score", ascending=False).reset_index(drop=True)
+    log(f"📍 {aoi_data.name}: {len(out)} focos de cambio en {len(alert_grid_ids)} grillas alertadas", "success")
+    return out[HOTSPOT_COLUMNS + ["geometry"]]
+
+
+def hotspot_table(hotspots):
+    """Tabla compacta (sin geometría) de los focos."""
+    return pd.DataFrame(hotspots.drop(columns="geometry"))
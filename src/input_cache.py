@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Caché local de insumos estáticos en GCS (AOIs, logos).
+
+Al iniciar una ejecución se lista cada prefijo de INPUTS_PATH una sola vez (el listado trae la
+generation y el ETag de todos los objetos), se descargan en paralelo solo los objetos nuevos o
+modificados y el resto de lecturas del pipeline se sirven desde disco local.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from src.aux_utils import log
+from src.config import INPUT_CACHE_DIR, INPUT_CACHE_WORKERS
+from src.gcs_utils import get_storage_client
+
+MANIFEST_NAME = "manifest.json"
+
+# gs://bucket/objeto -> ruta local, para la ejecución actual
+_MIRROR = {}
+
+
+def _split_gs(uri):
+    bucket, _, name = uri.replace("gs://", "", 1).partition("/")
+    return bucket, name
+
+
+def _load_manifest(cache_dir):
+    path = Path(cache_dir) / MANIFEST_NAME
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            log(f"⚠️ Manifest de caché ilegible, se revalidará todo: {e}", "warning")
+    return {}
+
+
+def _save_manifest(cache_dir, manifest):
+    path = Path(cache_dir) / MANIFEST_NAME
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _download(blob, local_path):
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = local_path.with_name(local_path.name + ".part")
+    # if_generation_match garantiza que se descarga exactamente la versión listada
+    blob.download_to_filename(str(tmp), if_generation_match=blob.generation)
+    os.replace(tmp, local_path)
+    return blob.size or local_path.stat().st_size
+
+
+def mirror_gcs_prefixes(gs_prefixes, cache_dir=None, max_workers=None, client=None):
+    """
+    Sincroniza prefijos gs:// a un directorio local.
+
+    Args:
+        gs_prefixes: lista de prefijos (ej: "gs://bucket/SIMBYP_DATA/area_estudio/dynamic_world")
+        cache_dir: directorio local de la caché (default: INPUT_CACHE_DIR)
+        max_workers: descargas concurrentes (default: INPUT_CACHE_WORKERS)
+        client: cliente de GCS (default: el compartido)
+
+    Returns:
+        dict: gs://bucket/objeto -> ruta local de todos los objetos bajo los prefijos
+    """
+    cache_dir = Path(cache_dir or INPUT_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    client = client or get_storage_client()
+    manifest = _load_manifest(cache_dir)
+
+    mirrored, to_download = {}, []
+    for prefix in gs_prefixes:
+        bucket_name, name_prefix = _split_gs(prefix.rstrip("/"))
+        for blob in client.list_blobs(bucket_name, prefix=f"{name_prefix}/"):
+            if blob.name.endswith("/"):
+                continue
+            uri = f"gs://{bucket_name}/{blob.name}"
+            local_path = cache_dir / bucket_name / blob.name
+            cached = manifest.get(uri, {})
+            fresh = (
+                local_path.exists()
+                and cached.get("generation") == blob.generation
+                and cached.get("etag") == blob.etag
+            )
+            if not fresh:
+                to_download.append((uri, blob, local_path))
+            mirrored[uri] = str(local_path)
+
+    n_bytes = 0
+    if to_download:
+        with ThreadPoolExecutor(max_workers=max_workers or INPUT_CACHE_WORKERS) as pool:
+            futures = {pool.submit(_download, blob, local_path): (uri, blob) for uri, blob, local_path in to_download}
+            for future in as_completed(futures):
+                uri, blob = futures[future]
+                try:
+                    n_bytes += future.result()
+                    manifest[uri] = {"generation": blob.generation, "etag": blob.etag, "path": mirrored[uri]}
+                except Exception as e:
+                    log(f"⚠️ No se pudo descargar {uri}: {e}", "warning")
+                    # Sin copia local válida se sigue leyendo directamente desde GCS
+                    if not Path(mirrored[uri]).exists():
+                        mirrored.pop(uri)
+        _save_manifest(cache_dir, manifest)
+
+    log(
+        f"🗄 Caché de insumos: {len(mirrored)} objetos, {len(to_download)} descargados "
+        f"({n_bytes / 1e6:.1f} MB), {len(mirrored) - len(to_download)} sin cambios",
+        "success"
+    )
+    _MIRROR.update(mirrored)
+    return mirrored
+
+
+def resolve_input(path):
+    """Ruta local en caché para un gs:// ya sincronizado; cualquier otra ruta se devuelve igual."""
+    return _MIRROR.get(str(path), path)
+
+
+def list_mirrored(gs_prefix):
+    """Objetos sincronizados bajo un prefijo: dict gs:// -> ruta local."""
+    prefix = gs_prefix.rstrip("/") + "/"
+    return {uri: local for uri, local in _MIRROR.items() if uri.startswith(prefix)}
@@ -12,7 +12,12 @@ import os
 import pandas as pd
 from pathlib import Path
 import json
-from src.config import PROJECT_ID, ALERT_THRESHOLD_PP
+from src.config import PROJECT_ID, ALERT_THRESHOLD_PP, MAP_ASSET_MODE, DISPLAY_GEOM_TOLERANCE, DISPLAY_GEOM_PRECISION, SCENE_INDEX_ENABLED
+from src.ee_accounting import get_info, download_ee_image, budget_allows
+from src.resilience import call_with_retry
+from src.scene_index import S2_COLLECTION, get_scene_index, scene_collection, window_ms
+from src.aoi_registry import AOIData, load_grid, load_ee_geometries
+from src.alert_utils import is_all_grids_aoi, coverage_alert_grid_ids
 from PIL import Image
 import numpy as np
 
@@ -30,10 +35,10 @@ def make_nas_transparent(png_path, image_type='sentinel'):
     except Exception as e:
         log(f"Error transparencia en {png_path}: {e}", "warning")
 
-def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio, mes, lookback_days, dw_before, dw_current, df_transitions=None, aoi_name=None):
+def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio, mes, lookback_days, dw_before, dw_current, df_transitions=None, aoi_name=None, asset_base_url=None, df_coverage=None):
     """
     Pipeline COMPLETO:
-    1. Genera PNGs de DW y Sentinel para grillas con alertas según CSV de coberturas
+    1. Genera PNGs de DW y Sentinel para grillas con alertas según las coberturas (df_coverage)
        - Alerta si pp_class_1 (árboles) disminuye más de ALERT_THRESHOLD_PP
        - Alerta si pp_class_5 (arbustos/matorrales) disminuye más de ALERT_THRESHOLD_PP 
          Y el aumento de árboles no compensa esa pérdida (evita transiciones 5→1)
@@ -43,18 +48,24 @@ def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio,
     ├── imagenes/
     │   ├── dw/
     │   └── sentinel/
+    ├── assets/          (copias con hash de los PNGs si MAP_ASSET_MODE != "inline"; en ese
+    │                     caso imagenes/ queda solo local y no se sube al store)
     ├── dw_mes.html
     └── sentinel_mes.html
+    
+    grid_path: ruta al GeoJSON de grilla o AOIData del registro (grilla, AOI y geometrías EE en memoria)
+    asset_base_url: URL pública de map_dir, usada cuando MAP_ASSET_MODE == "url"
+    df_coverage: DataFrame de generate_coverage_csv. Si es None no se generan PNGs (salvo Altiplano)
     """
-    import shapely
     from src.png_map import generar_mapa_png, get_file_grid_id
     
     log("="*70, "info")
     log(f"GENERANDO MAPAS: {aoi_name}", "info")
     log("="*70, "info")
     
+    aoi_data = grid_path if isinstance(grid_path, AOIData) else None
     try:
-        grid_gdf = gpd.read_file(grid_path).to_crs(epsg=4326)
+        grid_gdf = load_grid(grid_path)
         log(f"Grilla: {len(grid_gdf)} grids", "info")
     except Exception as e:
         log(f"ERROR grilla: {e}", "error")
@@ -69,47 +80,37 @@ def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio,
     dw_dir.mkdir(parents=True, exist_ok=True)
     sentinel_dir.mkdir(parents=True, exist_ok=True)
     
-    # Determinar qué grillas procesar usando CSV de coberturas (no transiciones)
-    threshold_pct = ALERT_THRESHOLD_PP
-    grids_to_process = set()
-    
-    # Leer CSV de coberturas para determinar alertas
-    coverage_csv_path = Path(map_dir).parent / "comparacion" / f"{aoi_name}_coberturas.csv"
-    
-    if aoi_name and "altiplano" in aoi_name.lower():
+    # Determinar qué grillas procesar con el motor de alertas sobre las coberturas en memoria
+    # (el CSV de coberturas es solo una salida; nunca se relee para decidir)
+    if is_all_grids_aoi(aoi_name):
         grids_to_process = set(grid_gdf["grid_id"].tolist())
         log(f"Altiplano: TODAS {len(grid_gdf)} grillas", "info")
-    elif coverage_csv_path.exists():
-        try:
-            df_coverage = pd.read_csv(coverage_csv_path)
-            # Criterios de alerta:
-            # 1. Clase 1 (árboles) disminuye más del umbral
-            # 2. Clase 5 (arbustos/matorrales) disminuye más del umbral Y el aumento de clase 1 no compensa esa pérdida
-            #    Esto evita alertar por transiciones naturales 5→1 (arbustos→árboles)
-            alerta_clase_1 = df_coverage["pp_class_1"] < -threshold_pct
-            alerta_clase_5 = (df_coverage["pp_class_5"] < -threshold_pct) & (df_coverage["pp_class_1"] < -df_coverage["pp_class_5"])
-            
-            mask = alerta_clase_1 | alerta_clase_5
-            grids_to_process = set(df_coverage[mask]["grid_id"].tolist())
-            
-            n_alerta_bosque = alerta_clase_1.sum()
-            n_alerta_arbustos = alerta_clase_5.sum()
-            log(f"Filtro coberturas (disminución >{threshold_pct}pp): {len(grids_to_process)}/{len(grid_gdf)} grillas", "info")
-            log(f"  - Alertas árboles (clase 1): {n_alerta_bosque}", "info")
-            log(f"  - Alertas arbustos/matorrales (clase 5, pérdida neta): {n_alerta_arbustos}", "info")
-        except Exception as e:
-            log(f"⚠️ Error leyendo CSV coberturas, usando todas las grillas: {e}", "warning")
-            grids_to_process = set(grid_gdf["grid_id"].tolist())
+    elif df_coverage is not None:
+        grids_to_process = set(coverage_alert_grid_ids(df_coverage, aoi_name, ALERT_THRESHOLD_PP))
     else:
-        # Fallback: usar todas las grillas si no hay CSV de coberturas
-        grids_to_process = set(grid_gdf["grid_id"].tolist())
-        log(f"Sin CSV coberturas: TODAS {len(grids_to_process)} grillas", "warning")
+        # Sin coberturas no hay criterio de alerta: no se exportan PNGs
+        grids_to_process = set()
+        log("Sin datos de coberturas: no se generan PNGs de grillas", "warning")
     
     # === PASO 1: GENERAR PNGs ===
     log("\n[1/3] Generando PNGs...", "info")
     png_count_dw = 0
     png_count_sentinel = 0
     
+    # Geometrías de Earth Engine (cacheadas en el registro si grid_path es AOIData)
+    ee_geoms = load_ee_geometries(grid_path)
+
+    # Disponibilidad de escenas Sentinel-2 desde el índice local: sin col.size().getInfo() por celda
+    s2_index = None
+    if SCENE_INDEX_ENABLED and aoi_data is not None and grids_to_process:
+        try:
+            s2_index = get_scene_index(S2_COLLECTION, aoi_data)
+            windows = [window_ms(d, lookback_days, extra_days=1) for d in (date_before, current_date)]
+            s2_index.ensure(min(w[0] for w in windows), max(w[1] for w in windows))
+        except Exception as e:
+            log(f"⚠️ Índice de escenas S2 no disponible, se consulta Earth Engine por celda: {e}", "warning")
+            s2_index = None
+    
     for _, row in grid_gdf.iterrows():
         grid_id = row.get("grid_id", _)
         if grid_id not in grids_to_process:
@@ -118,26 +119,22 @@ def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio,
         # Remapear grid_id si es Altiplano (0 → 1) para nombres de archivo
         file_grid_id = get_file_grid_id(grid_id, aoi_name)
         
-        geom = row.geometry
-        if geom.is_empty or geom.geom_type not in ["Polygon", "MultiPolygon"]:
+        ee_geom = ee_geoms.get(grid_id)
+        if ee_geom is None or row.geometry.geom_type not in ["Polygon", "MultiPolygon"]:
             continue
         
-        if geom.geom_type == "MultiPolygon":
-            geom = shapely.ops.unary_union([p for p in geom.geoms if not p.is_empty])
-        
-        gdf_tmp = gpd.GeoDataFrame(geometry=[geom], crs="EPSG:4326")
-        ee_geom = geemap.geopandas_to_ee(gdf_tmp).geometry()
-        
         # DW T1 y T2
         for png_file, date_str, img_source in [
             (dw_dir / f"dw_grid_{file_grid_id}_{date_before}.png", date_before, dw_before),
             (dw_dir / f"dw_grid_{file_grid_id}_{current_date}.png", current_date, dw_current)
         ]:
             if not png_file.exists():
+                if not budget_allows("dw_png"):
+                    continue
                 try:
                     vis_params = {"min": 0, "max": 8, "palette": ["#419BDF", "#397D49", "#88B053", "#7A87C6", "#E49635", "#DFC35A", "#C4281B", "#A59B8F", "#B39FE1"]}
                     dw_img = img_source.clip(ee_geom).visualize(**vis_params)
-                    geemap.download_ee_image(image=dw_img, filename=str(png_file), region=ee_geom, scale=10, crs="EPSG:4326", dtype="uint8")
+                    call_with_retry(download_ee_image, geemap.download_ee_image, label=f"PNG DW {png_file.name}", image=dw_img, filename=str(png_file), region=ee_geom, scale=10, crs="EPSG:4326", dtype="uint8")
                     if png_file.exists() and png_file.stat().st_size > 1000:
                         Image.open(png_file).verify()
                         make_nas_transparent(str(png_file), 'dw')
@@ -155,21 +152,31 @@ def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio,
             (sentinel_dir / f"sentinel_grid_{file_grid_id}_{current_date}.png", current_date)
         ]:
             if not png_file.exists():
+                # Con presupuesto de Earth Engine, los PNGs de Sentinel son lo primero que se omite
+                if not budget_allows("sentinel_png"):
+                    continue
                 try:
                     date_start = ee.Date(date_str).advance(-lookback_days, "day")
                     date_end = ee.Date(date_str).advance(1, "day")
-                    col = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-                        .filterDate(date_start, date_end) \
-                        .filterBounds(ee_geom) \
-                        .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", 30)) \
-                        .select(["B4", "B3", "B2"])
-                    if col.size().getInfo() > 0:
+                    if s2_index is not None:
+                        start_ms, end_ms = window_ms(date_str, lookback_days, extra_days=1)
+                        scene_ids = s2_index.ids(start_ms, end_ms, geometry=row.geometry, max_cloud=30)
+                        col = scene_collection(S2_COLLECTION, scene_ids, date_start, date_end, ee_geom).select(["B4", "B3", "B2"])
+                        has_scenes = bool(scene_ids)
+                    else:
+                        col = ee.ImageCollection(S2_COLLECTION) \
+                            .filterDate(date_start, date_end) \
+                            .filterBounds(ee_geom) \
+                            .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", 30)) \
+                            .select(["B4", "B3", "B2"])
+                        has_scenes = call_with_retry(get_info, col.size(), "size") > 0
+                    if has_scenes:
                         img = col.median().clip(ee_geom)
                         # Aplicar visualización para RGB natural: escalar uint16 a uint8
                         # Sentinel-2 SR: valores típicos 0-3000, escalamos a 0-255
                         vis_params = {"min": 0, "max": 3000, "bands": ["B4", "B3", "B2"]}
                         img_viz = img.visualize(**vis_params)
-                        geemap.download_ee_image(image=img_viz, filename=str(png_file), region=ee_geom, scale=10, crs="EPSG:4326", dtype="uint8")
+                        call_with_retry(download_ee_image, geemap.download_ee_image, label=f"PNG Sentinel {png_file.name}", image=img_viz, filename=str(png_file), region=ee_geom, scale=10, crs="EPSG:4326", dtype="uint8")
                         if png_file.exists() and png_file.stat().st_size > 1000:
                             Image.open(png_file).verify()
                             make_nas_transparent(str(png_file), 'sentinel')
@@ -196,10 +203,19 @@ def generate_maps(aoi_path, grid_path, map_dir, date_before, current_date, anio,
                 paramo=aoi_name if aoi_name else "paramo",
                 periodo=current_date,
                 tipo=tipo,
-                grilla_path=Path(grid_path),
+                grilla_path=Path(aoi_data.grid_path if aoi_data else grid_path),
                 imagenes_dir=Path(map_dir) / "imagenes",
                 output_html=Path(map_dir) / output_file,
-                alert_grid_ids=alert_grid_ids
+                alert_grid_ids=alert_grid_ids,
+                asset_mode=MAP_ASSET_MODE,
+                asset_base_url=asset_base_url,
+                display_tolerance=DISPLAY_GEOM_TOLERANCE,
+                display_precision=DISPLAY_GEOM_PRECISION,
+                grid_gdf=grid_gdf,
+                aoi_gdf=aoi_data.aoi if aoi_data else None,
+                center=aoi_data.center if aoi_data else None,
+                cell_centroids=aoi_data.cell_centroids if aoi_data else None,
+                periodo_anterior=date_before
             )
             log(f"  OK: {output_file}", "success")
         except Exception as e:
@@ -0,0 +1,189 @@
+"""
+Destino de los artefactos de una ejecución (CSV, GeoJSON, JSON, HTML, PNG).
+
+Todas las etapas escriben con claves relativas al periodo (ej: "paramo_chingaza/comparacion/x.csv")
+a través de la misma interfaz:
+  - LocalStore: escribe directamente en una carpeta local (desarrollo, USE_GCS = False, pruebas)
+  - GCSStore: sube cada artefacto directamente al bucket, sin copia completa del periodo en disco
+
+Los pasos que necesitan archivos reales (descarga y post-proceso de PNGs, mapas Folium) usan
+staging(): en LocalStore es la carpeta final; en GCSStore es una carpeta temporal que se sube
+al salir y se elimina, por lo que el disco local solo guarda un páramo a la vez.
+"""
+
+import base64
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.aux_utils import log
+from src.config import USE_GCS, GCS_BUCKET_NAME, GCS_PREFIX, GCS_SYNC, GCS_SYNC_DELETE_STALE, GCS_UPLOAD_RETRIES
+from src.resilience import call_with_retry
+from src.gcs_utils import (
+    SOURCE_MD5_KEY, _upload_blob, file_md5_b64, get_public_url, get_storage_client,
+    list_remote_checksums, upload_directory_to_gcs, upload_file_to_gcs,
+)
+
+
+class OutputStore:
+    """Interfaz común. Las claves usan '/' y son relativas a la raíz del store."""
+
+    def write_bytes(self, key, data):
+        raise NotImplementedError
+
+    def write_text(self, key, text):
+        self.write_bytes(key, text.encode("utf-8"))
+
+    @contextmanager
+    def open(self, key, mode="w"):
+        """Archivo en memoria ('w' o 'wb') que se escribe en el store al cerrarse."""
+        buf = io.BytesIO() if "b" in mode else io.StringIO()
+        yield buf
+        data = buf.getvalue()
+        self.write_bytes(key, data.encode("utf-8") if isinstance(data, str) else data)
+
+    def read_text(self, key):
+        """Contenido de un artefacto ya escrito, o None si no existe (ej: parciales de otras tareas)."""
+        raise NotImplementedError
+
+    def put_file(self, local_path, key):
+        raise NotImplementedError
+
+    @contextmanager
+    def staging(self, key_prefix, exclude=()):
+        """Carpeta local para key_prefix. exclude: subcarpetas que no se publican (ver upload_directory_to_gcs)."""
+        raise NotImplementedError
+
+    def url(self, key):
+        raise NotImplementedError
+
+
+class LocalStore(OutputStore):
+    """
+    Escribe en root/<clave>. url() devuelve la clave (relativa al reporte del periodo).
+    Las escrituras son atómicas (archivo temporal + os.replace): una etapa que falla o se reintenta
+    nunca deja un artefacto a medio escribir.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, key):
+        return self.root / key
+
+    def write_bytes(self, key, data):
+        target = self.path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        tmp.write_bytes(data)
+        os.replace(tmp, target)
+
+    @contextmanager
+    def open(self, key, mode="w"):
+        target = self.path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(target.name + ".part")
+        try:
+            with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8", "newline": ""})) as f:
+                yield f
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, target)
+
+    def read_text(self, key):
+        target = self.path(key)
+        return target.read_text(encoding="utf-8") if target.exists() else None
+
+    def put_file(self, local_path, key):
+        target = self.path(key)
+        if Path(local_path).resolve() == target.resolve():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(local_path, target)
+
+    @contextmanager
+    def staging(self, key_prefix, exclude=()):
+        target = self.path(key_prefix)
+        target.mkdir(parents=True, exist_ok=True)
+        yield target
+
+    def url(self, key):
+        return key
+
+
+class GCSStore(OutputStore):
+    """
+    Sube cada artefacto a gs://bucket_name/prefix/<clave>.
+
+    Con sync=True se omiten los artefactos cuyo MD5 coincide con el objeto existente
+    (checksums obtenidos con un solo listado del prefijo, la primera vez que se necesitan).
+    """
+
+    def __init__(self, bucket_name, prefix, client=None, sync=False, delete_stale=False):
+        self.bucket_name = bucket_name
+        self.prefix = prefix.strip("/")
+        self.client = client or get_storage_client()
+        self.sync = sync
+        self.delete_stale = delete_stale
+        self._remote = None
+
+    def blob_name(self, key):
+        return f"{self.prefix}/{key}"
+
+    def _unchanged(self, key, md5):
+        if not self.sync:
+            return False
+        if self._remote is None:
+            self._remote = list_remote_checksums(self.bucket_name, self.prefix, client=self.client)
+        remote = self._remote.get(self.blob_name(key), {})
+        return md5 in (remote.get("source_md5"), remote.get("md5"))
+
+    def write_bytes(self, key, data):
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        if self._unchanged(key, md5):
+            return
+        blob_name = self.blob_name(key)
+        blob = self.client.bucket(self.bucket_name).blob(blob_name)
+        blob.metadata = {SOURCE_MD5_KEY: md5}
+        call_with_retry(_upload_blob, blob, blob_name, data=data, backend="gcs", retries=GCS_UPLOAD_RETRIES, label=f"Subida de {key}")
+        log(f"✓ Subido: {key} → gs://{self.bucket_name}/{blob_name}", "success")
+
+    def read_text(self, key):
+        from google.api_core.exceptions import NotFound
+        try:
+            blob = self.client.bucket(self.bucket_name).blob(self.blob_name(key))
+            return call_with_retry(blob.download_as_text, backend="gcs", retries=GCS_UPLOAD_RETRIES, label=f"Lectura de {key}")
+        except NotFound:
+            return None
+
+    def put_file(self, local_path, key):
+        md5 = file_md5_b64(local_path)
+        if not self._unchanged(key, md5):
+            upload_file_to_gcs(str(local_path), self.bucket_name, self.blob_name(key), client=self.client, source_md5=md5)
+
+    @contextmanager
+    def staging(self, key_prefix, exclude=()):
+        tmp = tempfile.mkdtemp(prefix="simbyp_")
+        try:
+            yield Path(tmp)
+            upload_directory_to_gcs(
+                tmp, self.bucket_name, self.blob_name(key_prefix),
+                client=self.client, sync=self.sync, delete_stale=self.delete_stale, exclude=exclude
+            )
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def url(self, key):
+        return get_public_url(self.bucket_name, self.blob_name(key))
+
+
+def get_output_store(period_name, local_dir):
+    """Store del periodo según USE_GCS: gs://GCS_BUCKET_NAME/GCS_PREFIX/<periodo> o local_dir."""
+    if USE_GCS:
+        return GCSStore(GCS_BUCKET_NAME, f"{GCS_PREFIX}/{period_name}", sync=GCS_SYNC, delete_stale=GCS_SYNC_DELETE_STALE)
+    return LocalStore(local_dir)
@@ -6,11 +6,18 @@ Integra procesamiento de PNGs (transparencia, conversión RGBA) y remapeo de gri
 
 import folium
 import geopandas as gpd
+import numpy as np
+import shapely
+from branca.element import MacroElement
+from jinja2 import Template
 from pathlib import Path
+import hashlib
+import json
 import os
 from typing import Optional
 from datetime import datetime
 from PIL import Image
+from src.geom_utils import prepare_display_gdf, DISPLAY_TOLERANCE, DISPLAY_PRECISION
 
 
 # ============================================================================
@@ -70,7 +77,8 @@ def fix_all_pngs(mapas_dir):
         print(f"[WARN] Directorio no encontrado: {mapas_dir}")
         return 0
     
-    png_files = list(mapas_path.rglob('*.png'))
+    # Las copias con hash de contenido (assets/) ya están procesadas y no deben reescribirse
+    png_files = [p for p in mapas_path.rglob('*.png') if ASSETS_DIRNAME not in p.parts]
     if not png_files:
         print(f"[INFO] No se encontraron PNG en {mapas_dir}")
         return 0
@@ -115,6 +123,86 @@ def get_file_grid_id(grid_id, paramo):
     """
     return get_display_grid_id(grid_id, paramo)
 
+
+# ============================================================================
+# FUNCIONES DE REFERENCIA DE IMÁGENES (overlays por URL en vez de base64)
+# ============================================================================
+
+# Modos de referencia de overlays PNG:
+#   - 'inline':   Folium incrusta cada PNG en base64 dentro del HTML (comportamiento original)
+#   - 'relative': el HTML referencia copias con hash de contenido en assets/ por ruta relativa
+#   - 'url':      igual que 'relative' pero con URL absoluta (ej: URL pública de GCS)
+ASSET_MODES = ("inline", "relative", "url")
+ASSETS_DIRNAME = "assets"
+
+
+class ReferencedImageOverlay(folium.raster_layers.ImageOverlay):
+    """
+    ImageOverlay que apunta a una URL (relativa o pública) en lugar de incrustar la imagen.
+    Folium intenta abrir como archivo local cualquier ruta sin esquema, por eso se
+    inicializa con una data URI vacía y luego se reemplaza la URL.
+    """
+
+    def __init__(self, url, bounds, **kwargs):
+        super().__init__(image="data:,", bounds=bounds, **kwargs)
+        self.url = url
+
+
+def publish_hashed_asset(png_path, assets_dir):
+    """
+    Copia un PNG a assets_dir con el hash de su contenido en el nombre.
+    Ej: dw_grid_3_2025-01-01.png -> assets/dw_grid_3_2025-01-01.1a2b3c4d5e6f.png
+
+    El nombre cambia solo si cambia el contenido, por lo que el archivo puede
+    cachearse indefinidamente en el navegador.
+
+    Returns:
+        Path: ruta de la copia publicada
+    """
+    png_path = Path(png_path)
+    assets_dir = Path(assets_dir)
+    data = png_path.read_bytes()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    target = assets_dir / f"{png_path.stem}.{digest}{png_path.suffix}"
+    if not target.exists():
+        assets_dir.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+    return target
+
+
+def make_image_overlay(png_path, bounds, html_parent_path, asset_mode="inline", asset_base_url=None, **kwargs):
+    """
+    Crea el ImageOverlay de un PNG según el modo de referencia.
+
+    Args:
+        png_path: Ruta local al PNG
+        bounds: [[miny, minx], [maxy, maxx]]
+        html_parent_path: carpeta donde se guardará el HTML (raíz de las rutas relativas)
+        asset_mode: 'inline', 'relative' o 'url' (ver ASSET_MODES)
+        asset_base_url: URL pública equivalente a html_parent_path (requerida en modo 'url')
+        **kwargs: parámetros adicionales de ImageOverlay (name, opacity, ...)
+    """
+    if asset_mode not in ASSET_MODES:
+        raise ValueError(f"asset_mode inválido: {asset_mode}. Opciones: {ASSET_MODES}")
+
+    png_path = Path(png_path)
+    if asset_mode == "inline":
+        # Ruta ABSOLUTA para que Folium encuentre el archivo y lo incruste en base64
+        return folium.raster_layers.ImageOverlay(image=str(png_path.resolve()), bounds=bounds, **kwargs)
+
+    html_parent_path = Path(html_parent_path).resolve()
+    hashed_path = publish_hashed_asset(png_path, html_parent_path / ASSETS_DIRNAME)
+    rel_url = hashed_path.relative_to(html_parent_path).as_posix()
+
+    if asset_mode == "url":
+        if not asset_base_url:
+            raise ValueError("asset_mode='url' requiere asset_base_url")
+        url = f"{asset_base_url.rstrip('/')}/{rel_url}"
+    else:
+        url = rel_url
+    return ReferencedImageOverlay(url, bounds=bounds, **kwargs)
+
+
 def format_periodo_label(periodo: str, tipo: str) -> str:
     """
     Convierte periodo en formato legible.
@@ -160,38 +248,146 @@ def add_dw_legend(m):
     '''
     m.get_root().html.add_child(folium.Element(legend_html))
 
-def add_grid_labels(m, grid_gdf, paramo=None):
+def grid_style(feature):
+    """Estilo de una celda de la grilla según su propiedad 'alerted' (rojo si está alertada)."""
+    if feature["properties"].get("alerted"):
+        return {"color": "red", "weight": 2.5, "fillOpacity": 0.01, "fillColor": "red"}
+    return {"color": "black", "weight": 1.5, "fillOpacity": 0.02, "fillColor": "black"}
+
+
+def add_grid_layer(fg, grid_gdf, alert_grid_ids=None):
+    """
+    Agrega la grilla completa como una sola FeatureCollection GeoJSON.
+    Cada feature lleva las propiedades grid_id, alerted y popup; el estilo y el popup
+    se resuelven por propiedad, así que el HTML crece con la geometría y no con
+    una capa Leaflet por celda.
+    
+    Args:
+        fg: FeatureGroup (o mapa) al que se agrega la capa
+        grid_gdf: GeoDataFrame con las grillas (EPSG:4326)
+        alert_grid_ids: grid_ids alertados (se dibujan en rojo). Si None, todas en negro
+    """
+    grid_ids = grid_gdf["grid_id"] if "grid_id" in grid_gdf.columns else grid_gdf.index.to_series()
+    alerted = grid_ids.isin(set(alert_grid_ids or []))
+    layer_gdf = gpd.GeoDataFrame(
+        {
+            "grid_id": grid_ids.values,
+            "alerted": alerted.values,
+            "popup": ("Grid " + grid_ids.astype(str) + alerted.map({True: " - ALERTA", False: ""})).values,
+        },
+        geometry=grid_gdf.geometry.values,
+        crs="EPSG:4326",
+    )
+    folium.GeoJson(
+        layer_gdf,
+        style_function=grid_style,
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False),
+    ).add_to(fg)
+    return fg
+
+
+# Zoom mínimo a partir del cual se muestran los números de grilla
+GRID_LABEL_MIN_ZOOM = 9
+
+
+class GridLabelZoomToggle(MacroElement):
+    """
+    Oculta las etiquetas de grilla (tooltips permanentes con clase 'grid-label')
+    cuando el zoom del mapa es menor que min_zoom, para no dibujar todas las
+    etiquetas en vistas alejadas.
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+        <style>
+            .leaflet-tooltip.grid-label {
+                background: transparent; border: 0; box-shadow: none; padding: 0;
+                font-size: 14px; font-weight: bold; color: #000; font-family: Arial, sans-serif;
+            }
+            .leaflet-tooltip.grid-label:before { display: none; }
+            .grid-labels-hidden .leaflet-tooltip.grid-label { display: none; }
+        </style>
+        {% endmacro %}
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            function toggleGridLabels() {
+                var hide = map.getZoom() < {{ this.min_zoom }};
+                map.getContainer().classList.toggle("grid-labels-hidden", hide);
+            }
+            map.on("zoomend", toggleGridLabels);
+            toggleGridLabels();
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, min_zoom=GRID_LABEL_MIN_ZOOM):
+        super().__init__()
+        self._name = "GridLabelZoomToggle"
+        self.min_zoom = int(min_zoom)
+
+
+class GridLabels(MacroElement):
+    """
+    Números de grilla como tooltips permanentes, uno por celda: los puntos (lat, lon, etiqueta) se
+    incrustan como un solo arreglo JSON y el script crea un circleMarker invisible por punto con su
+    propio tooltip (un tooltip enlazado a toda la capa se comparte y solo muestra una etiqueta).
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var labels = L.layerGroup().addTo({{ this._parent.get_name() }});
+            {{ this.points }}.forEach(function(p) {
+                L.circleMarker([p[0], p[1]], {radius: 0, stroke: false, fill: false, interactive: false})
+                    .bindTooltip(p[2], {permanent: true, direction: "center", className: "grid-label"})
+                    .addTo(labels);
+            });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, points):
+        super().__init__()
+        self._name = "GridLabels"
+        self.points = json.dumps(points, separators=(",", ":"))
+
+
+def add_grid_labels(m, grid_gdf, paramo=None, min_zoom=GRID_LABEL_MIN_ZOOM, centroids=None):
     """
     Agrega etiquetas con números de grilla en el centro de cada polígono.
     Para Altiplano, remapea grid_id 0 → 1 en la visualización.
     
+    Las etiquetas se incrustan como un solo arreglo de puntos (ver GridLabels), en lugar de
+    un Marker con DivIcon por celda.
+    
     Args:
         m: mapa Folium
         grid_gdf: GeoDataFrame con las grillas
         paramo: Nombre del páramo (para remapeo de Altiplano)
+        min_zoom: zoom mínimo en el que se muestran las etiquetas
+        centroids: centroides por celda en el orden de grid_gdf (ej: AOIData.cell_centroids).
+                   Si es None se calculan
     """
-    for idx, row in grid_gdf.iterrows():
-        grid_id = row.get('grid_id', idx)
-        # Remapear grid_id si es Altiplano (0 → 1)
-        display_grid_id = get_display_grid_id(grid_id, paramo)
-        centroid = row.geometry.centroid
-        
-        # Crear un marcador con texto (sin ícono, solo texto)
-        folium.Marker(
-            location=[centroid.y, centroid.x],
-            icon=folium.DivIcon(html=f'''
-                <div style="font-size: 14px; font-weight: bold; color: #000;
-                           font-family: Arial, sans-serif;
-                           text-align: center;">
-                    {display_grid_id}
-                </div>
-            ''')
-        ).add_to(m)
+    if grid_gdf.empty:
+        return
+    
+    grid_ids = grid_gdf["grid_id"] if "grid_id" in grid_gdf.columns else grid_gdf.index.to_series()
+    if centroids is None or len(centroids) != len(grid_gdf):
+        centroids = shapely.centroid(np.asarray(grid_gdf.geometry.values))
+    xs, ys = shapely.get_x(centroids), shapely.get_y(centroids)
+    # Remapear grid_id si es Altiplano (0 → 1)
+    points = [
+        [round(float(y), 6), round(float(x), 6), str(get_display_grid_id(grid_id, paramo))]
+        for grid_id, x, y in zip(grid_ids, xs, ys)
+    ]
+    GridLabels(points).add_to(m)
+    GridLabelZoomToggle(min_zoom=min_zoom).add_to(m)
 
 
 from datetime import datetime
 
-def add_png_overlays(m, grid_gdf, mapas_dir, periodo, tipo, group_name, paramo=None, alert_grid_ids=None, html_parent_path=None, opacity=1.0):
+def add_png_overlays(m, grid_gdf, mapas_dir, periodo, tipo, group_name, paramo=None, alert_grid_ids=None, html_parent_path=None, opacity=1.0, asset_mode="inline", asset_base_url=None):
     """
     Agrega overlays PNG SOLO para grillas alertadas a un mapa Folium.
     Usa rutas RELATIVAS para que funcione tanto localmente como en GCS.
@@ -207,6 +403,8 @@ def add_png_overlays(m, grid_gdf, mapas_dir, periodo, tipo, group_name, paramo=N
         alert_grid_ids: lista de grid_ids alerted (SOLO mostrar PNGs para estos)
         html_parent_path: ruta padre donde se guardará el HTML (para rutas relativas)
         opacity: opacidad del overlay (0.0 a 1.0, default 0.75)
+        asset_mode: 'inline' (base64 en el HTML), 'relative' o 'url' (ver ASSET_MODES)
+        asset_base_url: URL pública de la carpeta del HTML (solo para asset_mode='url')
     """
     fg = folium.FeatureGroup(name=group_name, show=True)
     png_count = 0
@@ -245,14 +443,13 @@ def add_png_overlays(m, grid_gdf, mapas_dir, periodo, tipo, group_name, paramo=N
             bounds_tuple = row.geometry.bounds
             bounds = [[bounds_tuple[1], bounds_tuple[0]], [bounds_tuple[3], bounds_tuple[2]]]
             
-            # IMPORTANTE: Usar ruta ABSOLUTA para que Folium pueda acceder al archivo
-            # Al renderizar en el navegador, las rutas relativas funcionarán correctamente
-            png_path_absolute = str(png_path.resolve())
-            
-            folium.raster_layers.ImageOverlay(
+            make_image_overlay(
+                png_path,
+                bounds,
+                html_parent_path,
+                asset_mode=asset_mode,
+                asset_base_url=asset_base_url,
                 name=f"PNG Grid {display_grid_id}",
-                image=png_path_absolute,  # Ruta absoluta para que Folium encuentre el archivo
-                bounds=bounds,
                 opacity=opacity,
                 interactive=True,
                 cross_origin=False,
@@ -267,7 +464,7 @@ def add_png_overlays(m, grid_gdf, mapas_dir, periodo, tipo, group_name, paramo=N
     fg.add_to(m)
     return fg
 
-def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional[str]=None, imagenes_dir: Optional[str]=None, output_html: Optional[str]=None, alert_grid_ids: Optional[list]=None):
+def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional[str]=None, imagenes_dir: Optional[str]=None, output_html: Optional[str]=None, alert_grid_ids: Optional[list]=None, asset_mode: str="inline", asset_base_url: Optional[str]=None, display_tolerance: float=DISPLAY_TOLERANCE, display_precision: Optional[int]=DISPLAY_PRECISION, grid_gdf: Optional[gpd.GeoDataFrame]=None, aoi_gdf: Optional[gpd.GeoDataFrame]=None, center: Optional[tuple]=None, cell_centroids: Optional[np.ndarray]=None, periodo_anterior: Optional[str]=None):
 
     """
     Genera un mapa Folium con overlays PNG para un páramo, periodo y tipo (dw/sentinel).
@@ -278,8 +475,21 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
     - imagenes_dir: carpeta con subcarpetas dw/ y sentinel/ con los PNGs
     - output_html: ruta de salida del HTML
     - alert_grid_ids: lista de grid_ids a mostrar. Si None, muestra todos
+    - asset_mode: 'inline' incrusta los PNGs en base64; 'relative'/'url' los referencia
+      como copias con hash de contenido en assets/ junto al HTML
+    - asset_base_url: URL pública de la carpeta del HTML (requerida con asset_mode='url')
+    - display_tolerance, display_precision: simplificación (grados) y decimales de las
+      geometrías de grilla y AOI incrustadas en el HTML
+    - grid_gdf, aoi_gdf: grilla y AOI ya cargados en EPSG:4326 (ej: desde el registro de AOIs).
+      Si son None se leen de grilla_path y de la carpeta del páramo
+    - center: (lat, lon) del centro del mapa. Si es None se calcula a partir de la grilla
+    - cell_centroids: centroides por celda de grid_gdf (AOIData.cell_centroids) para las etiquetas
+    - periodo_anterior: fecha de la línea base de los PNGs 'antes' (date_before, la primera de
+      BASELINE_MONTHS / --lineas_base). Si es None, el mismo mes del año anterior
     """
     BASE = Path(__file__).parent.parent
+    if not periodo_anterior:
+        periodo_anterior = f"{int(periodo[:4])-1}-{periodo[5:]}"
     if not grilla_path:
         grilla_path = BASE / f'outputs/{periodo[:4]}_{int(periodo[5:7]):02d}/' / paramo / 'grilla' / f'grid_{paramo}_10000m.geojson'
     if not imagenes_dir:
@@ -292,30 +502,32 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
     imagenes_dir = Path(imagenes_dir).resolve()
     output_html = Path(output_html).resolve()
 
-    grid_gdf = gpd.read_file(grilla_path).to_crs(epsg=4326)
+    if grid_gdf is None:
+        grid_gdf = gpd.read_file(grilla_path).to_crs(epsg=4326)
+    aoi_path = Path(grilla_path).parent.parent / f"{paramo}.geojson"
     if grid_gdf.empty:
         print(f"[WARN] La grilla para {paramo} está vacía: {grilla_path}")
         # Intentar usar el polígono del AOI
-        aoi_path = Path(grilla_path).parent.parent / f"{paramo}.geojson"
-        if not aoi_path.exists():
-            print(f"[ERROR] No se encontró el shape del AOI para {paramo}: {aoi_path}")
-            return
-        aoi_gdf = gpd.read_file(aoi_path).to_crs(epsg=4326)
+        if aoi_gdf is None:
+            if not aoi_path.exists():
+                print(f"[ERROR] No se encontró el shape del AOI para {paramo}: {aoi_path}")
+                return
+            aoi_gdf = gpd.read_file(aoi_path).to_crs(epsg=4326)
         if aoi_gdf.empty:
             print(f"[ERROR] El shape del AOI para {paramo} está vacío: {aoi_path}")
             return
-        centroid = aoi_gdf.unary_union.centroid
+        aoi_union = aoi_gdf.unary_union
+        centroid = aoi_union.centroid
         m = folium.Map(location=[centroid.y, centroid.x], zoom_start=10, tiles="CartoDB positron")
         
         periodo_actual = periodo
-        periodo_anterior = f"{int(periodo[:4])-1}-{periodo[5:]}"
         
         # Crear FeatureGroup para Área de análisis (altiplano)
         fg_area = folium.FeatureGroup(name="Área de análisis", show=True)
         
         # Agregar límite del AOI
         folium.GeoJson(
-            aoi_gdf,
+            prepare_display_gdf(aoi_gdf, display_tolerance, display_precision, label=f"AOI {paramo}"),
             style_function=lambda x: {
                 "color": "darkblue", 
                 "weight": 2.5, 
@@ -342,18 +554,18 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
                 continue
             
             png_path = img_dir / png_filename
-            bounds = list(aoi_gdf.unary_union.bounds)
+            bounds = list(aoi_union.bounds)
             
             if png_path.exists():
                 fg = folium.FeatureGroup(name=label, show=True)
                 
-                # Usar ruta ABSOLUTA para que Folium pueda acceder al archivo
-                png_path_absolute = str(png_path.resolve())
-                
-                folium.raster_layers.ImageOverlay(
+                make_image_overlay(
+                    png_path,
+                    [[bounds[1], bounds[0]], [bounds[3], bounds[2]]],
+                    output_html.parent,
+                    asset_mode=asset_mode,
+                    asset_base_url=asset_base_url,
                     name=label,
-                    image=png_path_absolute,
-                    bounds=[[bounds[1], bounds[0]], [bounds[3], bounds[2]]],
                     opacity=opacity_val,
                     interactive=True,
                     cross_origin=False,
@@ -370,18 +582,20 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
         folium.LayerControl(collapsed=False).add_to(m)
         m.save(str(output_html))
         print(f"Mapa guardado en: {output_html}")
-        print("\nPara visualizar correctamente las imágenes, ejecuta en la raíz del proyecto:")
-        print("\n    python -m http.server\n")
-        print("Luego abre en tu navegador:")
-        print(f"    http://localhost:8000/{output_html.relative_to(BASE).as_posix()}\n")
+        if output_html.is_relative_to(BASE):
+            print("\nPara visualizar correctamente las imágenes, ejecuta en la raíz del proyecto:")
+            print("\n    python -m http.server\n")
+            print("Luego abre en tu navegador:")
+            print(f"    http://localhost:8000/{output_html.relative_to(BASE).as_posix()}\n")
         print(f"[INFO] El páramo {paramo} solo tiene una grilla (AOI). Verifica que la imagen PNG se haya generado correctamente.")
         return
-    centroid = grid_gdf.unary_union.centroid
-    m = folium.Map(location=[centroid.y, centroid.x], zoom_start=10, tiles="CartoDB positron")
+    if center is None:
+        centroid = grid_gdf.unary_union.centroid
+        center = (centroid.y, centroid.x)
+    m = folium.Map(location=list(center), zoom_start=10, tiles="CartoDB positron")
     
     # Períodos
     periodo_actual = periodo
-    periodo_anterior = f"{int(periodo[:4])-1}-{periodo[5:]}"
     
     # Pasar ruta del HTML para rutas relativas correctas
     html_parent = Path(output_html).parent
@@ -389,52 +603,28 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
     # PRIMERO: Crear FeatureGroup para la GRILLA (todo en un botón)
     fg_grilla = folium.FeatureGroup(name="Grilla de análisis", show=True)
     
-    # Agregar límites de grilla al FeatureGroup
-    if alert_grid_ids is not None and len(alert_grid_ids) > 0:
-        for idx, row in grid_gdf.iterrows():
-            grid_id = row.get('grid_id', idx)
-            is_alerted = grid_id in alert_grid_ids
-            
-            color = "red" if is_alerted else "black"
-            weight = 2.5 if is_alerted else 1.5
-            
-            folium.GeoJson(
-                gpd.GeoDataFrame([row], crs="EPSG:4326"),
-                style_function=lambda x, c=color, w=weight: {
-                    "color": c, 
-                    "weight": w, 
-                    "fillOpacity": 0.01 if c == "red" else 0.02,
-                    "fillColor": c if c == "red" else "black"
-                },
-                popup=f"Grid {grid_id}" + (" - ALERTA" if is_alerted else "")
-            ).add_to(fg_grilla)
-    else:
-        # Mostrar todas las grillas normalmente
-        for idx, row in grid_gdf.iterrows():
-            grid_id = row.get('grid_id', idx)
-            folium.GeoJson(
-                gpd.GeoDataFrame([row], crs="EPSG:4326"),
-                style_function=lambda x: {
-                    "color": "black", 
-                    "weight": 1.5, 
-                    "fillOpacity": 0.02,
-                    "fillColor": "black"
-                },
-                popup=f"Grid {grid_id}"
-            ).add_to(fg_grilla)
+    # Agregar límites de grilla al FeatureGroup (una sola capa GeoJSON para todas las celdas)
+    add_grid_layer(
+        fg_grilla,
+        prepare_display_gdf(grid_gdf, display_tolerance, display_precision, label=f"grilla {paramo}"),
+        alert_grid_ids=alert_grid_ids
+    )
     
     # Agregar FeatureGroup de grilla al mapa
     fg_grilla.add_to(m)
     
     # SEGUNDO: Agregar AOI polygon si existe (como FeatureGroup en Layer Control)
-    aoi_path = Path(grilla_path).parent.parent / f"{paramo}.geojson"
-    if aoi_path.exists():
+    if aoi_gdf is None and aoi_path.exists():
         try:
             aoi_gdf = gpd.read_file(aoi_path).to_crs(epsg=4326)
+        except Exception as e:
+            aoi_gdf = None
+    if aoi_gdf is not None:
+        try:
             if not aoi_gdf.empty:
                 fg_aoi = folium.FeatureGroup(name="Polígono de estudio (AOI)", show=True)
                 folium.GeoJson(
-                    aoi_gdf,
+                    prepare_display_gdf(aoi_gdf, display_tolerance, display_precision, label=f"AOI {paramo}"),
                     style_function=lambda x: {
                         "color": "darkblue", 
                         "weight": 2.5, 
@@ -446,6 +636,10 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
         except Exception as e:
             pass
     
+    # Procesar todos los PNGs (convertir a RGBA, hacer transparentes negros para DW)
+    # ANTES de crear los overlays, para que el HTML y las copias con hash usen la versión final
+    fix_all_pngs(imagenes_dir)
+    
     # TERCERO: Agregar PNG overlays (PRIMERO anterior como base, LUEGO actual encima)
     # Período anterior con opacity 1.0 (100%) como capa base
     fg_anterior = add_png_overlays(
@@ -454,7 +648,9 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
         paramo=paramo,
         alert_grid_ids=alert_grid_ids,
         html_parent_path=html_parent,
-        opacity=1.0
+        opacity=1.0,
+        asset_mode=asset_mode,
+        asset_base_url=asset_base_url
     )
     # Período actual con opacity 0.75 (75%) encima del anterior
     fg_actual = add_png_overlays(
@@ -463,7 +659,9 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
         paramo=paramo,
         alert_grid_ids=alert_grid_ids,
         html_parent_path=html_parent,
-        opacity=1.0
+        opacity=1.0,
+        asset_mode=asset_mode,
+        asset_base_url=asset_base_url
     )
     
     # CUARTO: Agregar leyenda si es Dynamic World
@@ -471,7 +669,7 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
         add_dw_legend(m)
     
     # QUINTO: Agregar números de grillas (con remapeo para Altiplano)
-    add_grid_labels(m, grid_gdf, paramo=paramo)
+    add_grid_labels(m, grid_gdf, paramo=paramo, centroids=cell_centroids)
     
     # SEXTO: Si es altiplano, hacer zoom automático al polígono
     # SÉPTIMO: Aplicar fit_bounds FINAL para Altiplano (después de agregar todos los elementos)
@@ -488,14 +686,12 @@ def generar_mapa_png(paramo: str, periodo: str, tipo: str, grilla_path: Optional
     m.save(str(output_html))
     print(f"Mapa guardado en: {output_html}")
     
-    # OCTAVO: Procesar todos los PNGs (convertir a RGBA, hacer transparentes negros para DW)
-    mapas_parent = Path(output_html).parent
-    fix_all_pngs(mapas_parent)
-    
-    print("\nPara visualizar correctamente las imágenes, ejecuta en la raíz del proyecto:")
-    print("\n    python -m http.server\n")
-    print("Luego abre en tu navegador:")
-    print(f"    http://localhost:8000/{output_html.relative_to(BASE).as_posix()}\n")
+    # Con salida directa a GCS el HTML se genera en una carpeta temporal fuera del proyecto
+    if output_html.is_relative_to(BASE):
+        print("\nPara visualizar correctamente las imágenes, ejecuta en la raíz del proyecto:")
+        print("\n    python -m http.server\n")
+        print("Luego abre en tu navegador:")
+        print(f"    http://localhost:8000/{output_html.relative_to(BASE).as_posix()}\n")
     if len(grid_gdf) == 1:
         print(f"[INFO] El páramo {paramo} solo tiene una grilla. Verifica que la imagen PNG se haya generado correctamente.")
 
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import json, re
+from functools import lru_cache
 from pathlib import Path
+from src.reports.report_assets import resolve_assets
 
 SECTION_PAT = re.compile(r"{{#(\w+)}}(.*?){{/\1}}", re.DOTALL)
 TOKEN_PAT   = re.compile(r"{{\s*([\w\.]+)\s*}}")
@@ -35,37 +37,100 @@ def build_header(header_dict):
     </header>
     """
 
-def render(template_path: Path, data_path: Path, out_path: Path):
-    template = template_path.read_text(encoding="utf-8")
-    data = json.loads(data_path.read_text(encoding="utf-8"))
+def render(template_path: Path, data_path: Path, out_path, data: dict = None, store=None, asset_mode: str = "inline"):
+    """
+    Renderiza el reporte. Si se da data, no se relee el JSON desde data_path.
+    Con store (ver src/output_store.py), out_path es la clave del HTML dentro del store.
+    Las referencias asset:// (logos) se resuelven aquí según asset_mode (ver report_assets.py).
+    La plantilla se compila una sola vez por proceso y la salida se escribe por fragmentos.
+    """
+    nodes = load_template(Path(template_path))
+    if data is None:
+        data = json.loads(data_path.read_text(encoding="utf-8"))
+
+    data = resolve_assets(data, asset_mode, out_path=out_path, store=store)
 
     # Convierte el dict HEADER a HTML antes de renderizar
     data["HEADER"] = build_header(data.get("HEADER"))
 
-    # Renderiza tokens + secciones
-    html = render_template(template, data)
-
-    out_path.write_text(html, encoding="utf-8")
+    if store is not None:
+        with store.open(str(out_path)) as f:
+            f.writelines(iter_render(nodes, data))
+    else:
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.writelines(iter_render(nodes, data))
     return out_path
 
-def render_template(tpl: str, root: dict) -> str:
-    def _render_block(block: str, ctx: dict) -> str:
-        def _section(m):
-            key, inner = m.group(1), m.group(2)
-            arr = ctx.get(key, [])
+# === Plantillas compiladas ===
+# Una plantilla se compila a una lista de nodos:
+#   str                        -> texto literal
+#   (TOKEN, clave)             -> {{clave}}
+#   (SECTION, clave, [nodos])  -> {{#clave}}...{{/clave}}, repetido por cada elemento de la lista
+TOKEN, SECTION = 0, 1
+
+def _compile_text(text: str) -> list:
+    nodes, pos = [], 0
+    for m in TOKEN_PAT.finditer(text):
+        if m.start() > pos:
+            nodes.append(text[pos:m.start()])
+        nodes.append((TOKEN, m.group(1)))
+        pos = m.end()
+    if pos < len(text):
+        nodes.append(text[pos:])
+    return nodes
+
+def _compile_block(block: str) -> list:
+    nodes, pos = [], 0
+    for m in SECTION_PAT.finditer(block):
+        nodes.extend(_compile_text(block[pos:m.start()]))
+        nodes.append((SECTION, m.group(1), _compile_block(m.group(2))))
+        pos = m.end()
+    nodes.extend(_compile_text(block[pos:]))
+    return nodes
+
+@lru_cache(maxsize=32)
+def compile_template(tpl: str) -> tuple:
+    """Compila (una vez por contenido de plantilla) el árbol de nodos."""
+    return tuple(_compile_block(tpl))
+
+_FILE_CACHE = {}
+
+def load_template(template_path: Path) -> tuple:
+    """Lee y compila la plantilla; se vuelve a leer solo si cambia su mtime."""
+    mtime = template_path.stat().st_mtime_ns
+    cached = _FILE_CACHE.get(template_path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, compile_template(template_path.read_text(encoding="utf-8")))
+        _FILE_CACHE[template_path] = cached
+    return cached[1]
+
+_MISSING = object()
+
+def _lookup(scopes, key, default):
+    # scopes: contextos del más interno al más externo (cada elemento de sección sobre su padre)
+    for scope in scopes:
+        value = scope.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+    return default
+
+def _render_nodes(nodes, scopes):
+    for node in nodes:
+        if node.__class__ is str:
+            yield node
+        elif node[0] == TOKEN:
+            value = _lookup(scopes, node[1], "")
+            yield value if value.__class__ is str else str(value)
+        else:
+            arr = _lookup(scopes, node[1], [])
             if not isinstance(arr, list):
-                return ""
-            out = []
+                continue
             for item in arr:
-                local = {**ctx, **(item if isinstance(item, dict) else {".": item})}
-                out.append(_render_block(inner, local))
-            return "".join(out)
-
-        out = SECTION_PAT.sub(_section, block)
+                yield from _render_nodes(node[2], (item if isinstance(item, dict) else {".": item},) + scopes)
 
-        def _token(m):
-            k = m.group(1)
-            return str(ctx.get(k, root.get(k, "")))
-        return TOKEN_PAT.sub(_token, out)
+def iter_render(nodes, root: dict):
+    """Generador de los fragmentos del HTML (en orden) a partir de una plantilla compilada, sin concatenarlos."""
+    return _render_nodes(nodes, (root,))
 
-    return _render_block(tpl, root)
+def render_template(tpl: str, root: dict) -> str:
+    return "".join(iter_render(compile_template(tpl), root))
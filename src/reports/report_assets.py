@@ -0,0 +1,94 @@
+"""
+Referencias a imágenes estáticas (logos) en los datos del reporte.
+
+El JSON del reporte guarda solo referencias "asset://<id>" y un mapa ASSETS {id: ruta gs:// o local};
+las imágenes se resuelven al renderizar según el modo:
+  - "inline"   -> data URI en base64 (cacheado por proceso: cada logo se codifica una sola vez)
+  - "relative" -> copia con hash de contenido en assets/ junto al reporte, referenciada por ruta relativa
+  - "url"      -> URL pública de GCS del archivo original
+"""
+
+import hashlib
+import shutil
+from pathlib import Path
+
+ASSET_SCHEME = "asset://"
+REPORT_ASSET_MODES = ("inline", "relative", "url")
+ASSETS_DIRNAME = "assets"
+
+
+def asset_ref(asset_id):
+    """Referencia a guardar en los datos del reporte (ej: asset://header_img1)."""
+    return f"{ASSET_SCHEME}{asset_id}"
+
+
+def _local_source(source):
+    # Usa la caché local de insumos si el archivo ya se sincronizó desde GCS
+    from src.input_cache import resolve_input
+    return resolve_input(source)
+
+
+# source -> data URI. Solo se cachean las codificaciones exitosas: image_to_base64 devuelve "" si
+# falla, y un error transitorio no debe dejar el logo en blanco el resto del proceso
+_INLINE_CACHE = {}
+
+
+def _inline(source):
+    if source not in _INLINE_CACHE:
+        from src.gcs_utils import image_to_base64
+        data_uri = image_to_base64(_local_source(source))
+        if not data_uri:
+            return data_uri
+        _INLINE_CACHE[source] = data_uri
+    return _INLINE_CACHE[source]
+
+
+def _public_url(source):
+    if source.startswith(("http://", "https://")):
+        return source
+    if not source.startswith("gs://"):
+        raise ValueError(f"El modo 'url' requiere un asset en GCS: {source}")
+    from src.gcs_utils import get_public_url
+    bucket, _, name = source.replace("gs://", "", 1).partition("/")
+    return get_public_url(bucket, name)
+
+
+def _publish(asset_id, source, out_path, store):
+    local = Path(_local_source(source))
+    if not local.exists():
+        # Sin copia local (ej: sin caché de insumos) se incrusta como antes
+        return _inline(source)
+    digest = hashlib.sha256(local.read_bytes()).hexdigest()[:12]
+    key = f"{ASSETS_DIRNAME}/{asset_id}.{digest}{local.suffix}"
+    if store is not None:
+        store.put_file(local, key)
+    else:
+        target = Path(out_path).parent / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(local, target)
+    return key
+
+
+def resolve_assets(data, mode="inline", out_path=None, store=None):
+    """
+    Devuelve una copia de data con las referencias asset:// (en el primer nivel) reemplazadas.
+    Las referencias sin entrada en ASSETS quedan vacías.
+    """
+    if mode not in REPORT_ASSET_MODES:
+        raise ValueError(f"mode inválido: {mode}. Opciones: {REPORT_ASSET_MODES}")
+    assets = data.get("ASSETS") or {}
+    resolved = {}
+    for key, value in data.items():
+        if isinstance(value, str) and value.startswith(ASSET_SCHEME):
+            asset_id = value[len(ASSET_SCHEME):]
+            source = assets.get(asset_id)
+            if source is None:
+                value = ""
+            elif mode == "inline":
+                value = _inline(source)
+            elif mode == "url":
+                value = _public_url(source)
+            else:
+                value = _publish(asset_id, source, out_path, store)
+        resolved[key] = value
+    return resolved
@@ -0,0 +1,118 @@
+"""
+Reintentos y circuit breakers compartidos para Earth Engine y Cloud Storage.
+
+- Los errores se clasifican en transitorios (cuotas, 429/5xx, timeouts, conexión) y permanentes
+  (geometría inválida, permisos, objeto inexistente...). Solo los transitorios se reintentan, con
+  backoff exponencial y jitter.
+- Un circuit breaker por backend ("ee", "gcs") se abre tras BREAKER_FAILURE_THRESHOLD fallos
+  transitorios seguidos: la etapa se pausa BREAKER_COOLDOWN_S segundos en lugar de seguir golpeando
+  el servicio, y luego se deja pasar una llamada de prueba.
+"""
+
+import random
+import re
+import threading
+import time
+
+from src.aux_utils import log
+from src.config import RETRY_ATTEMPTS, RETRY_BASE_DELAY_S, RETRY_MAX_DELAY_S, BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_S
+
+# Excepciones transitorias por nombre de clase (google.api_core, requests, urllib3, http.client, builtins)
+TRANSIENT_ERRORS = {
+    "ServiceUnavailable", "TooManyRequests", "InternalServerError", "GatewayTimeout", "BadGateway",
+    "DeadlineExceeded", "RetryError", "ConnectionError", "ConnectTimeout", "ReadTimeout", "Timeout",
+    "ChunkedEncodingError", "ProtocolError", "IncompleteRead", "RemoteDisconnected", "TimeoutError",
+    "ConnectionResetError", "ConnectionAbortedError", "BrokenPipeError",
+}
+# Frases de cuota y concurrencia de Earth Engine (ee.EEException no distingue por tipo)
+TRANSIENT_MESSAGES = (
+    "too many concurrent aggregations", "too many concurrent requests", "too many requests",
+    "rate limit exceeded", "quota exceeded",
+)
+# Códigos HTTP transitorios citados en el mensaje (palabra completa: no "5000 elements")
+TRANSIENT_STATUS = re.compile(r"\b(429|5\d\d)\b")
+
+
+def _status_code(exc):
+    """Código HTTP de la excepción si lo expone (google.api_core: exc.code, requests: exc.response.status_code)."""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_transient(exc):
+    """True si vale la pena reintentar la llamada que lanzó exc."""
+    if any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__):
+        return True
+    code = _status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    message = str(exc).lower()
+    return any(phrase in message for phrase in TRANSIENT_MESSAGES) or bool(TRANSIENT_STATUS.search(message))
+
+
+def backoff_delay(attempt):
+    """Espera (s) antes del reintento attempt (0, 1, ...): exponencial con jitter completo."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_S, RETRY_BASE_DELAY_S * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, name, threshold=None, cooldown=None):
+        self.name = name
+        self.threshold = threshold or BREAKER_FAILURE_THRESHOLD
+        self.cooldown = cooldown or BREAKER_COOLDOWN_S
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Si el circuito está abierto, pausa hasta que termine el enfriamiento (luego pasa una llamada de prueba)."""
+        with self._lock:
+            remaining = self.cooldown - (time.monotonic() - self.opened_at) if self.opened_at is not None else 0
+        if remaining > 0:
+            log(f"⏸️ {self.name}: circuito abierto tras {self.failures} fallos, pausa de {remaining:.0f}s", "warning")
+            time.sleep(remaining)
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log(f"▶️ {self.name}: circuito cerrado", "info")
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+BREAKERS = {"ee": CircuitBreaker("Earth Engine"), "gcs": CircuitBreaker("Cloud Storage")}
+
+
+def call_with_retry(fn, *args, backend="ee", retries=None, label=None, **kwargs):
+    """
+    fn(*args, **kwargs) con reintentos de errores transitorios y el circuit breaker del backend.
+    Los errores permanentes se propagan de inmediato.
+    """
+    breaker = BREAKERS[backend]
+    retries = RETRY_ATTEMPTS if retries is None else retries
+    for attempt in range(retries + 1):
+        breaker.wait()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            breaker.failure()
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            log(f"↻ {label or getattr(fn, '__name__', 'llamada')}: error transitorio ({type(e).__name__}), reintento {attempt + 1}/{retries} en {delay:.1f}s", "warning")
+            time.sleep(delay)
+        else:
+            breaker.success()
+            return result
@@ -0,0 +1,202 @@
+"""
+Índice local de escenas (Dynamic World y Sentinel-2) por AOI.
+
+Cada índice guarda, para las escenas que intersectan los bounds del AOI, su ID (system:index),
+fecha de adquisición, huella (footprint) y porcentaje de nubes. Se persiste en SCENE_INDEX_DIR y se
+actualiza de forma incremental: solo se consultan en Earth Engine las fechas fuera del rango ya
+indexado (marcas de agua baja y alta), re-consultando los últimos SCENE_INDEX_OVERLAP_DAYS para
+incluir escenas ingeridas con retraso.
+
+Con el índice, preguntas de disponibilidad ("¿cuántas escenas S2 con <30% de nubes hay para la
+grilla 7 en la ventana?") se responden localmente y los mosaicos se construyen con listas explícitas
+de escenas (además de filterDate/filterBounds, ver scene_collection).
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import ee
+from shapely.geometry import shape
+
+from src.aux_utils import log
+from src.ee_accounting import get_info
+from src.resilience import call_with_retry
+from src.config import SCENE_INDEX_DIR, SCENE_INDEX_OVERLAP_DAYS, SCENE_INDEX_CHUNK_DAYS
+
+DW_COLLECTION = "GOOGLE/DYNAMICWORLD/V1"
+S2_COLLECTION = "COPERNICUS/S2_SR_HARMONIZED"
+S2_CLOUD_PROPERTY = "CLOUDY_PIXEL_PERCENTAGE"
+
+_DAY_MS = 24 * 3600 * 1000
+
+
+def date_to_ms(date_str):
+    """'YYYY-MM-DD' (UTC) -> milisegundos desde epoch, como ee.Date."""
+    return int(datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def window_ms(end_date, lookback_days, extra_days=0):
+    """[end_date - lookback_days, end_date + extra_days) en milisegundos."""
+    end = date_to_ms(end_date)
+    return end - lookback_days * _DAY_MS, end + extra_days * _DAY_MS
+
+
+class SceneIndex:
+    """Índice de escenas de una colección para los bounds de un AOI."""
+
+    def __init__(self, collection, aoi_name, bounds, cloud_property=None, cache_dir=None):
+        self.collection = collection
+        self.aoi_name = aoi_name
+        self.bounds = tuple(bounds)
+        self.cloud_property = cloud_property
+        self.path = Path(cache_dir or SCENE_INDEX_DIR) / aoi_name / f"{collection.replace('/', '_')}.json"
+        self.low_ms = self.high_ms = None
+        self.scenes_by_id = {}
+        self._footprints = {}
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            if tuple(data.get("bounds", ())) != self.bounds:
+                log(f"Índice de escenas {self.path.name} ({self.aoi_name}): bounds distintos, se reconstruye", "warning")
+                return
+            self.low_ms, self.high_ms = data["low_ms"], data["high_ms"]
+            self.scenes_by_id = {s["id"]: s for s in data["scenes"]}
+        except Exception as e:
+            log(f"⚠️ Índice de escenas ilegible ({self.path}), se reconstruye: {e}", "warning")
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "collection": self.collection,
+            "aoi": self.aoi_name,
+            "bounds": list(self.bounds),
+            "low_ms": self.low_ms,
+            "high_ms": self.high_ms,
+            "scenes": sorted(self.scenes_by_id.values(), key=lambda s: (s["time"], s["id"])),
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def _fetch(self, start_ms, end_ms):
+        """Consulta en Earth Engine las escenas de [start_ms, end_ms), en ventanas de SCENE_INDEX_CHUNK_DAYS."""
+        region = ee.Geometry.BBox(*self.bounds)
+        cloud_property = self.cloud_property
+        n_new = 0
+        for chunk_start in range(start_ms, end_ms, SCENE_INDEX_CHUNK_DAYS * _DAY_MS):
+            chunk_end = min(chunk_start + SCENE_INDEX_CHUNK_DAYS * _DAY_MS, end_ms)
+            col = ee.ImageCollection(self.collection).filterBounds(region).filterDate(chunk_start, chunk_end)
+
+            def _to_feature(img):
+                props = {"id": img.get("system:index"), "time": img.get("system:time_start")}
+                if cloud_property:
+                    props["cloud"] = img.get(cloud_property)
+                return ee.Feature(img.geometry(), props)
+
+            for feature in call_with_retry(get_info, col.map(_to_feature), "indice_escenas", label=f"índice {self.collection}").get("features", []):
+                props = feature["properties"]
+                if props["id"] not in self.scenes_by_id:
+                    n_new += 1
+                self.scenes_by_id[props["id"]] = {
+                    "id": props["id"],
+                    "time": props["time"],
+                    "cloud": props.get("cloud"),
+                    "footprint": feature["geometry"],
+                }
+        return n_new
+
+    def ensure(self, start_ms, end_ms):
+        """Garantiza que el índice cubra [start_ms, end_ms); solo consulta los rangos faltantes."""
+        if self.low_ms is None:
+            ranges = [(start_ms, end_ms)]
+        else:
+            ranges = []
+            if start_ms < self.low_ms:
+                ranges.append((start_ms, self.low_ms))
+            if end_ms > self.high_ms - SCENE_INDEX_OVERLAP_DAYS * _DAY_MS:
+                ranges.append((max(self.high_ms - SCENE_INDEX_OVERLAP_DAYS * _DAY_MS, start_ms), end_ms))
+        if not ranges:
+            return 0
+        n_new = sum(self._fetch(s, e) for s, e in ranges if e > s)
+        self.low_ms = min(start_ms, self.low_ms) if self.low_ms is not None else start_ms
+        self.high_ms = max(end_ms, self.high_ms) if self.high_ms is not None else end_ms
+        self.save()
+        log(f"🛰 Índice {self.collection} ({self.aoi_name}): {n_new} escenas nuevas, {len(self.scenes_by_id)} en total", "info")
+        return n_new
+
+    def footprint(self, scene):
+        """Huella shapely (EPSG:4326) de una escena del índice."""
+        fp = self._footprints.get(scene["id"])
+        if fp is None:
+            fp = self._footprints[scene["id"]] = shape(scene["footprint"])
+        return fp
+
+    def scenes(self, start_ms, end_ms, geometry=None, max_cloud=None):
+        """
+        Escenas con start_ms <= fecha < end_ms (consultando EE solo si faltan fechas en el índice).
+
+        Args:
+            geometry: geometría shapely (EPSG:4326); solo escenas cuya huella la intersecta
+            max_cloud: porcentaje de nubes estrictamente menor a este valor
+        """
+        self.ensure(start_ms, end_ms)
+        out = []
+        for scene in self.scenes_by_id.values():
+            if not start_ms <= scene["time"] < end_ms:
+                continue
+            if max_cloud is not None and (scene["cloud"] is None or scene["cloud"] >= max_cloud):
+                continue
+            if geometry is not None and not self.footprint(scene).intersects(geometry):
+                continue
+            out.append(scene)
+        return sorted(out, key=lambda s: (s["time"], s["id"]))
+
+    def ids(self, start_ms, end_ms, geometry=None, max_cloud=None):
+        return [s["id"] for s in self.scenes(start_ms, end_ms, geometry, max_cloud)]
+
+    def count(self, start_ms, end_ms, geometry=None, max_cloud=None):
+        return len(self.scenes(start_ms, end_ms, geometry, max_cloud))
+
+
+# Índices abiertos en la ejecución actual: (colección, aoi_name) -> SceneIndex
+_INDEXES = {}
+
+
+def get_scene_index(collection, aoi_data):
+    """SceneIndex de la colección para un AOIData (uno por proceso)."""
+    key = (collection, aoi_data.name)
+    if key not in _INDEXES:
+        cloud_property = S2_CLOUD_PROPERTY if collection == S2_COLLECTION else None
+        _INDEXES[key] = SceneIndex(collection, aoi_data.name, aoi_data.bounds, cloud_property=cloud_property)
+    return _INDEXES[key]
+
+
+def window_scene_ids(collection, aois, end_date, lookback_days, max_cloud=None):
+    """IDs de las escenas de la ventana [end_date - lookback_days, end_date), unión sobre los AOIs."""
+    start_ms, end_ms = window_ms(end_date, lookback_days)
+    ids = set()
+    for aoi in aois:
+        ids.update(get_scene_index(collection, aoi).ids(start_ms, end_ms, max_cloud=max_cloud))
+    return sorted(ids)
+
+
+def scene_collection(collection, scene_ids, start, end, region):
+    """
+    ee.ImageCollection con una lista explícita de escenas.
+
+    filterDate(start, end) y filterBounds(region) se aplican antes que inList: usan los índices de
+    la colección, por lo que inList solo recorre las escenas de la ventana y nunca cuesta más que la
+    consulta sin lista.
+    """
+    return (
+        ee.ImageCollection(collection)
+        .filterDate(start, end)
+        .filterBounds(region)
+        .filter(ee.Filter.inList("system:index", list(scene_ids)))
+    )
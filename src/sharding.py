@@ -0,0 +1,107 @@
+"""
+Ejecución por fragmentos (shards) de los páramos en varias tareas de Cloud Run Jobs.
+
+Cada tarea (CLOUD_RUN_TASK_INDEX / CLOUD_RUN_TASK_COUNT, o --tarea / --tareas) toma un subconjunto
+determinista de AOIs balanceado por costo estimado, los procesa y escribe sus resultados parciales
+en parciales/ dentro del store del periodo. La fusión arma el JSON y el HTML del reporte cuando
+están los parciales de todas las tareas (la última tarea en terminar la hace; también con --fusionar).
+
+Localmente se prueba lanzando N procesos con distintos --tarea y el mismo --tareas.
+"""
+
+import json
+import os
+
+import geopandas as gpd
+
+from src.aux_utils import log, save_json
+from src.config import GRID_SIZE
+
+PARTIALS_DIR = "parciales"
+
+
+def resolve_task(task_index=None, task_count=None):
+    """(índice, total) de la tarea: argumentos CLI o variables de entorno de Cloud Run. Por defecto (0, 1)."""
+    if task_index is None:
+        task_index = int(os.environ.get("CLOUD_RUN_TASK_INDEX", 0))
+    if task_count is None:
+        task_count = int(os.environ.get("CLOUD_RUN_TASK_COUNT", 1))
+    if task_count < 1 or not 0 <= task_index < task_count:
+        raise ValueError(f"Tarea inválida: índice {task_index} de {task_count}")
+    return task_index, task_count
+
+
+def execution_id(explicit=None, task_count=1):
+    """
+    Identificador de la ejecución (--ejecucion o CLOUD_RUN_EXECUTION), para ignorar parciales de otras
+    ejecuciones. Obligatorio con varias tareas: sin él, una tarea podría fusionar parciales viejos.
+    """
+    run_id = explicit or os.environ.get("CLOUD_RUN_EXECUTION")
+    if task_count > 1 and not run_id:
+        raise ValueError("Con varias tareas se requiere un identificador de ejecución (--ejecucion o CLOUD_RUN_EXECUTION)")
+    return run_id
+
+
+def estimate_aoi_cost(aoi_path):
+    """Costo aproximado de un AOI: número de celdas de GRID_SIZE que cubre su área."""
+    gdf = gpd.read_file(aoi_path).to_crs(epsg=3857)
+    return 1 + float(gdf.geometry.area.sum()) / GRID_SIZE ** 2
+
+
+def assign_shards(aoi_paths, task_count, cost_fn=None):
+    """
+    Reparte los AOIs en task_count fragmentos balanceados: de mayor a menor costo, cada AOI va al
+    fragmento con menor costo acumulado. Determinista para la misma lista y los mismos costos.
+
+    Returns:
+        lista de task_count listas de rutas (cada una en el orden de aoi_paths)
+    """
+    cost_fn = cost_fn or estimate_aoi_cost
+    costs = {}
+    for path in aoi_paths:
+        try:
+            costs[path] = cost_fn(path)
+        except Exception as e:
+            log(f"⚠️ No se pudo estimar el costo de {path}, se usa 1: {e}", "warning")
+            costs[path] = 1.0
+
+    loads = [0.0] * task_count
+    assigned = [set() for _ in range(task_count)]
+    for path in sorted(aoi_paths, key=lambda p: (-costs[p], os.path.basename(p))):
+        shard = min(range(task_count), key=lambda i: (loads[i], i))
+        loads[shard] += costs[path]
+        assigned[shard].add(path)
+    return [[p for p in aoi_paths if p in shard] for shard in assigned]
+
+
+def partial_key(task_index, task_count):
+    return f"{PARTIALS_DIR}/tarea_{task_index:03d}_de_{task_count:03d}.json"
+
+
+def write_partial(store, task_index, task_count, results, execution=None):
+    """Resultados de una tarea: [{"aoi": nombre, "result": dict de process_aoi, "costo": tiempos}, ...]."""
+    save_json({
+        "tarea": task_index,
+        "tareas": task_count,
+        "ejecucion": execution,
+        "resultados": results,
+    }, partial_key(task_index, task_count), store=store)
+
+
+def load_partials(store, task_count, execution=None):
+    """
+    Lee los parciales de todas las tareas.
+
+    Returns:
+        (entradas {"aoi", "result", ...} ordenadas por nombre de AOI, lista de índices de tareas faltantes)
+    """
+    entries, missing = [], []
+    for task_index in range(task_count):
+        text = store.read_text(partial_key(task_index, task_count))
+        partial = json.loads(text) if text else None
+        if partial is None or partial.get("ejecucion") != execution:
+            missing.append(task_index)
+            continue
+        entries += partial["resultados"]
+    entries.sort(key=lambda e: e["aoi"])
+    return entries, missing
@@ -0,0 +1,134 @@
+"""
+Índices espectrales de Sentinel-2 por celda: NDVI, NBR y NDMI en t1 y t2.
+
+Por AOI (o unión de AOIs) y periodo se arma un solo compuesto S2 con máscara de nubes (SCL) en la
+misma ventana que el mosaico DW. Las bandas de índices se reducen con media, mediana y percentiles
+10/90 encadenando un segundo reduceRegions sobre la colección de cada lote de reduce_cells: los
+conteos DW y las estadísticas espectrales llegan en la misma solicitud.
+
+A diferencia de los conteos DW, estas estadísticas no son aditivas: no se suman en las grillas
+anidadas ni se escalan en el screening (ver is_spectral).
+"""
+
+import ee
+import geopandas as gpd
+import pandas as pd
+
+from src.aux_utils import log
+from src.aoi_registry import AOIData
+from src.scene_index import S2_COLLECTION, S2_CLOUD_PROPERTY, scene_collection, window_scene_ids
+from src.config import (
+    LOOKBACK_DAYS, SCENE_INDEX_ENABLED, SPECTRAL_INDICES_ENABLED, SPECTRAL_MAX_CLOUD, SPECTRAL_MASK_SCL,
+)
+
+# Índice -> (banda NIR, banda de referencia) de la diferencia normalizada
+SPECTRAL_INDICES = {"ndvi": ("B8", "B4"), "nbr": ("B8", "B12"), "ndmi": ("B8", "B11")}
+SPECTRAL_STATS = ("mean", "median", "p10", "p90")
+# Estadísticas con delta t2 - t1 en la tabla
+DELTA_STATS = ("mean", "median")
+
+_S2_BANDS = ["B4", "B8", "B11", "B12"]
+
+
+def spectral_columns():
+    """Columnas <índice>_<periodo>_<estadística> que devuelve la reducción."""
+    return [f"{idx}_{period}_{stat}" for idx in SPECTRAL_INDICES for period in ("t1", "t2") for stat in SPECTRAL_STATS]
+
+
+def is_spectral(band):
+    """True para las propiedades de estadísticas espectrales (no aditivas)."""
+    return band.split("_", 1)[0] in SPECTRAL_INDICES
+
+
+def s2_scene_ids(aois, end_date, lookback_days=LOOKBACK_DAYS):
+    """Escenas S2 con menos de SPECTRAL_MAX_CLOUD % de nubes según el índice local (None si no está disponible)."""
+    if not SCENE_INDEX_ENABLED:
+        return None
+    try:
+        return window_scene_ids(S2_COLLECTION, aois, end_date, lookback_days, max_cloud=SPECTRAL_MAX_CLOUD)
+    except Exception as e:
+        log(f"⚠️ Índice de escenas S2 no disponible, se filtra la colección en Earth Engine: {e}", "warning")
+        return None
+
+
+def _mask_clouds(img):
+    scl = img.select("SCL")
+    clear = scl.remap(SPECTRAL_MASK_SCL, [0] * len(SPECTRAL_MASK_SCL), 1)
+    return img.updateMask(clear).select(_S2_BANDS).toFloat()
+
+
+def s2_composite(aoi, end_date, lookback_days=LOOKBACK_DAYS, scene_ids=None):
+    """
+    Mediana S2 (B4, B8, B11, B12) con máscara SCL de la ventana [end_date - lookback_days, end_date).
+
+    aoi: AOIData del registro, bounds (minx, miny, maxx, maxy) o ruta al GeoJSON
+    scene_ids: escenas S2 explícitas. Si es None y aoi es AOIData, se toman del índice local
+    """
+    if isinstance(aoi, tuple):
+        minx, miny, maxx, maxy = aoi
+    elif isinstance(aoi, AOIData):
+        minx, miny, maxx, maxy = aoi.bounds
+        if scene_ids is None:
+            scene_ids = s2_scene_ids([aoi], end_date, lookback_days)
+    else:
+        minx, miny, maxx, maxy = gpd.read_file(aoi).total_bounds
+    bbox = ee.Geometry.BBox(minx, miny, maxx, maxy)
+
+    start, end = ee.Date(end_date).advance(-lookback_days, "day"), ee.Date(end_date)
+    if scene_ids is not None:
+        collection = scene_collection(S2_COLLECTION, scene_ids, start, end, bbox)
+    else:
+        collection = (
+            ee.ImageCollection(S2_COLLECTION)
+            .filterDate(start, end)
+            .filterBounds(bbox)
+            .filter(ee.Filter.lt(S2_CLOUD_PROPERTY, SPECTRAL_MAX_CLOUD))
+        )
+    # Imagen enmascarada con las bandas esperadas: sin escenas, el compuesto queda vacío (estadísticas
+    # nulas) en lugar de hacer fallar la reducción de los conteos DW del mismo lote
+    empty = ee.Image.constant([0] * len(_S2_BANDS)).rename(_S2_BANDS).toFloat().updateMask(0)
+    composite = collection.map(_mask_clouds).merge(ee.ImageCollection([empty])).median()
+    return composite.clip(bbox)
+
+
+def index_image(s2_before, s2_current):
+    """Bandas <índice>_t1 y <índice>_t2 (diferencias normalizadas) de los dos compuestos."""
+    bands = []
+    for period, img in (("t1", s2_before), ("t2", s2_current)):
+        for name, (nir, ref) in SPECTRAL_INDICES.items():
+            bands.append(img.normalizedDifference([nir, ref]).rename(f"{name}_{period}"))
+    return ee.Image.cat(bands)
+
+
+def spectral_image(aoi, date_before, current_date, lookback_days=LOOKBACK_DAYS, scene_ids=(None, None)):
+    """Imagen de índices de ambos periodos para reduce_cells (None si SPECTRAL_INDICES_ENABLED es False)."""
+    if not SPECTRAL_INDICES_ENABLED:
+        return None
+    return index_image(
+        s2_composite(aoi, date_before, lookback_days, scene_ids=scene_ids[0]),
+        s2_composite(aoi, current_date, lookback_days, scene_ids=scene_ids[1]),
+    )
+
+
+def index_reducer():
+    """Media, mediana y p10/p90 con salidas <banda>_mean, <banda>_median, <banda>_p10, <banda>_p90."""
+    return (
+        ee.Reducer.mean()
+        .combine(ee.Reducer.median(), sharedInputs=True)
+        .combine(ee.Reducer.percentile([10, 90]), sharedInputs=True)
+    )
+
+
+def spectral_from_counts(counts, grid_ids):
+    """DataFrame de estadísticas espectrales por celda y sus deltas (t2 - t1); NaN sin píxeles válidos."""
+    columns = spectral_columns()
+    rows = []
+    for grid_id in grid_ids:
+        stats = counts.get(grid_id) or {}
+        rows.append({"grid_id": grid_id, **{col: stats.get(col) for col in columns}})
+    df = pd.DataFrame(rows, columns=["grid_id"] + columns)
+    df[columns] = df[columns].astype(float).round(4)
+    for idx in SPECTRAL_INDICES:
+        for stat in DELTA_STATS:
+            df[f"delta_{idx}_{stat}"] = df[f"{idx}_t2_{stat}"] - df[f"{idx}_t1_{stat}"]
+    return df